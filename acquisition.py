@@ -0,0 +1,245 @@
+#Acquisition from several boards at once: one reader thread per serial port and a merger that lines their samples up in time.
+#Every board sends its own channels (the first board X, Y, Z, a second one for example deflection, amplitude and phase). Each reader
+#reads whatever the port has in one go, stamps the block once with time.monotonic_ns() and spreads the samples evenly over the time
+#since the previous read (see spread), so timestamps cost one clock call per block and never jump with the wall clock. The samples go
+#in the reader's own ring buffer (see ringbuffer.py), so a slow or stalled board never holds up the others. The merger takes the samples of the primary board (the one with X and Y, which decides where a sample goes on
+#the map) and gives each one the latest value of every other board's channels at that time ("as of" join), and puts the combined
+#samples in the output ring the map and the session writer read from.
+#A primary sample is only merged once every other board has sent something at least as new, so all channels come from the same
+#moment. A board that sent nothing for max_wait s is not waited for, its last values are used until it comes back.
+
+import time
+import threading
+import numpy as np
+from ringbuffer import SampleRingBuffer
+from serialprotocol import BinaryFrameDecoder
+
+
+CHANNEL_MAX = np.iinfo(np.uint16).max #Largest value a channel column holds.
+
+
+def source_fields(channels):
+    return tuple((name, np.uint16) for name in channels) + (("timestamp", np.int64),)
+
+
+def open_port(source, simulate=None):
+    #Serial port of a board (an entry of SOURCES in gamepad_2_7.py). simulate is a dict with the arguments of
+    #simulator.SimulatedSerial (source, rate), for running without the hardware.
+    if simulate is not None:
+        from simulator import SimulatedSerial
+        return SimulatedSerial(simulate["source"], rate=simulate["rate"], mode=source["mode"], timeout=0.01)
+    import serial
+    return serial.Serial(source["port"], source["baudrate"], timeout=0.01)
+
+
+def spread(start, end, n):
+    #n int64 timestamps evenly spaced over (start, end] ns, the last one at end: the samples of a block arrived after the previous read.
+    return end - ((end - start)*np.arange(n - 1, -1, -1, dtype=np.int64))//n
+
+
+def clock_anchor():
+    #The same instant on the monotonic clock (which the readers use), in UTC and as local time, all in ns. Stored once per session,
+    #it turns the monotonic timestamps into wall clock time (see StreamMerger's clock_offset_ns).
+    monotonic = time.monotonic_ns()
+    utc = time.time_ns()
+    return {"monotonic_ns": monotonic, "utc_ns": utc, "utc_offset_s": time.localtime(utc/1e9).tm_gmtoff}
+
+
+def local_time_offset(anchor):
+    #ns to add to a monotonic timestamp to get local time, like datetime.now() gives.
+    return anchor["utc_ns"] - anchor["monotonic_ns"] + anchor["utc_offset_s"]*1000000000
+
+
+class SourceReader(threading.Thread):
+    #Reads one board. mode "ascii" expects one line of comma separated integers per sample, one per channel. mode "binary" expects the
+    #frames of serialprotocol.py, which carry exactly three channels.
+    def __init__(self, name, port, channels=("X", "Y", "Z"), mode="ascii", capacity=1 << 18, metrics=None):
+        super().__init__(name=f"read_{name}", daemon=True)
+        if mode == "binary" and len(channels) != 3:
+            raise ValueError(f"{name}: binary frames carry 3 channels, not {len(channels)}")
+        self.source = name
+        self.port = port
+        self.channels = tuple(channels)
+        self.mode = mode
+        self.ring = SampleRingBuffer(capacity, source_fields(self.channels))
+        self.merge_reader = self.ring.add_reader("merge")
+        self.samples = 0
+        self.parse_errors = 0 #Bad lines, or dropped and corrupt frames
+        self.stopped = False
+        self.last_read = time.monotonic_ns() #End of the previous read, the samples of the next block arrived after it.
+        self.pending = b"" #Start of a line that was not complete yet.
+        if metrics is not None:
+            metrics.gauge("serial_lines_total", lambda: self.samples, source=name)
+            metrics.gauge("serial_parse_errors_total", lambda: self.parse_errors, source=name)
+            metrics.gauge("source_backlog", self.merge_reader.available, source=name)
+            metrics.gauge("source_overruns_total", lambda: self.merge_reader.overruns, source=name)
+
+    def parse_error(self, message, count=1):
+        # Only the first few are printed so a noisy line does not flood the console, the Stats panel shows the count.
+        self.parse_errors += count
+        if self.parse_errors <= 10:
+            print(f"{self.source}: {message}")
+        if self.parse_errors >= 10 and self.parse_errors - count < 10:
+            print(f"{self.source}: further parse errors are only counted, see the Stats panel")
+
+    def run(self):
+        self.last_read = time.monotonic_ns()
+        if self.mode == "binary":
+            self.run_binary()
+        else:
+            self.run_ascii()
+
+    def run_ascii(self):
+        while not self.stopped:
+            self.read_ascii()
+
+    def read_ascii(self):
+        #Reads what the port has (at least one byte, or nothing after its timeout) and adds the complete lines. Returns the number of samples.
+        data = self.port.read(max(1, getattr(self.port, "in_waiting", 65536))) # Files (replays, benchmark) have no in_waiting.
+        now = time.monotonic_ns()
+        if not data:
+            self.last_read = now
+            return 0
+        lines = (self.pending + data).split(b"\n")
+        self.pending = lines.pop()
+        rows = []
+        channels = len(self.channels)
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                result = tuple(map(int, line.split(b",")))
+            except ValueError as e:
+                self.parse_error(f"Error parsing data: {line.decode(errors='replace')} -> {e}")
+                continue
+            # Ensure correct data length
+            if len(result) != channels:
+                self.parse_error(f"Warning: Unexpected data format: {line.decode(errors='replace')}")
+                continue
+            # A value the uint16 columns cannot hold would wrap around silently, so a noisy line like that is a bad line too.
+            if min(result) < 0 or max(result) > CHANNEL_MAX:
+                self.parse_error(f"Warning: Value out of range: {line.decode(errors='replace')}")
+                continue
+            rows.append(result)
+        if rows:
+            values = np.array(rows, dtype=np.int64)
+            self.ring.extend(*values.T, spread(self.last_read, now, len(rows)))
+            self.samples += len(rows)
+        self.last_read = now
+        return len(rows)
+
+    def run_binary(self):
+        #Whole blocks of binary frames are decoded at once.
+        decoder = BinaryFrameDecoder()
+        reported = 0
+        while not self.stopped:
+            x, y, z = decoder.read_from(self.port)
+            now = time.monotonic_ns()
+            if len(x):
+                self.ring.extend(x, y, z, spread(self.last_read, now, len(x)))
+                self.samples += len(x)
+            self.last_read = now
+            lost = decoder.dropped_frames + decoder.corrupt_frames
+            if lost > reported:
+                self.parse_error(f"Warning: {decoder.dropped_frames} frames dropped, {decoder.corrupt_frames} corrupt frames so far", lost - reported)
+                reported = lost
+
+    def stop(self):
+        self.stopped = True
+
+
+class StreamMerger(threading.Thread):
+    #Merges the sources into ring (made with merged_fields), the first source is the primary one. Timestamps in the output are
+    #monotonic ns plus clock_offset_ns, e.g. to store them as wall clock time. on_merged() is called after every merged block.
+    def __init__(self, sources, ring, clock_offset_ns=0, max_wait=0.05, poll=0.001, on_merged=None, metrics=None):
+        super().__init__(name="merge", daemon=True)
+        self.primary = sources[0]
+        self.others = list(sources[1:])
+        self.ring = ring
+        self.clock_offset_ns = clock_offset_ns
+        self.max_wait_ns = int(max_wait*1e9)
+        self.poll = poll
+        self.on_merged = on_merged
+        self.waiting = None #Primary samples not merged yet, dict of arrays
+        self.pending = {source.source: None for source in self.others} #Samples of the other sources, the first one is the "as of" value
+        self.last_arrival = {source.source: time.monotonic_ns() for source in self.others}
+        self.merged = 0
+        self.stale = 0 #Primary samples merged with the last values of a source that went quiet.
+        self.stopped = False
+        self.lag = metrics.histogram("merge_lag_seconds") if metrics is not None else None #Time from reading to merging.
+        if metrics is not None:
+            metrics.gauge("merged_samples_total", lambda: self.merged)
+            metrics.gauge("merged_stale_samples_total", lambda: self.stale)
+
+    @staticmethod
+    def merged_fields(sources):
+        channels = [name for source in sources for name in source.channels]
+        if len(set(channels)) != len(channels):
+            raise ValueError(f"Channel names must be unique: {channels}")
+        return source_fields(channels)
+
+    def run(self):
+        while not self.stopped:
+            if self.merge() == 0:
+                time.sleep(self.poll)
+            elif self.on_merged is not None:
+                self.on_merged()
+
+    def merge(self):
+        #Merges everything that can be merged now, returns the number of samples added to the ring.
+        now = time.monotonic_ns()
+        self.waiting = append(self.waiting, self.primary.merge_reader.drain())
+        for source in self.others:
+            new = source.merge_reader.drain()
+            if len(new["timestamp"]):
+                self.pending[source.source] = append(self.pending[source.source], new)
+                self.last_arrival[source.source] = now
+        if self.waiting is None or len(self.waiting["timestamp"]) == 0:
+            return 0
+
+        t = self.waiting["timestamp"]
+        ready = len(t)
+        stale = False
+        for source in self.others:
+            pending = self.pending[source.source]
+            if now - self.last_arrival[source.source] > self.max_wait_ns:
+                stale = True #Quiet source, go on with its last values.
+                continue
+            newest = pending["timestamp"][-1] if pending is not None and len(pending["timestamp"]) else None
+            ready = min(ready, 0 if newest is None else int(np.searchsorted(t, newest, side="right")))
+        if ready == 0:
+            return 0
+
+        columns = [self.waiting[name][:ready] for name in self.primary.channels]
+        for source in self.others:
+            pending = self.pending[source.source]
+            if pending is None or len(pending["timestamp"]) == 0:
+                columns.extend(np.zeros(ready, dtype=np.uint16) for _ in source.channels)
+                continue
+            #Latest sample at or before each primary sample. Only right after the start a primary sample can be older than all of
+            #them, it then gets the first one.
+            index = np.maximum(np.searchsorted(pending["timestamp"], t[:ready], side="right") - 1, 0)
+            columns.extend(pending[name][index] for name in source.channels)
+            keep = int(index[-1]) #Stays as the "as of" value of the next primary samples.
+            self.pending[source.source] = {name: column[keep:] for name, column in pending.items()}
+        self.ring.extend(*columns, t[:ready] + self.clock_offset_ns)
+        if self.lag is not None:
+            self.lag.observe((now - int(t[ready - 1]))/1e9)
+        self.waiting = {name: column[ready:] for name, column in self.waiting.items()}
+        self.merged += ready
+        if stale:
+            self.stale += ready
+        return ready
+
+    def stop(self):
+        self.stopped = True
+
+
+def append(batch, new):
+    #Concatenates two dicts of columns (batch may be None).
+    if batch is None or len(batch["timestamp"]) == 0:
+        return new
+    if len(new["timestamp"]) == 0:
+        return batch
+    return {name: np.concatenate((column, new[name])) for name, column in batch.items()}
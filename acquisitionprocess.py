@@ -0,0 +1,343 @@
+#Acquisition in its own process, started with --acquisition-process.
+#The readers, the merger, the binning, the session writer and the checkpoints (acquisition.py, binning.py, sessionfile.py,
+#checkpoint.py) run in a separate Python process, so they do not compete for the GIL with the Qt event loop, the gamepad timer and
+#matplotlib. The map lives in shared memory (multiprocessing.shared_memory): the acquisition process adds to it and the GUI process only
+#maps the same arrays and draws them. The per-tile sequence numbers of the binner (see binning.py) tell the GUI which tiles changed and
+#which copies are torn, so neither process ever locks the other.
+#The raw samples stay in the acquisition process, which writes the session file. The GUI talks to it through two queues: commands
+#("open" a new or resumed session file, "stop") and events (connected, session opened, errors, and a metrics snapshot every second,
+#which the GUI imports into its own Metrics so the Stats panel and the exporters show the acquisition as before).
+
+import sys
+import time
+import types
+import queue
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from binning import PixelBinner
+from ringbuffer import SampleRingBuffer
+from acquisition import SourceReader, StreamMerger, open_port
+from sessionfile import SessionWriter
+from checkpoint import Checkpointer, resume as resume_session
+from metrics import Metrics, StackSampler
+
+SHARED = ("sum", "count", "min", "max", "last", "tile_seq", "state") #Arrays of the map in shared memory, the rest is per process.
+STATE = ("samples", "idj", "idk", "version") #Scalars of the binner, kept in the "state" array.
+SEEN_NEVER = np.iinfo(np.uint64).max #Tile sequence number that never occurs, see mark_dirty.
+
+
+def state_property(name):
+    index = STATE.index(name)
+    return property(lambda self: int(self.state[index]), lambda self, value: self.state.__setitem__(index, value))
+
+
+class SharedMap(PixelBinner):
+    #PixelBinner with its arrays in shared memory. Without names it creates them (GUI process, which also removes them in unlink()),
+    #with the names of an existing one it maps the same arrays (acquisition process).
+    #The dirty tiles are found from the sequence numbers instead of the dirty marks, which could not be cleared safely from the other
+    #process: take_dirty() returns the tiles whose number changed since the last call.
+    samples = state_property("samples")
+    idj = state_property("idj")
+    idk = state_property("idk")
+    version = state_property("version")
+
+    def __init__(self, numofpoints=1024, lo=0, hi=1023, tile=64, names=None):
+        self.owner = names is None
+        self.names = dict(names or {})
+        self.blocks = {}
+        self.fills = {}
+        self.state = self.array("state", (len(STATE),), np.int64, 0)
+        attached = dict(self.state_values()) if not self.owner else None
+        super().__init__(numofpoints, lo, hi, tile)
+        if attached is not None: #PixelBinner.__init__ set them to 0.
+            for name, value in attached.items():
+                setattr(self, name, value)
+        self.seen = np.full((self.tiles, self.tiles), SEEN_NEVER, dtype=np.uint64)
+
+    def state_values(self):
+        return zip(STATE, self.state.tolist())
+
+    def array(self, name, shape, dtype, fill):
+        if name not in SHARED:
+            return super().array(name, shape, dtype, fill)
+        size = int(np.prod(shape))*np.dtype(dtype).itemsize
+        if self.owner:
+            block = shared_memory.SharedMemory(create=True, size=size)
+            self.names[name] = block.name
+        else:
+            block = shared_memory.SharedMemory(name=self.names[name])
+        self.blocks[name] = block
+        self.fills[name] = fill
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        if self.owner:
+            array.fill(fill)
+        return array
+
+    def take_dirty(self):
+        seq = self.tile_seq.copy()
+        dirty = np.argwhere(seq != self.seen)
+        self.seen = seq
+        return dirty
+
+    def mark_dirty(self, tiles):
+        self.seen[tiles] = SEEN_NEVER
+
+    def replace(self, binner=None):
+        #Empties the map, or replaces it with the one of binner (e.g. resumed from a checkpoint), in place. Only from the process that adds.
+        self.tile_seq += 1
+        for name in ("sum", "count", "min", "max", "last"):
+            if binner is None:
+                getattr(self, name).fill(self.fills[name])
+            else:
+                np.copyto(getattr(self, name), getattr(binner, name))
+        self.samples, self.idj, self.idk = (0, 0, 0) if binner is None else (binner.samples, binner.idj, binner.idk)
+        self.tile_seq += 1
+        self.version += 1
+
+    def unlink(self):
+        #Removes the shared memory (GUI process, at the end). Arrays still mapping it keep working until they are dropped.
+        for block in self.blocks.values():
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class AcquisitionWorker:
+    #Everything that runs in the acquisition process. config is made by connect_acquisition_process in gamepad_2_7.py.
+    def __init__(self, config, names, commands, events):
+        self.config = config
+        self.commands = commands
+        self.events = events
+        self.metrics = Metrics()
+        self.map = SharedMap(config["numofpoints"], 0, config["scansize"], config["tile"], names=names)
+        self.lock = threading.Lock() #Between the flushes on the merge thread and opening a session on the main thread.
+        self.writer = None
+        self.checkpointer = None
+        self.sampler = None
+        self.reported_overruns = 0
+        self.flush_time = self.metrics.histogram("flush_seconds")
+        self.samples_binned = self.metrics.counter("samples_binned_total")
+        self.metrics.gauge("ring_backlog", lambda: self.map_reader.available())
+        self.metrics.gauge("ring_overruns_total", lambda: sum(self.ring.overruns().values()))
+        self.metrics.gauge("writer_queue", lambda: self.writer.queue_depth())
+        self.metrics.gauge("writer_max_queue", lambda: self.writer.max_depth)
+        self.metrics.gauge("writer_bytes_total", lambda: self.writer.bytes_written)
+        self.metrics.gauge("writer_dropped_samples_total", lambda: self.writer.dropped_samples)
+        self.metrics.gauge("checkpoints_total", lambda: self.checkpointer.saved)
+        self.metrics.gauge("checkpoint_save_seconds", lambda: self.checkpointer.save_time)
+
+    def connect(self):
+        #Same as connect_serial in gamepad_2_7.py: the primary board has to be there, the others are left out if they cannot be opened.
+        self.sources = []
+        opened = []
+        for i, source in enumerate(self.config["sources"]):
+            try:
+                port = open_port(source, self.config["simulate"])
+            except Exception as e:
+                if i == 0:
+                    raise
+                self.events.put(("message", f"Cannot open {source['name']} on {source['port']}, going on without it: {e}"))
+                continue
+            self.sources.append(SourceReader(source["name"], port, source["channels"], source["mode"], metrics=self.metrics))
+            opened.append(f"{source['name']} ({'simulated' if self.config['simulate'] else source['port']})")
+        self.ring = SampleRingBuffer(capacity=self.config["capacity"], fields=StreamMerger.merged_fields(self.sources))
+        self.map_reader = self.ring.add_reader("map")
+        self.file_reader = self.ring.add_reader("file")
+        #The monotonic clock is the same in every process, so the offset of the GUI's clock anchor holds here too.
+        self.merger = StreamMerger(self.sources, self.ring, clock_offset_ns=self.config["clock_offset_ns"], on_merged=self.merged, metrics=self.metrics)
+        if self.config["session"] is not None:
+            self.open(*self.config["session"])
+        for reader in self.sources:
+            reader.start()
+        self.merger.start()
+        if self.config.get("profile"):
+            self.sampler = StackSampler(self.sources + [self.merger], self.config["profile"], write_interval=5.0)
+            self.sampler.start()
+        self.events.put(("connected", ", ".join(opened), [reader.source for reader in self.sources]))
+
+    def merged(self):
+        if self.map_reader.available() > self.config["flush_samples"]:
+            self.flush()
+
+    def flush(self):
+        #Same as flush_samples in gamepad_2_7.py.
+        with self.lock:
+            start = time.perf_counter()
+            batch = self.map_reader.drain()
+            self.map.add(batch["X"], batch["Y"], 1024-batch["Z"].astype(np.float64)) # The z sensor reading is inverted.
+            self.samples_binned.inc(len(batch["Z"]))
+            batch = self.file_reader.drain()
+            if self.writer is not None:
+                self.writer.submit(batch)
+                if self.checkpointer.due():
+                    self.checkpointer.take(self.map, self.writer)
+            self.flush_time.observe(time.perf_counter() - start)
+        lost = sum(self.ring.overruns().values())
+        if lost > self.reported_overruns:
+            self.events.put(("message", f"Warning: ring buffer overrun, {lost} samples lost so far"))
+            self.reported_overruns = lost
+
+    def open(self, path, metadata, resume=False):
+        #New session file, or one continued from its checkpoint. The slow part (the replay) happens before taking the lock.
+        start = time.perf_counter()
+        resumed, replayed = resume_session(path) if resume else (None, 0)
+        writer = SessionWriter(path, metadata=metadata, metrics=self.metrics, resume=resume)
+        checkpointer = Checkpointer(path, self.config["checkpoint_interval"])
+        with self.lock:
+            self.map.replace(resumed)
+            old_writer, old_checkpointer = self.writer, self.checkpointer
+            self.writer, self.checkpointer = writer, checkpointer
+        if old_writer is not None:
+            old_writer.close()
+            old_checkpointer.close()
+        self.events.put(("opened", str(path), self.map.samples, replayed, time.perf_counter() - start))
+
+    def run(self):
+        try:
+            self.connect()
+        except Exception as e:
+            self.events.put(("error", f"{type(e).__name__}: {e}"))
+            return
+        parent = multiprocessing.parent_process()
+        next_report = 0.0
+        while parent is None or parent.is_alive(): #Do not outlive a GUI that was killed.
+            try:
+                command = self.commands.get(timeout=self.config["report_interval"])
+            except queue.Empty:
+                command = None
+            if time.monotonic() >= next_report:
+                self.events.put(("metrics", self.metrics.snapshot()))
+                next_report = time.monotonic() + self.config["report_interval"]
+            if command is None:
+                continue
+            if command[0] == "stop":
+                break
+            if command[0] == "open":
+                try:
+                    self.open(*command[1:])
+                except Exception as e:
+                    self.events.put(("error", f"Cannot open session {command[1]}: {e}"))
+        self.stop()
+
+    def stop(self):
+        for thread in self.sources + [self.merger]:
+            thread.stop()
+        self.merger.join()
+        self.flush()
+        if self.writer is not None:
+            if self.map.samples:
+                self.checkpointer.take(self.map, self.writer, wait=True)
+            self.writer.close()
+            self.checkpointer.close()
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler.join()
+
+
+def run_acquisition(config, names, commands, events):
+    #Entry point of the acquisition process.
+    AcquisitionWorker(config, names, commands, events).run()
+
+
+class RemoteSession:
+    #Stands in for the SessionWriter and the Checkpointer of the acquisition process in the GUI (writer and checkpointer in
+    #gamepad_2_7.py), with the values of the latest metrics snapshot the process sent.
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def gauge(self, name):
+        snapshot = self.metrics.imported.get("acquisition")
+        value = snapshot["gauges"].get(name) if snapshot is not None else None
+        return value or 0
+
+    bytes_written = property(lambda self: self.gauge("writer_bytes_total"))
+    dropped_samples = property(lambda self: self.gauge("writer_dropped_samples_total"))
+    max_depth = property(lambda self: self.gauge("writer_max_queue"))
+    saved = property(lambda self: self.gauge("checkpoints_total"))
+    save_time = property(lambda self: self.gauge("checkpoint_save_seconds"))
+
+    def queue_depth(self):
+        return self.gauge("writer_queue")
+
+    def due(self):
+        return False
+
+    def close(self):
+        pass
+
+
+class AcquisitionProcess:
+    #GUI side: creates the shared map, starts the process and talks to it. config: see connect_acquisition_process in gamepad_2_7.py.
+    def __init__(self, config, metrics):
+        self.metrics = metrics
+        self.map = SharedMap(config["numofpoints"], 0, config["scansize"], config["tile"])
+        context = multiprocessing.get_context("spawn") #As on Windows, and no fork of a process that runs Qt threads.
+        self.commands = context.Queue()
+        self.events = context.Queue()
+        self.sources = [] #Names of the boards that were opened.
+        self.error = None
+        self.process = context.Process(target=run_acquisition, args=(config, self.map.names, self.commands, self.events), name="acquisition", daemon=True)
+        #A spawned process first runs the main script of this one again (as __mp_main__), in case the target was defined there. Ours is
+        #in this module, so the main script is hidden while the process starts: it only imports what run_acquisition needs, not the GUI
+        #of gamepad_2_7.py with its Qt, options and devices.
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            self.process.start()
+        finally:
+            sys.modules["__main__"] = main
+
+    def wait_connected(self, timeout=60.0):
+        #Waits until the process has opened the boards, returns what it opened. Raises RuntimeError if it could not.
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                event = self.events.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                if time.monotonic() > deadline or not self.process.is_alive():
+                    raise RuntimeError(f"Acquisition process did not start (exit code {self.process.exitcode})")
+                continue
+            self.handle(event)
+            if event[0] == "connected":
+                return event[1]
+            if event[0] == "error":
+                raise RuntimeError(event[1])
+
+    def handle(self, event):
+        kind = event[0]
+        if kind == "metrics":
+            self.metrics.import_snapshot(event[1])
+        elif kind == "connected":
+            self.sources = event[2]
+        elif kind == "opened":
+            path, samples, replayed, took = event[1:]
+            print(f"Acquisition process: session {path} open, {samples} samples in the map ({replayed} replayed) after {took*1000:.0f} ms")
+        elif kind == "error":
+            self.error = event[1]
+            print(f"Acquisition process: {event[1]}")
+        else:
+            print(f"Acquisition process: {event[1]}")
+
+    def poll(self):
+        #Handles the events that arrived, call it regularly from the GUI thread.
+        while True:
+            try:
+                self.handle(self.events.get_nowait())
+            except queue.Empty:
+                break
+        if not self.process.is_alive() and self.error is None:
+            self.error = f"stopped (exit code {self.process.exitcode})"
+
+    def open(self, path, metadata, resume=False):
+        self.commands.put(("open", str(path), metadata, resume))
+
+    def stop(self, timeout=10.0):
+        #Lets the process write what it has and close the session file, then removes the shared map.
+        self.commands.put(("stop",))
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.map.unlink()
@@ -0,0 +1,340 @@
+#Performance benchmarks of the hot paths, run on the simulated devices of simulator.py (no hardware needed).
+#   parse_ascii        read_AFM text path: readline, split, int() and push into the ring buffer          samples/s
+#   parse_binary       binary frames decoded in blocks (serialprotocol.py)                             samples/s
+#   ingest_dataframe   the old per-sample DataFrame + pd.concat path, for reference                      samples/s
+#   binning_*          map update (binning.py) with small batches like read_AFM and with large batches    samples/s
+#   writer             session writer (sessionfile.py) from submit to data on disk                       samples/s
+#   input_latency      left stick deflection until the offset write reaches the simulated Studio         ms
+#   frame_*            GamepadMonitor.update_visualization with new data, for several grid sizes (--view)  ms
+#   frame_zoom         same with the largest grid, zoomed in to 2x2 um                                    ms
+#   raster_*           RasterView alone (rasterview.py): colormap lookup and repaint, for several grid sizes  ms
+#   planner_*          gap planner (gapplanner.py) on a 1024x1024 map with 10, 100 and 1000 holes            ms
+#   ingest_*           samples binned per second by the whole program (gamepad_2_7.py in a subprocess) on    samples/s
+#                      a fast simulated Arduino, acquisition in a thread or in its own process
+#                      (--acquisition-process), with the map being drawn or not (--no-plot)
+#Usage:
+#   python benchmark.py --save results.json                   run everything and keep the numbers
+#   python benchmark.py --baseline results.json               compare with a previous run, exits with 1 if something got slower
+#   python benchmark.py --only binning frame --quick          run a subset with fewer samples
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from ringbuffer import SampleRingBuffer
+from acquisition import SourceReader
+from binning import PixelBinner
+from serialprotocol import BinaryFrameDecoder, encode_frames
+from sessionfile import SessionWriter
+from metrics import totals
+import benchmark_ringbuffer
+
+results = {}
+
+
+def record(name, value, unit, higher_is_better):
+    results[name] = {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+    print(f"{name:24s} {value:14.3f} {unit}" if value is not None else f"{name:24s} {'failed':>14s} {unit}")
+
+
+def synthetic_samples(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return tuple(rng.integers(0, 1024, n, dtype=np.uint16) for _ in range(3))
+
+
+#%%%%%%%%%%%%%%%%%%
+# Acquisition
+#%%%%%%%%%%%%%%%%%%
+
+def bench_parse(n):
+    x, y, z = synthetic_samples(n)
+    text = "".join(f"{a},{b},{c}\r\n" for a, b, c in zip(x.tolist(), y.tolist(), z.tolist())).encode()
+    port = io.BytesIO(text)
+    reader = SourceReader("bench", port, capacity=1 << 20) #Same steps as the reader thread, a block at a time.
+    start = time.perf_counter()
+    while port.tell() < len(text):
+        reader.read_ascii()
+    record("parse_ascii", n/(time.perf_counter() - start), "samples/s", True)
+
+    stream = encode_frames(x, y, z)
+    port = io.BytesIO(stream)
+    decoder = BinaryFrameDecoder()
+    ring = SampleRingBuffer(capacity=1 << 20)
+    start = time.perf_counter()
+    while True:
+        xb, yb, zb = decoder.read_from(port)
+        if len(xb) == 0 and decoder.fill < 10:
+            break
+        ring.extend(xb, yb, zb, np.full(len(xb), time.time_ns(), dtype=np.int64))
+    record("parse_binary", n/(time.perf_counter() - start), "samples/s", True)
+
+    lines = benchmark_ringbuffer.synthetic_lines(min(n, 3000))
+    record("ingest_dataframe", benchmark_ringbuffer.measure(benchmark_ringbuffer.dataframe_path, lines), "samples/s", True)
+
+
+def bench_binning(n):
+    x, y, z = synthetic_samples(n)
+    for name, batch in (("binning_batch4", 4), ("binning_batch4096", 4096)):
+        binner = PixelBinner()
+        count = min(n, 20000) if batch < 100 else n
+        start = time.perf_counter()
+        for i in range(0, count, batch):
+            binner.add(x[i:i + batch], y[i:i + batch], z[i:i + batch])
+        record(name, count/(time.perf_counter() - start), "samples/s", True)
+
+
+def bench_writer(n):
+    x, y, z = synthetic_samples(n)
+    t = np.arange(n, dtype=np.int64)
+    with tempfile.TemporaryDirectory() as folder:
+        writer = SessionWriter(os.path.join(folder, "bench.npys"))
+        start = time.perf_counter()
+        for i in range(0, n, 1024):
+            writer.submit({"X": x[i:i + 1024], "Y": y[i:i + 1024], "Z": z[i:i + 1024], "timestamp": t[i:i + 1024]})
+            while writer.queue_depth() > 200: #Do not measure dropped batches, wait like a steady 1024 sample producer would.
+                time.sleep(0.0001)
+        writer.close()
+        elapsed = time.perf_counter() - start
+    record("writer", writer.samples_written/elapsed, "samples/s", True)
+
+
+#%%%%%%%%%%%%%%%%%%
+# GUI: input latency and frame time (needs PySide6 and matplotlib, uses Qt's offscreen platform)
+#%%%%%%%%%%%%%%%%%%
+
+gui = None
+studio_latency = 0.005 # s per simulated Studio RPC
+view = "raster" # Live view of the window, see --view of gamepad_2_7.py
+
+
+def load_gui():
+    #Imports gamepad_2_7.py on the simulated devices and creates the window, once.
+    global gui
+    if gui is not None:
+        return gui
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.chdir(tempfile.mkdtemp(prefix="afm_benchmark_")) #The session file of the window goes there.
+    import gamepad_2_7 as gp
+    gp.setup(["--simulate", "--latency", str(studio_latency), "--view", view])
+    from PySide6.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([sys.argv[0]])
+    window = gp.GamepadMonitor()
+    window.show()
+    gp.start_devices(window)
+    ready = gp.executor.submit(lambda: None) #Queued behind the Studio setup.
+    while gp.gamepad is None or gp.merger is None or not ready.done():
+        app.processEvents()
+        time.sleep(0.001)
+    gui = (gp, app, window)
+    return gui
+
+
+def run_events(app, seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        app.processEvents()
+        time.sleep(0.0005)
+
+
+def bench_input_latency(repeats=5, timeout=2.0):
+    gp, app, window = load_gui()
+    spm = gp.spm
+    latencies = []
+    for i in range(repeats):
+        written = []
+        spm.on_write = lambda path, value: written.append(time.perf_counter()) if "image_offset" in path else None
+        run_events(app, 0.1)
+        start = time.perf_counter()
+        gp.gamepad.set_axis(0, 1.0 if i % 2 == 0 else -1.0)
+        while not written and time.perf_counter() - start < timeout:
+            app.processEvents()
+            time.sleep(0.0002)
+        gp.gamepad.set_axis(0, 0.0)
+        if written:
+            latencies.append((written[0] - start)*1000)
+    spm.on_write = None
+    run_events(app, 0.1)
+    record("input_latency", float(np.median(latencies)) if latencies else None, "ms", False)
+
+
+def frame_times(gp, app, window, x, y, z, frames):
+    window.update_visualization() #First frame may do a full redraw.
+    run_events(app, 0.05)
+    times = []
+    for i in range(frames):
+        #New data, so the frame is not skipped: 100 samples around the tip, which moves a bit every frame like during a scan.
+        gp.binner.add(x[:100] % 32 + 16*i, y[:100] % 32 + 16*i, z[:100])
+        start = time.perf_counter()
+        window.update_visualization()
+        times.append((time.perf_counter() - start)*1000)
+        app.processEvents()
+    return float(np.median(times))
+
+
+def bench_frame_time(sizes, frames=10):
+    gp, app, window = load_gui()
+    original = gp.binner
+    for size in sizes:
+        gp.binner = PixelBinner(size, 0, 1023)
+        x, y, z = synthetic_samples(size*size//2)
+        gp.binner.add(x, y, z)
+        record(f"frame_{size}", frame_times(gp, app, window, x, y, z, frames), "ms", False)
+    if sizes:
+        #Same map as the largest size, zoomed in to 2x2 um.
+        limits = gp.xmin, gp.xmax, gp.ymin, gp.ymax
+        gp.xmin, gp.xmax, gp.ymin, gp.ymax = -1, 1, -1, 1
+        record("frame_zoom", frame_times(gp, app, window, x, y, z, frames), "ms", False)
+        gp.xmin, gp.xmax, gp.ymin, gp.ymax = limits
+    gp.binner = original
+
+
+def bench_raster(sizes, frames=20):
+    #set_map and repaint of an 800x800 RasterView with a map where a tenth of the pixels are empty, without the rest of the window.
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from rasterview import RasterView
+    app = QApplication.instance() or QApplication([sys.argv[0]])
+    raster = RasterView()
+    raster.resize(800, 800)
+    raster.show()
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        data = rng.uniform(0, 1023, (size, size)).astype(np.float32)
+        data[rng.random((size, size)) < 0.1] = np.nan
+        times = []
+        for i in range(frames):
+            start = time.perf_counter()
+            raster.set_map(data, (-50, 50, -50, 50), 0, 1023)
+            raster.set_cursor(i - 10, 10 - i)
+            raster.repaint()
+            times.append((time.perf_counter() - start)*1000)
+        record(f"raster_{size}", float(np.median(times)), "ms", False)
+    raster.close()
+
+
+def bench_planner(holes=(10, 100, 1000), repeats=3):
+    #Planning time against the number of holes punched in an otherwise fully visited map.
+    from gapplanner import plan_gaps
+    rng = np.random.default_rng(0)
+    for n in holes:
+        count = np.ones((1024, 1024), dtype=np.uint32)
+        for x, y in rng.integers(0, 1000, (n, 2)):
+            count[x:x + 20, y:y + 20] = 0
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            plan_gaps(count, (0.0, 0.0), (-50e-6, -50e-6), (100e-6/1023, 100e-6/1023), cell=20)
+            times.append((time.perf_counter() - start)*1000)
+        record(f"planner_{n}", float(np.median(times)), "ms", False)
+
+
+def bench_ingest(rate, seconds):
+    #Runs the program for a while on a simulated Arduino sending rate samples/s and reads the binning rate from its metrics file.
+    folder = tempfile.mkdtemp(prefix="afm_ingest_")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gamepad_2_7.py")
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    for name, options in (("thread_plot", []), ("thread_noplot", ["--no-plot"]),
+                          ("process_plot", ["--acquisition-process"]), ("process_noplot", ["--acquisition-process", "--no-plot"])):
+        path = os.path.join(folder, name + ".jsonl")
+        subprocess.run([sys.executable, script, "--simulate", "--rate", str(rate), "--run-seconds", str(seconds), "--metrics-file", path,
+                        "--metrics-interval", "1"] + options, cwd=folder, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=seconds + 120)
+        with open(path) as f:
+            snapshots = [json.loads(line) for line in f]
+        #Average over the steady part (the first seconds are the start up). The map is binned in bursts, so the rates of single
+        #seconds jump between 0 and several times the real rate.
+        steady = snapshots[2:]
+        rate_binned = None
+        if len(steady) >= 2 and steady[-1]["monotonic"] > steady[0]["monotonic"]:
+            binned = [totals(s).get("samples_binned_total", 0) for s in (steady[0], steady[-1])]
+            rate_binned = (binned[1] - binned[0])/(steady[-1]["monotonic"] - steady[0]["monotonic"])
+        record(f"ingest_{name}", rate_binned, "samples/s", True)
+
+
+#%%%%%%%%%%%%%%%%%%
+# Running and comparing
+#%%%%%%%%%%%%%%%%%%
+
+def compare(baseline, tolerance):
+    #Prints the change of every result against the baseline, returns the names that got worse by more than tolerance.
+    regressions = []
+    print(f"\n{'benchmark':24s} {'baseline':>14s} {'now':>14s} {'change':>9s}")
+    for name, now in results.items():
+        before = baseline.get("results", {}).get(name)
+        if before is None or before["value"] is None or now["value"] is None:
+            continue
+        ratio = now["value"]/before["value"]
+        better = ratio >= 1 if now["higher_is_better"] else ratio <= 1
+        worse_by = (1/ratio - 1) if now["higher_is_better"] else (ratio - 1)
+        flag = ""
+        if not better and worse_by > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:24s} {before['value']:14.3f} {now['value']:14.3f} {100*(ratio - 1):+8.1f}%{flag}")
+    return regressions
+
+
+def main(argv=None):
+    global studio_latency, view
+    parser = argparse.ArgumentParser(description="Benchmarks of the acquisition, map, writer and GUI hot paths.")
+    parser.add_argument("--only", nargs="*", help="Run only these groups: parse binning writer input frame raster planner ingest")
+    parser.add_argument("--quick", action="store_true", help="Fewer samples, for a fast check")
+    parser.add_argument("--sizes", nargs="*", type=int, default=[256, 512, 1024, 2048], help="Grid sizes for the frame and raster times")
+    parser.add_argument("--rate", type=float, default=300000, help="Samples per second of the simulated Arduino for the ingest group")
+    parser.add_argument("--view", default=view, choices=["raster", "matplotlib"], help="Live view for the frame group")
+    parser.add_argument("--latency", type=float, default=studio_latency, help="Seconds per RPC of the simulated Studio")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+    studio_latency = args.latency
+    view = args.view
+    n = 50000 if args.quick else 500000
+    groups = args.only or ["parse", "binning", "writer", "input", "frame", "raster", "planner", "ingest"]
+    save = os.path.abspath(args.save) if args.save else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    if "parse" in groups:
+        bench_parse(n//5)
+    if "binning" in groups:
+        bench_binning(n)
+    if "writer" in groups:
+        bench_writer(n)
+    if "input" in groups:
+        bench_input_latency(3 if args.quick else 10)
+    if "frame" in groups:
+        bench_frame_time(args.sizes, 5 if args.quick else 20)
+    if "raster" in groups:
+        bench_raster(args.sizes, 5 if args.quick else 20)
+    if "planner" in groups:
+        bench_planner(repeats=1 if args.quick else 3)
+    if "ingest" in groups:
+        bench_ingest(args.rate, 6 if args.quick else 15)
+
+    output = {"meta": {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(), "numpy": np.__version__,
+                       "platform": platform.platform(), "quick": args.quick}, "results": results}
+    if save:
+        with open(save, "w") as f:
+            json.dump(output, f, indent=1)
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(json.load(f), args.tolerance)
+        if regressions:
+            print("Slower than the baseline:", ", ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    code = main()
+    sys.stdout.flush()
+    os._exit(code) #The simulated reader thread of the GUI never ends on its own.
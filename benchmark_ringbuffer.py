@@ -0,0 +1,63 @@
+#Benchmark of the read_AFM ingest path: the old per-sample DataFrame + pd.concat against the preallocated ring buffer.
+#Both paths parse the same synthetic "x,y,z" lines and hand a batch to the consumers every buferlenght+1 samples, like read_AFM does.
+#No serial port or disk is involved, so the numbers are the sustained samples/sec the Python side can take before it starts losing data.
+#Usage: python benchmark_ringbuffer.py [number of samples]
+
+import sys
+import time
+import datetime
+import numpy as np
+import pandas as pd
+from ringbuffer import SampleRingBuffer
+
+buferlenght = 3
+
+
+def synthetic_lines(n):
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 1024, size=(n, 3))
+    return [f"{x},{y},{z}\r\n".encode() for x, y, z in values]
+
+
+def dataframe_path(lines): #The code path read_AFM used before the ring buffer.
+    data0 = {"X": [], "Y": [], "Z": [], "timestamp": []}
+    df1 = pd.DataFrame(data0)
+    k = 0
+    for line in lines:
+        result = [x.strip() for x in line.decode().strip().split(',')]
+        data2 = {"X": [float(result[0])], "Y": [float(result[1])], "Z": [float(result[2])], "timestamp": [datetime.datetime.now()]}
+        df1 = pd.concat([df1, pd.DataFrame(data2)], ignore_index=True)
+        k += 1
+        if k > buferlenght:
+            k = 0
+            df1["X"].tolist(), df1["Y"].tolist(), df1["Z"].tolist()
+            df1 = pd.DataFrame(data0)
+
+
+def ringbuffer_path(lines):
+    ring = SampleRingBuffer()
+    map_reader = ring.add_reader("map")
+    file_reader = ring.add_reader("file")
+    for line in lines:
+        result = line.decode().strip().split(',')
+        ring.push(int(result[0]), int(result[1]), int(result[2]), time.time_ns())
+        if map_reader.available() > buferlenght:
+            map_reader.drain()
+            file_reader.drain()
+    return ring
+
+
+def measure(function, lines):
+    start = time.perf_counter()
+    function(lines)
+    return len(lines)/(time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    lines = synthetic_lines(n)
+    old_rate = measure(dataframe_path, lines[:min(n, 5000)]) #The old path is slow enough that a few thousand samples give a stable number.
+    new_rate = measure(ringbuffer_path, lines)
+    print(f"DataFrame + concat: {old_rate:12.0f} samples/s")
+    print(f"Ring buffer:        {new_rate:12.0f} samples/s  ({new_rate/old_rate:.0f}x)")
+    print("The Arduino sends roughly 2e6/10/10 = 20000 samples/s at 2 Mbaud (10 bits per byte, ~10 bytes per line).")
@@ -0,0 +1,107 @@
+#Vectorized binning of x y z samples onto the square pixel grid of the map.
+#The grid is uniform, so the pixel of a sample is computed arithmetically for a whole batch instead of searching for the closest grid
+#point one sample at a time. Samples are accumulated with unbuffered scatter operations (np.add.at, np.minimum.at...), so several samples
+#landing on the same pixel in one batch are all counted. Besides the last value, each pixel keeps the running sum, hit count, min and max,
+#which lets us average the noisy 10-bit ADC readings instead of throwing all but the latest one away.
+#The grid is also divided in square tiles, and every tile that got samples is marked as dirty until take_dirty() is called, so the
+#live view (see pyramid.py) only has to update the parts of the map that changed.
+#Every tile also has a sequence number that add() makes odd before it writes the tile and even again when it is done (a seqlock). The
+#live view copies tiles while samples are being added, without any lock, and uses the numbers to find copies that may be torn (a sum
+#already updated but not its count) and take them again next frame.
+
+import threading
+import numpy as np
+
+LAYERS = ("mean", "min", "max", "last", "count")
+
+
+class PixelBinner:
+    def __init__(self, numofpoints=1024, lo=0, hi=1023, tile=64):
+        #Samples with value lo fall on the first pixel and samples with value hi on the last one (same as np.linspace(lo, hi, numofpoints)).
+        self.numofpoints = numofpoints
+        self.lo = lo
+        self.hi = hi
+        self.scale = (numofpoints - 1)/(hi - lo)
+        shape = (numofpoints, numofpoints)
+        self.sum = self.array("sum", shape, np.float64, 0)
+        self.count = self.array("count", shape, np.uint32, 0)
+        self.min = self.array("min", shape, np.float32, np.inf)
+        self.max = self.array("max", shape, np.float32, -np.inf)
+        self.last = self.array("last", shape, np.float32, np.nan)
+        self.idj = 0 #Pixel of the last sample, used to draw the cursor.
+        self.idk = 0
+        self.samples = 0
+        self.version = 0 #Increases every time new samples are added, so the plot knows if it has to redraw.
+        self.tile = tile #Side of the dirty tiles in pixels.
+        self.tiles = -(-numofpoints//tile)
+        self.dirty = np.zeros((self.tiles, self.tiles), dtype=bool)
+        self.dirty_lock = threading.Lock() #Samples arrive on the read thread, the dirty tiles are taken on the GUI thread.
+        self.tile_seq = self.array("tile_seq", (self.tiles, self.tiles), np.uint64, 0) #Odd while add() is writing the tile.
+
+    def array(self, name, shape, dtype, fill):
+        #Allocates the arrays of the map, see acquisitionprocess.SharedMap for the version in shared memory.
+        return np.full(shape, fill, dtype=dtype)
+
+    def indices(self, values):
+        idx = np.rint((np.asarray(values, dtype=np.float64) - self.lo)*self.scale).astype(np.intp)
+        np.clip(idx, 0, self.numofpoints - 1, out=idx)
+        return idx
+
+    def add(self, x, y, z):
+        #x and y select the pixel (first and second index respectively), z is the value to accumulate.
+        z = np.asarray(z, dtype=np.float64)
+        if z.size == 0:
+            return
+        ix = self.indices(x)
+        iy = self.indices(y)
+        flat = ix*self.numofpoints + iy
+        touched = np.zeros(self.tiles*self.tiles, dtype=bool)
+        touched[(ix//self.tile)*self.tiles + iy//self.tile] = True
+        seq = self.tile_seq.reshape(-1)
+        seq[touched] += 1
+        np.add.at(self.sum.reshape(-1), flat, z)
+        np.add.at(self.count.reshape(-1), flat, 1)
+        np.minimum.at(self.min.reshape(-1), flat, z)
+        np.maximum.at(self.max.reshape(-1), flat, z)
+        self.last.reshape(-1)[flat] = z #With repeated pixels the later sample wins.
+        self.idj, self.idk = divmod(int(flat[-1]), self.numofpoints)
+        self.samples += z.size
+        seq[touched] += 1
+        with self.dirty_lock:
+            self.dirty.reshape(-1)[touched] = True
+        self.version += 1
+
+    def take_dirty(self):
+        #Returns the (row, column) tile indices touched since the last call and clears the marks.
+        with self.dirty_lock:
+            dirty = np.argwhere(self.dirty)
+            self.dirty[:] = False
+        return dirty
+
+    def mark_dirty(self, tiles):
+        #Marks the tiles (a boolean array of the tile grid) as dirty again, e.g. the ones the live view could not copy cleanly.
+        with self.dirty_lock:
+            self.dirty |= tiles
+
+    def mean(self, fill=np.nan, out=None, region=(slice(None), slice(None))):
+        count = self.count[region]
+        if out is None:
+            out = np.empty(count.shape, dtype=np.float64)
+        out.fill(fill)
+        np.divide(self.sum[region], count, out=out, where=count > 0, casting="same_kind")
+        return out
+
+    def layer(self, name, fill=np.nan, out=None, region=(slice(None), slice(None))):
+        #Map layer by name (see LAYERS). Pixels without samples are set to fill.
+        #With out (an array of the grid shape) the result is written there, so the live view does not allocate a new map every frame.
+        #region (a pair of slices) gives only that part of the map, out must then have the shape of the region.
+        if name == "mean":
+            return self.mean(fill, out, region)
+        if name == "count":
+            return self.count[region]
+        count = self.count[region]
+        if out is None:
+            out = np.empty(count.shape, dtype=np.float64)
+        out.fill(fill)
+        np.copyto(out, getattr(self, name)[region], where=count > 0)
+        return out
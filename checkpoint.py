@@ -0,0 +1,153 @@
+#Checkpoints of the live map, so a session can be picked up again without replaying its whole file.
+#Every now and then the binner arrays (sum, count, min, max, last) are saved as plain .npy files in <session>.ckpt/, together with a
+#small checkpoint.json that says where in the session file the map stops: the byte offset of a chunk and how many samples from that
+#chunk on are already in the map. The arrays of each checkpoint get new file names and checkpoint.json is replaced in one step
+#(os.replace) only after they are complete, so a crash while saving leaves the previous checkpoint intact.
+#Resuming maps the arrays (np.load with mmap_mode="c", nothing is read until a pixel is touched, changes stay in memory) and bins
+#only the samples written after the checkpoint, so it takes about the same time for a five minute and a five hour session.
+
+import os
+import json
+import time
+import queue
+import datetime
+import threading
+from pathlib import Path
+import numpy as np
+from binning import PixelBinner
+from sessionfile import iter_chunks, truncate_incomplete
+
+ARRAYS = ("sum", "count", "min", "max", "last")
+POINTER = "checkpoint.json"
+
+
+def checkpoint_dir(session):
+    return Path(session).with_suffix(".ckpt")
+
+
+def read_pointer(session):
+    #Contents of checkpoint.json of the session, None if it has no checkpoint.
+    try:
+        with open(checkpoint_dir(session)/POINTER) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def latest_resumable(folder="."):
+    #Newest session file in folder that has a checkpoint, or None.
+    sessions = sorted(Path(folder).glob("*.npys"), key=lambda p: p.stat().st_mtime, reverse=True)
+    return next((session for session in sessions if read_pointer(session) is not None), None)
+
+
+class Checkpointer:
+    #Saves checkpoints of one session on its own thread. take() copies the binner arrays (so it must run on the thread that adds to
+    #the binner, between two batches) and returns at once, the copy is written in the background. If the previous checkpoint is still
+    #being written the new one is skipped.
+    def __init__(self, session, interval=30.0):
+        self.session = Path(session)
+        self.directory = checkpoint_dir(session) #Made by the first checkpoint, so sessions that never get one leave no empty folder.
+        self.interval = interval #s between checkpoints, see due().
+        pointer = read_pointer(session)
+        self.generation = pointer["generation"] if pointer else 0
+        self.last = time.monotonic()
+        self.saved = 0
+        self.skipped = 0
+        self.save_time = 0.0 #s the last checkpoint took to write.
+        self.error = None
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self.run, name="checkpoint", daemon=True)
+        self.thread.start()
+
+    def due(self):
+        return time.monotonic() - self.last >= self.interval
+
+    def take(self, binner, writer, wait=False):
+        #The map holds every sample the writer accepted: the ones in the file up to offset, and the skip samples still queued (or
+        #being written) that will follow from there on. With wait (the last checkpoint of a session) it waits for the previous one
+        #instead of skipping.
+        self.last = time.monotonic()
+        offset, written = writer.progress
+        info = {"offset": offset, "skip": writer.submitted_samples - written, "samples": binner.samples, "numofpoints": binner.numofpoints,
+                "lo": binner.lo, "hi": binner.hi, "tile": binner.tile, "idj": binner.idj, "idk": binner.idk}
+        try:
+            self.queue.put((info, {name: getattr(binner, name).copy() for name in ARRAYS}), block=wait)
+        except queue.Full:
+            self.skipped += 1
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                start = time.perf_counter()
+                self.write(*item)
+                self.save_time = time.perf_counter() - start
+                self.saved += 1
+            except Exception as e: #Keep the previous checkpoint and try again next time.
+                self.error = e
+                print(f"Error saving checkpoint: {e}")
+
+    def write(self, info, arrays):
+        generation = self.generation + 1
+        self.directory.mkdir(exist_ok=True)
+        for name, array in arrays.items():
+            with open(self.directory/f"{name}.{generation}.npy", "wb") as f:
+                np.save(f, array)
+                f.flush()
+                os.fsync(f.fileno())
+        info.update(generation=generation, time=datetime.datetime.now().isoformat(), arrays={name: f"{name}.{generation}.npy" for name in arrays})
+        temporary = self.directory/(POINTER + ".tmp")
+        with open(temporary, "w") as f:
+            json.dump(info, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.directory/POINTER)
+        self.generation = generation
+        self.remove_old()
+
+    def remove_old(self):
+        #Arrays of older checkpoints. A resumed session may still have them mapped (Windows does not allow deleting those), they are
+        #then removed by a later checkpoint.
+        for path in self.directory.glob("*.npy"):
+            if not path.name.endswith(f".{self.generation}.npy"):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def resume(session, on_progress=None):
+    #Rebuilds the binner of a session from its checkpoint plus the samples written after it, and cuts off a chunk the program was
+    #writing when it stopped, so the writer can append to the file. Returns the binner and the number of samples replayed.
+    #on_progress(samples) is called after every replayed chunk.
+    pointer = read_pointer(session)
+    if pointer is None:
+        raise FileNotFoundError(f"{session} has no checkpoint")
+    directory = checkpoint_dir(session)
+    binner = PixelBinner(pointer["numofpoints"], pointer["lo"], pointer["hi"], pointer.get("tile", 64))
+    for name in ARRAYS:
+        setattr(binner, name, np.load(directory/pointer["arrays"][name], mmap_mode="c"))
+    binner.samples = pointer["samples"]
+    binner.idj, binner.idk = pointer["idj"], pointer["idk"]
+    binner.dirty[:] = True
+
+    skip = pointer["skip"]
+    replayed = 0
+    for _, records in iter_chunks(session, pointer["offset"]):
+        if skip >= len(records):
+            skip -= len(records)
+            continue
+        records = records[skip:]
+        skip = 0
+        binner.add(records["X"], records["Y"], 1024-records["Z"].astype(np.float64)) # The z sensor reading is inverted.
+        replayed += len(records)
+        if on_progress is not None:
+            on_progress(replayed)
+    truncate_incomplete(session, pointer["offset"])
+    return binner, replayed
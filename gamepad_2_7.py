@@ -1,5 +1,6 @@
 #Script to interface between a gamepad controller and a DriveAFM using Python and an Arduino board. 
 #AFM must be on, Studio must be on and a measuring sesion open, gamepad should be conected and recognized by the PC, and Arduino should be conected to the PC and running the code to measure voltages and write to serial.
+#Without the hardware, "python gamepad_2_7.py --simulate" runs everything on the stand-ins of simulator.py (see --help for the options).
 #Working on:
 #Studio 13.2
 #Nanosurf python script package  1.9.4
@@ -17,62 +18,208 @@
 #%%%%%%%%%%%%%%%%%%
 
 import sys
-import pygame
+import time
+startup_t0 = time.perf_counter() # Startup phases are timed from here, see log_phase.
 from PySide6 import  QtWidgets
-from PySide6.QtCore import QTimer, Qt
+from PySide6.QtCore import QTimer, Qt, Signal
 from PySide6.QtGui import QColor, QPainter, QBrush, QPen
-from PySide6.QtWidgets import QFormLayout, QApplication, QSlider, QDoubleSpinBox, QWidget, QVBoxLayout, QLabel, QComboBox, QLineEdit,QHBoxLayout, QGroupBox, QPushButton, QGridLayout
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
-import matplotlib.colors as mcolors
-import matplotlib.cm as cm
+from PySide6.QtWidgets import QProgressBar, QFormLayout, QApplication, QSlider, QDoubleSpinBox, QWidget, QVBoxLayout, QLabel, QComboBox, QLineEdit,QHBoxLayout, QGroupBox, QPushButton, QGridLayout, QFileDialog, QCheckBox
 import numpy as np
-import matplotlib.pyplot as plt
 from PySide6.QtGui import QPalette, QColor
-import nanosurf
-import time
-import threading
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning) #This is to avoid getting messages about some of the libraries and or functions changing in the future.
 warnings.simplefilter(action='ignore', category=UserWarning)
-import pandas as pd
 import datetime
 from pathlib import Path  
-from scipy import ndimage
-import serial
 import re
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from ringbuffer import SampleRingBuffer
+from binning import PixelBinner, LAYERS
+from acquisition import SourceReader, StreamMerger, clock_anchor, local_time_offset, open_port as open_board
+from acquisitionprocess import AcquisitionProcess, RemoteSession
+from checkpoint import Checkpointer, resume as resume_session, latest_resumable, read_pointer
+from sessionfile import SessionWriter
+from gamepadinput import InputDispatcher, BUTTONS
+from studioexecutor import StudioExecutor
+from studiocache import PropertyCache, SETPOINT, OFFSET_X, OFFSET_Y, POS_X, POS_Y
+from motioncontrol import MotionController
+from scanpaths import hilbert_vertices, serpentine_vertices, spiral_vertices, merge_collinear, PathExecutor
+from pyramid import MapPyramid
+from rasterview import RasterView
+from mosaic import MosaicMap, MOSAIC_LAYERS, counts_to_metres
+from leveling import Leveler, AutoContrast, LEVELING
+from metrics import Metrics, JsonLinesExporter, PrometheusServer, StackSampler, rates
+import functools
+# pygame, serial and nanosurf are imported when their device is connected (see connect_gamepad, connect_serial and connect_studio),
+# so the window does not wait for them, and scipy when the first gap path is planned (see plan_fill_gaps). The matplotlib canvas is
+# only imported for --view matplotlib (see create_figure), matplotlib.pyplot is not needed, the plot is embedded in the Qt window.
+
+def log_phase(name, start):
+    # Prints how long a startup phase took and when it ended, counted from the start of the script.
+    now = time.perf_counter()
+    print(f"Startup: {name} took {now - start:.2f} s (at {now - startup_t0:.2f} s)")
+    return now - start
+
+#%%%%%%%%%%%%%%%%%%
+# Command line options, only needed to run without the hardware.
+#%%%%%%%%%%%%%%%%%%
+
+def parse_arguments(argv=None):
+    # Returns the options and whatever is left for Qt.
+    parser = argparse.ArgumentParser(description="Gamepad interface for the DriveAFM.")
+    parser.add_argument("--simulate", action="store_true", help="Use the simulated Arduino, gamepad and Studio of simulator.py")
+    parser.add_argument("--replay", help="With --simulate, replay this session file (.npys or .csv) instead of a synthetic scan")
+    parser.add_argument("--pattern", default="raster", choices=["raster", "spiral"], help="Synthetic scan of the simulated Arduino")
+    parser.add_argument("--rate", type=float, default=20000, help="Samples per second of the simulated Arduino")
+    parser.add_argument("--script", help="JSON file with the scripted gamepad events, see simulator.ScriptedGamepad")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every access to the simulated Studio takes")
+    parser.add_argument("--move-speed", type=float, default=100e-6, help="m/s of the position controller moves of the simulated Studio")
+    parser.add_argument("--run-seconds", type=float, help="Close the window after this many seconds (for unattended runs)")
+    parser.add_argument("--metrics-file", help="Append a snapshot of the metrics (see metrics.py) to this JSON-lines file, rotated at 10 MB")
+    parser.add_argument("--metrics-interval", type=float, default=5.0, help="Seconds between snapshots in --metrics-file")
+    parser.add_argument("--metrics-port", type=int, help="Serve the metrics in Prometheus text format on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--profile-read", help="Sample the stacks of the read and merge threads and save the collapsed stacks (flame graph input) to this file")
+    parser.add_argument("--resume", nargs="?", const="latest", help="Continue a session (the newest one with a checkpoint if no file is given), see checkpoint.py")
+    parser.add_argument("--acquisition-process", action="store_true", help="Read, bin and save the samples in a separate process, see acquisitionprocess.py")
+    parser.add_argument("--view", default="raster", choices=["raster", "matplotlib"], help="Live map painted with Qt (rasterview.py) or the matplotlib canvas")
+    parser.add_argument("--no-plot", action="store_true", help="Do not redraw the map (to measure the acquisition without the drawing)")
+    parser.add_argument("--second-board", action="store_true", help="Also read the board with the extra channels (SECOND_BOARD below)")
+    return parser.parse_known_args(argv)
+
+args = None # Set by setup().
+
+# Counters and latency histograms of every stage (see metrics.py). They are shown in the Stats panel and can be exported.
+metrics = None # Created by setup(), like the executor, the cache and the mosaic below.
+read_sampler = None # Sampling profiler of the acquisition threads, only with --profile-read.
 
 #%%%%%%%%%%%%%%%%%%
 # Initialize conections to different systems.
 #%%%%%%%%%%%%%%%%%%
 
+# The window opens first and the three devices connect at the same time afterwards (see start_devices), each one shows up as ready
+# in the window when it is done. Until then the device is None and whatever needs it waits: the read threads start once the Arduino
+# is there, gamepad polling does nothing without a gamepad, and Studio commands queue up behind the Studio setup on the executor.
+sources = [] # One SourceReader per board (see acquisition.py)
+merger = None
+acquisition = None # The acquisition process, only with --acquisition-process.
+session = None # (file, metadata, resume) of the session it writes, see open_session.
+gamepad = None
+studio = None
+spm = None
+get_events = lambda: [] # Replaced by the event source of the gamepad once it is connected.
+
 ##Arduino
-try:    
-    ser = serial.Serial('COM19', 2000000, timeout=0.01) #User should change the port number accordingly.
-except:
-    print("COM not working or wrong COM port selected")
+SERIAL_MODE = "ascii" #"ascii" for the x,y,z text lines, "binary" for the framed protocol (set BINARY_MODE 1 in the Arduino sketch too), see serialprotocol.py.
+# Boards to read. Each one gets its own reader thread and channels, and their samples are merged by time (see acquisition.py).
+# The first one is the primary board, the Arduino with the X, Y, Z positions that place the samples on the map.
+SOURCES = [
+    {"name": "arduino", "port": "COM19", "baudrate": 2000000, "channels": ("X", "Y", "Z"), "mode": SERIAL_MODE}, #User should change the port number accordingly.
+]
+# A second board for extra channels, sending "deflection,amplitude,phase" lines. Read only with --second-board.
+SECOND_BOARD = {"name": "signals", "port": "COM20", "baudrate": 2000000, "channels": ("deflection", "amplitude", "phase"), "mode": "ascii"}
+
+def simulated_board():
+    return {"source": args.replay or args.pattern, "rate": args.rate} if args.simulate else None
+
+def open_port(source):
+    return open_board(source, simulated_board())
+
+def connect_serial():
+    # The primary board has to be there, the others are left out (with their channels) if they cannot be opened.
+    global ring, map_reader, file_reader, merger, read_sampler
+    if args.acquisition_process:
+        return connect_acquisition_process()
+    opened = []
+    for i, source in enumerate(SOURCES):
+        try:
+            port = open_port(source)
+        except Exception as e:
+            if i == 0:
+                raise
+            print(f"Cannot open {source['name']} on {source['port']}, going on without it: {e}")
+            continue
+        sources.append(SourceReader(source["name"], port, source["channels"], source["mode"], metrics=metrics))
+        opened.append(f"{source['name']} ({'simulated' if args.simulate else source['port']})")
+    # Samples of all boards, merged, for the map and the file. Readers are added before anything is pushed, so they miss nothing.
+    ring = SampleRingBuffer(capacity=1 << 18, fields=StreamMerger.merged_fields(sources))
+    map_reader = ring.add_reader("map")
+    file_reader = ring.add_reader("file")
+    merger = StreamMerger(sources, ring, clock_offset_ns=local_time_offset(clock), on_merged=samples_merged, metrics=metrics)
+    #These are the independent threads that will be trying to read data from AFM (throught the Arduino) as fast as possible.
+    for reader in sources:
+        reader.start()
+    merger.start()
+    if args.profile_read:
+        read_sampler = StackSampler(sources + [merger], args.profile_read, write_interval=5.0)
+        read_sampler.start()
+    return ", ".join(opened)
+
+def connect_acquisition_process():
+    # Same as above, but the boards are read, binned and saved in another process (see acquisitionprocess.py). It opens the session
+    # the window has chosen, and from then on the map drawn here is the one it fills, in shared memory.
+    global acquisition, binner
+    config = {"sources": SOURCES, "simulate": simulated_board(), "numofpoints": numofpoints, "scansize": scansize, "tile": binner.tile,
+              "capacity": 1 << 18, "flush_samples": buferlenght, "clock_offset_ns": local_time_offset(clock),
+              "checkpoint_interval": checkpoint_interval, "report_interval": 1.0, "session": session, "profile": args.profile_read}
+    acquisition = AcquisitionProcess(config, metrics)
+    opened = acquisition.wait_connected()
+    binner = acquisition.map
+    return opened + " in the acquisition process"
 
 ##Gamepad
-# Initialize Pygame for gamepad input
-pygame.init()
-pygame.joystick.init()
-# Check if a gamepad is connected
-if pygame.joystick.get_count() == 0:
-    print("No gamepad detected.")
-try:
+def connect_gamepad():
+    global gamepad, get_events
+    if args.simulate:
+        from simulator import ScriptedGamepad
+        gamepad = ScriptedGamepad(args.script)
+        get_events = gamepad.get_events
+        return "scripted"
+    # Initialize Pygame for gamepad input. This stays on the GUI thread, SDL wants its events pumped by the thread that initialized it.
+    import pygame
+    pygame.init()
+    pygame.joystick.init()
+    # Check if a gamepad is connected
+    if pygame.joystick.get_count() == 0:
+        raise RuntimeError("No gamepad detected")
     # Create a joystick object for the first gamepad
     gamepad = pygame.joystick.Joystick(0)
     gamepad.init()    
     #pygame.joystick.rumble(0,0.7,500)#This makes the joystick vibrate, but I found that it is not supported by all the joysticks I tried, so I leave it out for now.
-except:
-    print("Cannot connect to gamepad.")
+    get_events = pygame.event.get # Button presses and stick moves arrive as events, see gamepadinput.py
+    return gamepad.get_name()
 
 ##Studio
 # Initialize connection with Studio and prepares Studio by changing the User outputs and some imaging/spectroscopy parameters.
-try:
-    studio = nanosurf.Studio()
+segment_timeout = 5.0 # s to wait for Studio to report a segment change before giving up
+segment_poll = 0.02 # s between checks of the segment count
+
+def wait_for_segments(setup, count):
+    # Studio adds and removes segments asynchronously, editing a segment before Studio finished adding it can crash Studio.
+    # So instead of sleeping a fixed time we ask for the segment count until it is what we expect.
+    deadline = time.monotonic() + segment_timeout
+    while setup.segment_count() != count:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Studio did not reach {count} spectroscopy segments")
+        time.sleep(segment_poll)
+
+CALIB_GAIN=-0.5 # User output calibration set in connect_studio, the mosaic uses it to turn the Arduino readings back into positions.
+CALIB_OFFSET=0.25
+
+def connect_studio():
+    global studio, spm
+    if args.simulate:
+        from simulator import FakeStudio
+        studio = FakeStudio(latency=args.latency, move_speed=args.move_speed)
+    else:
+        start = time.perf_counter()
+        import nanosurf
+        log_phase("nanosurf import", start)
+        studio = nanosurf.Studio()
     studio.connect()
     spm = studio.spm
+    cache.spm = spm
+    read_mosaic_origin()
     
     #Choose Position x y and z as outputs of the BNC connectors    
     spm.core.user_out.property.hi_res_input1.value = spm.core.user_out.property.hi_res_input1.ValueEnum.Position_X
@@ -81,34 +228,65 @@ try:
     
     #Then we scale and offset the output so instead of going from -10 to 10V it goes from 0 to 5V (The Arduino only accepts from 0 to 5V).
     #Note that these values are system specific so they could change depending ont he calibration of the system.
-    spm.lu.analog_hi_res_out.user1.attribute.calib_gain.value=-0.5
-    spm.lu.analog_hi_res_out.user1.attribute.calib_offset.value=0.25    
-    spm.lu.analog_hi_res_out.user2.attribute.calib_gain.value=-0.5
-    spm.lu.analog_hi_res_out.user2.attribute.calib_offset.value=0.25    
-    spm.lu.analog_hi_res_out.user3.attribute.calib_gain.value=-0.5
-    spm.lu.analog_hi_res_out.user3.attribute.calib_offset.value=0.25   
+    spm.lu.analog_hi_res_out.user1.attribute.calib_gain.value=CALIB_GAIN
+    spm.lu.analog_hi_res_out.user1.attribute.calib_offset.value=CALIB_OFFSET
+    spm.lu.analog_hi_res_out.user2.attribute.calib_gain.value=CALIB_GAIN
+    spm.lu.analog_hi_res_out.user2.attribute.calib_offset.value=CALIB_OFFSET
+    spm.lu.analog_hi_res_out.user3.attribute.calib_gain.value=CALIB_GAIN
+    spm.lu.analog_hi_res_out.user3.attribute.calib_offset.value=CALIB_OFFSET
     
     #Prepare the spectroscopy routine
     #It is a simple routine that retracts the tip some distance (so it doesn't matter if the system is initially retracted or engaged). Then performs an advance to setpoint, and last another retract to capture advance and retract force vs distance.
     #First removes any existing spectroscopy routine by deleting the segments.
-    while spm.workflow.spectroscopy_setup.segment_count()>0:
-        spm.workflow.spectroscopy_setup.remove_segment(0)
-    time.sleep(1)#It can be faster than this, but I found that python sometimes tries to edit a segment before Studio finished adding it, and this can crash Studio.
-    studio.spm.workflow.spectroscopy_setup.add_new_segment()
-    time.sleep(1)
-    studio.spm.workflow.spectroscopy_setup.transform_segment(0,"ramp_with_fixed_length_retract")
-    time.sleep(1)
-    studio.spm.workflow.spectroscopy_setup.add_new_segment()
-    time.sleep(1)
-    studio.spm.workflow.spectroscopy_setup.transform_segment(1,"ramp_with_setpoint_advance")
-    time.sleep(1)
-    studio.spm.workflow.spectroscopy_setup.segment_configuration(1,r'{"id":"ramp_with_setpoint_advance","property":{"setpoint":{"value":100e-03, "unit":"V"}}}')
-    time.sleep(1)
-    studio.spm.workflow.spectroscopy_setup.add_new_segment()
-    time.sleep(1)
-    studio.spm.workflow.spectroscopy_setup.transform_segment(2,"ramp_with_fixed_length_retract")    
-except:
-    print("Cannot connect with Studio session")
+    setup = spm.workflow.spectroscopy_setup
+    count = setup.segment_count()
+    while count>0:
+        setup.remove_segment(0)
+        count -= 1
+        wait_for_segments(setup, count)
+    setup.add_new_segment()
+    wait_for_segments(setup, 1)
+    setup.transform_segment(0,"ramp_with_fixed_length_retract")
+    setup.add_new_segment() # Studio handles our calls in order, so waiting for this segment also means the transform above is done.
+    wait_for_segments(setup, 2)
+    setup.transform_segment(1,"ramp_with_setpoint_advance")
+    setup.segment_configuration(1,r'{"id":"ramp_with_setpoint_advance","property":{"setpoint":{"value":100e-03, "unit":"V"}}}')
+    setup.add_new_segment()
+    wait_for_segments(setup, 3)
+    setup.transform_segment(2,"ramp_with_fixed_length_retract")
+    wait_for_segments(setup, 3) # One more round trip, so the last transform is done before the first command from the gamepad.
+    return "simulated" if args.simulate else "connected"
+
+# From here on only the executor thread talks to Studio, the GUI hands it commands and gets a future back (see studioexecutor.py).
+executor = None
+# Properties we read are mirrored in the cache (see studiocache.py), our own writes go through it, so most reads never reach Studio.
+cache = None
+cache_refresh_interval = 2.0 # s between refreshes of the cached values, to see changes made in Studio itself
+
+device_pool = None # Only the Arduino connects there, see start_devices.
+
+def start_devices(window):
+    # Connects the Arduino (pool thread), Studio (executor thread, so every Studio command waits for the setup) and the gamepad
+    # (GUI thread, right after the window is shown) at the same time. Each one reports to window.device_ready when done.
+    def connect(name, function):
+        start = time.perf_counter()
+        try:
+            detail = function()
+        except Exception as e:
+            print(f"Cannot connect to {name}: {e}")
+            window.device_ready.emit(name, False, str(e), time.perf_counter() - start)
+        else:
+            window.device_ready.emit(name, True, detail, log_phase(f"{name} connection", start))
+    device_pool.submit(connect, "Arduino", connect_serial)
+    executor.submit(connect, "Studio", connect_studio)
+    QTimer.singleShot(0, lambda: connect("Gamepad", connect_gamepad))
+
+def start_metrics_export():
+    if args.metrics_file:
+        JsonLinesExporter(metrics, args.metrics_file, interval=args.metrics_interval).start()
+    if args.metrics_port:
+        PrometheusServer(metrics, args.metrics_port).start()
+        print(f"Metrics on http://127.0.0.1:{args.metrics_port}/metrics")
 
 #%%%%%%%%%%%%%%%%%%
 # Define functions that will be executed when pressing buttons on the gamepad
@@ -121,16 +299,16 @@ except:
 def decrease_setpoint(): #Reads current setpoint value and decreases it by 10%
     print("Decreasing setpoint") 
     try:
-        currentsetpoint=spm.core.z_controller.property.setpoint.value
-        spm.core.z_controller.property.setpoint.value=currentsetpoint-0.1*currentsetpoint
+        currentsetpoint=cache.get(SETPOINT)
+        cache.set(SETPOINT, currentsetpoint-0.1*currentsetpoint)
     except:
         print("Setpoint not decreased")
 
 def increase_setpoint(): #Reads current setpoint value and increases it by 10%
     print("Increasing setpoint") 
     try:
-        currentsetpoint=spm.core.z_controller.property.setpoint.value
-        spm.core.z_controller.property.setpoint.value=currentsetpoint+0.1*currentsetpoint
+        currentsetpoint=cache.get(SETPOINT)
+        cache.set(SETPOINT, currentsetpoint+0.1*currentsetpoint)
     except:
         print("Setpoint not increased")
 
@@ -164,135 +342,172 @@ def startstop(): #This initiates a spiral scan controlled by the AFM controller,
 def select(): #No function here.
     print("Selecting item")  
     
-def H_curve(): #Experimental feature where the tip moves describing the Hilbert curve.
+def H_curve(): #Experimental feature where the tip moves describing the Hilbert curve. Pressing it again while moving cancels it.
     print("Executing the H curve")  
-    t2 = threading.Thread(target=move_H_curve)
-    t2.start()
-    
-function_dic={'H_curve':H_curve,'decrease_setpoint':decrease_setpoint,'increase_setpoint':increase_setpoint,'Aproach':Aproach,'interact':interact,'Withdraw':Withdraw,'startstop':startstop,'select':select}
-def move_H_curve():
-    #This moves the tip describing the Hilbert curve, a fractal space-filling curve. It is experimental. Starts on the current tip position and moves right and up. Approximately 7 iterations and 4um step covers 100um by 100um   
-    vx=4e-6
-    vy=0
-    #Creates the Hilbert curve internally as a sequence of orders for a "Turtle"
-    hilbert_seq = "a"
-    for _ in range(7):
-        new_seq = ""
-        for char in hilbert_seq:
-            if char == "a":
-                new_seq += "-bF+aFa+Fb-"
-            elif char == "b":
-                new_seq += "+aF-bFb-Fa+"
-            else:
-                new_seq += char
-        hilbert_seq = new_seq
-    #Executes the sequence of Turtle orders
-        x=spm.lu.position_control.instance.attribute.current_pos_x.value
-        y=spm.lu.position_control.instance.attribute.current_pos_y.value        
-    for char in hilbert_seq:
-        newvx=vx
-        newvy=vy
-        if char == "F":
-            #spm.workflow.imaging.property.image_offset_x.value=(x+vx)
-            x=x+vx #Instead of reading the position from the sensor, we use an "ideal position", this reduces the noise in drawing the curve.
-            y=y+vy
-            time.sleep(0.2)
-            spm.lu.position_control.instance.attribute.target_move_pos_x.value=(x)
-            time.sleep(0.2)
-            spm.lu.position_control.instance.attribute.target_move_pos_y.value=(y)
-            time.sleep(0.2)
-            spm.lu.position_control.instance.trigger.move_to_target_fix_speed_xy()
-            time.sleep(0.2)                   
-        elif char == "+":
-            newvx=vy
-            newvy=-vx
-        elif char == "-":        
-            newvx=-vy
-            newvy=vx        
-        vx=newvx
-        vy=newvy
-        
-    
+    start_path('Hilbert')
+
+def path_scan(): #Moves the tip along the path selected in the GUI (Hilbert, Serpentine, Spiral or Fill gaps). Pressing it again cancels it.
+    print(f"Executing the {path_kind} path")
+    start_path(path_kind)
+
+# Paths start at the current tip position and cover a square of path_size to the right and up (the spiral is centered on it).
+path_kind='Hilbert'
+path_size=100e-6 # m
+hilbert_order=5 # 2**5 = 32 points per side
+path_pitch=2e-6 # m between serpentine lines and spiral turns
+# Fill gaps goes through the parts of the map (inside what was visited so far) that have no samples yet, see gapplanner.py.
+gap_min_fill=0.5 # A cell of about path_pitch x path_pitch is a gap if less than this part of its pixels have samples
+path_description='' # What the running path is, for the progress label
+path_runner=None
+path_progress=None # Set by the GUI, called from the path thread with (vertices done, total, seconds left)
+
+def start_path(kind):
+    # Runs on the executor thread. The path itself runs on its own thread and sends each move through the executor.
+    global path_runner, path_description
+    if path_runner is not None and path_runner.is_alive():
+        path_runner.cancel()
+        print("Path cancelled")
+        return
+    x, y = read_position() # Once, before generating the path.
+    read_mosaic_origin()
+    path_description = ''
+    if kind == 'Fill gaps':
+        vertices = plan_fill_gaps(x, y)
+        if len(vertices) == 0:
+            print("No gaps to fill")
+            return
+    elif kind == 'Serpentine':
+        vertices = serpentine_vertices(path_size, path_size, path_pitch, (x, y))
+    elif kind == 'Spiral':
+        vertices = spiral_vertices(path_size/2, path_pitch, (x, y))
+    else:
+        vertices = hilbert_vertices(hilbert_order, path_size/(2**hilbert_order-1), (x, y))
+    vertices = merge_collinear(vertices) # Straight stretches become one move.
+    path_runner = PathExecutor(vertices, lambda x, y: executor.submit(move_to_target, x, y).result(), lambda: executor.submit(read_position).result(), on_progress=path_progress)
+    path_runner.start()
+
+def plan_fill_gaps(x, y):
+    # Pixel i of the map is at the position the Arduino reads for that pixel, with the user output calibration (see mosaic.py), so this
+    # assumes the Position X/Y outputs and the position controller use the same coordinates.
+    global path_description
+    from gapplanner import plan_gaps # Needs scipy, which is slow to import, so only when the first gap path is planned.
+    origin = counts_to_metres(binner.lo, CALIB_GAIN, CALIB_OFFSET)
+    pitch = counts_to_metres(binner.lo + 1/binner.scale, CALIB_GAIN, CALIB_OFFSET) - origin
+    cell = max(1, int(round(path_pitch/abs(pitch))))
+    vertices, info = plan_gaps(binner.count, (x, y), (origin, origin), (pitch, pitch), cell, gap_min_fill)
+    path_description = f"{info['regions']} gaps, "
+    print(f"Fill gaps: {info['gap_cells']} cells in {info['regions']} gaps, {info['length']*1e6:.0f} um of path, planned in {info['planning_seconds']*1000:.0f} ms")
+    return vertices
+
+def move_to_target(x, y): #Starts a move of the position controller, the path executor waits for the readback to get there
+    spm.lu.position_control.instance.attribute.target_move_pos_x.value=x
+    spm.lu.position_control.instance.attribute.target_move_pos_y.value=y
+    spm.lu.position_control.instance.trigger.move_to_target_fix_speed_xy()
+
+def read_position(): #Position readback, always read from Studio
+    return cache.read(POS_X), cache.read(POS_Y)
+
+def read_offset(): #Current x y offset (tip position)
+    return cache.get(OFFSET_X), cache.get(OFFSET_Y)
+
+def set_offset(x, y): #Moves the tip by setting the x y offset, an axis that did not change is not written
+    cache.set(OFFSET_X, x)
+    cache.set(OFFSET_Y, y)
+
+def refresh_cache(): #Runs on the executor now and then, returns the properties Studio changed behind our back
+    changed = cache.refresh(older_than=cache_refresh_interval)
+    if mosaic_origin and any(cache.peek(path, None) is None for path in mosaic_origins[mosaic_origin]):
+        read_mosaic_origin() # Forgotten by an invalidate, the refresh only reads again what is cached.
+    return changed
+
+def read_mosaic_origin(): #Runs on the executor, reads the origin of the mosaic (see mosaic_position) from Studio
+    if mosaic_origin:
+        for path in mosaic_origins[mosaic_origin]:
+            cache.read(path)
+
+function_dic={'H_curve':H_curve,'path_scan':path_scan,'decrease_setpoint':decrease_setpoint,'increase_setpoint':increase_setpoint,'Aproach':Aproach,'interact':interact,'Withdraw':Withdraw,'startstop':startstop,'select':select}
+repeating_actions={'decrease_setpoint','increase_setpoint'} # These fire again while the button is held, the rest once per press.
+invalidating_actions={'Aproach','Withdraw','interact','startstop','H_curve','path_scan'} # Studio changes things on its own after these, so the cache is emptied.
+# Joystick motion (see motioncontrol.py): left stick for fast moves, right stick for fine positioning.
+joystick_deadzone=0.15 # Deflections below this are ignored
+joystick_exponent=2.0 # Response curve, 1 is linear, higher gives finer control for small deflections
+joystick_max_speed=20e-6 # m/s at full left stick
+joystick_fine_speed=1e-6 # m/s at full right stick
+joystick_command_rate=20 # Offset writes per second at most
     
 #%%%%%%%%%%%%%%%%%%
-# Thread to capture data from the AFM, this has several sleep because a code executed later on has to create the newfile before read_AFM can start storing data.
+# Threads to capture data from the AFM, they are started by connect_serial, after the window created the newfile the samples are stored in.
 #%%%%%%%%%%%%%%%%%%
 
-# Thread for reading AFM data
-# Our data will be x y z positions plus a timestamp
-def read_AFM():
-    global Z,idj,idk, buferlenght, ser
-    k = 0
-    time.sleep(1)
-
-    # Initialize DataFrame once
-    data0 = {
-        "X": [],
-        "Y": [],
-        "Z": [],
-        "timestamp": []
-    }
-    df1 = pd.DataFrame(data0)
-
-    while True:
-        try:
-            # Read and decode serial data
-            data = ser.readline().decode().strip()
-            
-            if data:
-                result = [x.strip() for x in data.split(',')]
-                
-                # Ensure correct data length
-                if len(result) != 3:
-                    print(f"Warning: Unexpected data format: {data}")
-                    continue
-                
-                # Convert to float and store
-                x_val = float(result[0])
-                y_val = float(result[1])
-                z_val = float(result[2])
-                
-                data2 = {
-                    "X": [x_val],
-                    "Y": [y_val],
-                    "Z": [z_val],
-                    "timestamp": [datetime.datetime.now()]
-                }
-
-                df2 = pd.DataFrame(data2)
-                df1 = pd.concat([df1, df2], ignore_index=True)  # Efficient appending                
-                k += 1
-
-        except (ValueError, IndexError) as e:
-            print(f"Error parsing data: {data} -> {e}")
-        
-        # Process data when buffer limit is reached
-        # Two things happen here, one is that we save the raw data to a CSV file (could be any of the other formats supported by Pandas, like NHF5, I chosed CSV because it is easily readable).
-        # The other thing is that we asign the data to one of the entries of an array which is 1023 by 1023 pixels (the maximun resolution obtained by the Arduino).
-        # Note: A much universal approach would be to link together the maximun scanrange with the User Output calibration and the Arduino 0-5V input limitation.
-        if k > buferlenght:
-            k = 0
-            xdata = df1["X"].tolist()
-            ydata = df1["Y"].tolist()
-            zdata = df1["Z"].tolist()            
-
-            for i in range(len(xdata)):
-                pos_x = xdata[i]
-                pos_y = ydata[i]
-                pos_z = zdata[i]
-
-                idj = (np.abs(X[0, :] - pos_x)).argmin()
-                idk = (np.abs(Y[:, 0] - pos_y)).argmin()
-
-                Z[idj, idk] =1024-pos_z # The z sensor reading is inverted.
-            
-            df1.to_csv(filepath, mode='a', index=False, header=False)
-            # Reset DataFrame after processing
-            df1 = pd.DataFrame(data0)
-            
-#This initializes and independent thread that will be trying to read data from AFM (throught the Arduino) as fast as possible.
-t1 = threading.Thread(target=read_AFM)
-t1.start()                   
+# Our data will be x y z positions (plus the channels of any other board) and a timestamp.
+# Every board is read by its own thread into its own ring buffer, and the merger lines the boards up in time and puts the combined
+# samples into the ring buffer below (see acquisition.py and ringbuffer.py). The map and the file each have their own reader on it and
+# take everything new in one go.
+clock = None # Readers stamp monotonic time, the file gets local time in ns (like datetime.now() used to give) from this anchor, which is stored with the session.
+ring = None # Created by connect_serial, once we know which boards are there.
+map_reader = None
+file_reader = None
+samples_binned = None
+checkpoint_interval = 30.0 # s between checkpoints of the map, so a session can be resumed quickly (see checkpoint.py)
+flush_time = None
+# Besides the map of the current scan, every sample also goes into the mosaic (see mosaic.py), one map of everything that was scanned in
+# physical coordinates, shown with the mosaic layers of the plot. Not with --acquisition-process, the samples are binned in that process.
+mosaic_pixel=100e-9 # m
+mosaic_origin="offset" # Added to the scan position: None, "offset" (image offset) or "stage" (position controller), whichever the Position X/Y outputs leave out.
+# Read from Studio when it is connected, at the start of a path and after the cache is emptied, and kept fresh by refresh_cache. It stays 0 without Studio.
+mosaic_origins={"offset": (OFFSET_X, OFFSET_Y), "stage": (POS_X, POS_Y)}
+mosaic = None
+
+def flush_samples():
+    # Two things happen here, one is that we hand the raw data to the session writer, which saves it to disk from its own thread (see sessionfile.py, it can also export to CSV).
+    # The other thing is that we bin the data into the pixels of a map which is 1024 by 1024 pixels (the maximun resolution obtained by the Arduino), see binning.py.
+    # Note: A much universal approach would be to link together the maximun scanrange with the User Output calibration and the Arduino 0-5V input limitation.
+    start = time.perf_counter()
+    batch = map_reader.drain()
+    z = 1024-batch["Z"].astype(np.float64) # The z sensor reading is inverted.
+    binner.add(batch["X"], batch["Y"], z)
+    leveler.add(batch["X"], batch["Y"], z) # Running sums for the leveling of the live view, see leveling.py.
+    mosaic.add(*mosaic_position(batch["X"], batch["Y"]), z)
+    samples_binned.inc(len(batch["Z"]))
+
+    writer.submit(file_reader.drain())
+    if checkpointer.due():
+        checkpointer.take(binner, writer) # Copies the map here, between two batches, and saves it on its own thread.
+    flush_time.observe(time.perf_counter() - start)
+
+    lost = sum(ring.overruns().values())
+    if lost > flush_samples.reported_overruns:
+        print(f"Warning: ring buffer overrun, {lost} samples lost so far")
+        flush_samples.reported_overruns = lost
+flush_samples.reported_overruns = 0
+
+def mosaic_position(x, y):
+    # m, from the Arduino readings. The origin is the last value read from Studio (the cache is refreshed every cache_refresh_interval s),
+    # never an RPC, this runs on the merge thread.
+    x0, y0 = (cache.peek(path) for path in mosaic_origins[mosaic_origin]) if mosaic_origin else (0.0, 0.0)
+    return counts_to_metres(x, CALIB_GAIN, CALIB_OFFSET) + x0, counts_to_metres(y, CALIB_GAIN, CALIB_OFFSET) + y0
+
+def stop_acquisition():
+    # On quit: the readers and the merger stop, what they left in the ring is binned and handed to the writer, which writes everything
+    # it has queued and closes the file (its thread is a daemon, so without this the end of the session would be lost). A last
+    # checkpoint is taken before that.
+    if acquisition is not None:
+        acquisition.stop() # The process does the same on its side.
+        return
+    for thread in sources + ([merger] if merger is not None else []):
+        thread.stop()
+    if merger is not None:
+        merger.join()
+        flush_samples()
+    if binner.samples:
+        checkpointer.take(binner, writer, wait=True) # So even a session shorter than checkpoint_interval can be resumed.
+    writer.close()
+    checkpointer.close()
+
+def samples_merged():
+    # Runs on the merge thread after every merged block. Process data when buffer limit is reached.
+    if map_reader.available() > buferlenght:
+        flush_samples()
 
 #%%%%%%%%%%%%%%%%%%
 # GUI and main thread
@@ -300,6 +515,10 @@ t1.start()
 
 # Main window class
 class GamepadMonitor(QWidget):
+    command_done = Signal(str) # Emitted from the executor thread, Qt delivers it to the GUI thread.
+    path_progress = Signal(int, int, float) # Emitted from the path thread.
+    device_ready = Signal(str, bool, str, float) # Device, connected, detail or error, seconds it took. Emitted by start_devices.
+
     def __init__(self):
         super().__init__()
         
@@ -317,34 +536,84 @@ class GamepadMonitor(QWidget):
         
         # Set up control mappings
         control_layout = QVBoxLayout()
+        # One indicator per device, they turn green (or red) as the devices finish connecting (see start_devices).
+        device_layout = QHBoxLayout()
+        self.device_labels = {}
+        self.devices_pending = {'Arduino', 'Gamepad', 'Studio'}
+        for name in ('Arduino', 'Gamepad', 'Studio'):
+            self.device_labels[name] = QLabel(f'{name}: connecting')
+            self.device_labels[name].setStyleSheet('color: gray')
+            device_layout.addWidget(self.device_labels[name])
+        control_layout.addLayout(device_layout)
+        self.device_ready.connect(self.show_device)
         self.create_control_menu(control_layout, 'A', 'decrease_setpoint')
         self.create_control_menu(control_layout, 'B', 'increase_setpoint')
         self.create_control_menu(control_layout, 'X', 'Aproach')
         self.create_control_menu(control_layout, 'Y', 'startstop')
-        self.create_control_menu(control_layout, 'LB', 'Map')
+        self.create_control_menu(control_layout, 'LB', 'select')
         self.create_control_menu(control_layout, 'RB', 'Withdraw')
         self.create_control_menu(control_layout, 'Start','interact')
-        self.create_control_menu(control_layout, 'Select', 'Select')
+        self.create_control_menu(control_layout, 'Select', 'select')
+        self.dispatcher = InputDispatcher(debounce=0.03, hold_delay=0.5, repeat_interval=0.25)
+        self.rebuild_dispatch_table()
+        self.studio_label = QLabel('Studio: idle')
+        control_layout.addWidget(self.studio_label)
+        self.command_done.connect(self.studio_label.setText)
+        # Tip position we are moving to, read once from Studio and then only written.
+        self.motion = MotionController(joystick_deadzone, joystick_exponent, joystick_max_speed, joystick_fine_speed, joystick_command_rate)
+        self.offset_request = None
+        self.cache_label = QLabel('Cache: -')
+        control_layout.addWidget(self.cache_label)
+        self.cache_timer = QTimer(self)
+        self.cache_timer.timeout.connect(self.refresh_cache)
+        self.cache_timer.start(int(cache_refresh_interval*1000))
         control_group = QGroupBox('Control Mappings')
         control_group.setLayout(control_layout)
         self.layout.addWidget(control_group,0,0)
+
+        # Path scans (H_curve and path_scan actions): which path, progress and pause/cancel.
+        path_layout = QVBoxLayout()
+        pathcombobox = QComboBox()
+        pathcombobox.addItems(['Hilbert', 'Serpentine', 'Spiral', 'Fill gaps'])
+        pathcombobox.setCurrentText(path_kind)
+        pathcombobox.currentTextChanged.connect(self.value_pathchanged)
+        path_layout.addWidget(pathcombobox)
+        self.path_bar = QProgressBar()
+        path_layout.addWidget(self.path_bar)
+        self.path_label = QLabel('No path running')
+        path_layout.addWidget(self.path_label)
+        path_buttons = QHBoxLayout()
+        self.pause_button = QPushButton('Pause')
+        self.pause_button.clicked.connect(self.pause_path)
+        path_buttons.addWidget(self.pause_button)
+        cancel_button = QPushButton('Cancel')
+        cancel_button.clicked.connect(self.cancel_path)
+        path_buttons.addWidget(cancel_button)
+        path_layout.addLayout(path_buttons)
+        path_group = QGroupBox('Path')
+        path_group.setLayout(path_layout)
+        self.layout.addWidget(path_group,0,1)
+        global path_progress
+        path_progress = self.path_progress.emit
+        self.path_progress.connect(self.show_path_progress)
         
-        # Add a 2D plot        
-        self.figure = Figure(facecolor='white')
-        self.canvas = FigureCanvas(self.figure)
-        
-        ##self.ax = self.figure.add_subplot(111, projection='3d')
-        self.ax = self.figure.add_subplot(111)
-        
-        self.ax.set_facecolor('white')         # Axes background
-        self.ax.tick_params(colors='black')  # Tick labels
-        self.ax.xaxis.label.set_color('black')  # X-axis label
-        self.ax.yaxis.label.set_color('black')  # Y-axis label
-        for spine in self.ax.spines.values():   # Axes spines
-            spine.set_edgecolor('black')
-        self.ax.set_xlabel("X Axis")
-        self.ax.set_ylabel("Y Axis")
-        self.layout.addWidget(self.canvas,1,0) 
+        # Add a 2D plot. By default it is painted directly with Qt (see rasterview.py), --view matplotlib gives the matplotlib canvas.
+        # Either way it shows only the part of the map inside the axes, from the level of the pyramid (see pyramid.py) that has about
+        # as many pixels as the screen, so drawing it costs the same whatever the zoom and the grid size.
+        self.pyramid = MapPyramid(binner.numofpoints, binner.tile)
+        self.drawn_limits = (xmin, xmax, ymin, ymax)
+        self.drawn_state = None
+        self.frame_time = 0 # Running average of the time to render a frame, in ms.
+        self.contrast = AutoContrast()
+        self.shown_limits = (zmin, zmax)
+        self.leveler_time = 0 # When the leveling sums were last taken from the map of the acquisition process.
+        if args.view == "raster":
+            self.raster = RasterView()
+            self.raster.set_limits(xmin,xmax,ymin,ymax)
+            self.layout.addWidget(self.raster,1,0)
+        else:
+            self.raster = None
+            self.create_figure()
         
         #2D plot interface 
         plot_control_layout = QVBoxLayout()
@@ -352,8 +621,8 @@ class GamepadMonitor(QWidget):
         xminlabel=QLabel('x min')
         plot_control_layout.addWidget(xminlabel) 
         xmindoublespinbox = QDoubleSpinBox()
-        xmindoublespinbox .setMinimum(-50)
-        xmindoublespinbox .setMaximum(50)
+        xmindoublespinbox .setMinimum(-view_range)
+        xmindoublespinbox .setMaximum(view_range)
         xmindoublespinbox .setSingleStep(1)  
         xmindoublespinbox .setDecimals(2)
         xmindoublespinbox .setValue(-50) 
@@ -365,8 +634,8 @@ class GamepadMonitor(QWidget):
         xmaxlabel=QLabel('x max')
         plot_control_layout.addWidget(xmaxlabel) 
         xmaxdoublespinbox = QDoubleSpinBox()
-        xmaxdoublespinbox.setMinimum(-50)
-        xmaxdoublespinbox.setMaximum(50)
+        xmaxdoublespinbox.setMinimum(-view_range)
+        xmaxdoublespinbox.setMaximum(view_range)
         xmaxdoublespinbox.setSingleStep(1)  
         xmaxdoublespinbox.setDecimals(2)
         xmaxdoublespinbox.setValue(50) 
@@ -378,8 +647,8 @@ class GamepadMonitor(QWidget):
         yminlabel=QLabel('y min')
         plot_control_layout.addWidget(yminlabel) 
         ymindoublespinbox = QDoubleSpinBox()
-        ymindoublespinbox.setMinimum(-50)
-        ymindoublespinbox.setMaximum(50)
+        ymindoublespinbox.setMinimum(-view_range)
+        ymindoublespinbox.setMaximum(view_range)
         ymindoublespinbox.setSingleStep(1)  
         ymindoublespinbox.setDecimals(2)
         ymindoublespinbox.setValue(-50) 
@@ -391,8 +660,8 @@ class GamepadMonitor(QWidget):
         ymaxlabel=QLabel('y max')
         plot_control_layout.addWidget(ymaxlabel) 
         ymaxdoublespinbox = QDoubleSpinBox()
-        ymaxdoublespinbox.setMinimum(-50)
-        ymaxdoublespinbox.setMaximum(50)
+        ymaxdoublespinbox.setMinimum(-view_range)
+        ymaxdoublespinbox.setMaximum(view_range)
         ymaxdoublespinbox.setSingleStep(1)  
         ymaxdoublespinbox.setDecimals(2)
         ymaxdoublespinbox.setValue(50) 
@@ -425,9 +694,66 @@ class GamepadMonitor(QWidget):
         doublespinbox2.textChanged.connect(self.value_maxchanged_str)
         plot_control_layout.addWidget(doublespinbox2)  
 
+        layerlabel=QLabel('Layer')
+        plot_control_layout.addWidget(layerlabel)
+        layercombobox = QComboBox()
+        layercombobox.addItems(list(LAYERS))
+        if self.raster is not None and not args.acquisition_process:
+            layercombobox.addItems([f'mosaic {name}' for name in MOSAIC_LAYERS])
+        layercombobox.setCurrentText(maplayer)
+        layercombobox.currentTextChanged.connect(self.value_layerchanged)
+        plot_control_layout.addWidget(layercombobox)
+
+        levelinglabel=QLabel('Leveling')
+        plot_control_layout.addWidget(levelinglabel)
+        levelingcombobox = QComboBox()
+        levelingcombobox.addItems(list(LEVELING))
+        levelingcombobox.setCurrentText(leveling)
+        levelingcombobox.currentTextChanged.connect(self.value_levelingchanged)
+        plot_control_layout.addWidget(levelingcombobox)
+        autocontrastcheckbox = QCheckBox('Auto contrast')
+        autocontrastcheckbox.setChecked(auto_contrast)
+        autocontrastcheckbox.toggled.connect(self.value_autocontrastchanged)
+        plot_control_layout.addWidget(autocontrastcheckbox)
+
+        self.frame_label=QLabel('Frame: - ms')
+        plot_control_layout.addWidget(self.frame_label)
+        self.writer_label=QLabel('Writer queue: 0')
+        plot_control_layout.addWidget(self.writer_label)
+        resume_button = QPushButton('Resume session...')
+        resume_button.clicked.connect(self.choose_session)
+        plot_control_layout.addWidget(resume_button)
+        self.limit_spinboxes = (xmindoublespinbox, xmaxdoublespinbox, ymindoublespinbox, ymaxdoublespinbox)
+        mosaic_fit_button = QPushButton('Show whole mosaic')
+        mosaic_fit_button.clicked.connect(self.fit_mosaic)
+        plot_control_layout.addWidget(mosaic_fit_button)
+        mosaic_save_button = QPushButton('Save mosaic...')
+        mosaic_save_button.clicked.connect(self.save_mosaic)
+        plot_control_layout.addWidget(mosaic_save_button)
+        for button in (mosaic_fit_button, mosaic_save_button):
+            button.setEnabled(self.raster is not None and not args.acquisition_process)
+
         plot_control_group = QGroupBox('Plot Control')
         plot_control_group.setLayout(plot_control_layout)    
         self.layout.addWidget(plot_control_group,1,1) 
+
+        # Stats of the whole pipeline (see metrics.py), to see which stage loses samples or makes the joystick lag.
+        stats_layout = QVBoxLayout()
+        self.stats_label = QLabel('Stats: -')
+        self.stats_label.setStyleSheet('font-family: monospace')
+        self.stats_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        stats_layout.addWidget(self.stats_label)
+        stats_group = QGroupBox('Stats')
+        stats_group.setLayout(stats_layout)
+        self.layout.addWidget(stats_group,2,0,1,2)
+        self.frame_seconds = metrics.histogram("frame_seconds")
+        self.gamepad_interval = metrics.histogram("gamepad_poll_interval_seconds")
+        metrics.gauge("map_torn_tiles_total", lambda: self.pyramid.torn_tiles) # Tile copies redone because samples arrived meanwhile.
+        self.last_poll = None
+        self.last_snapshot = None
+        self.stats_timer = QTimer(self)
+        self.stats_timer.timeout.connect(self.update_stats)
+        self.stats_timer.start(1000)
         
         #Last, we apply the layout to the widget.
         self.setLayout(self.layout)
@@ -435,14 +761,15 @@ class GamepadMonitor(QWidget):
         #These are two threads that run continuosly calling two different functions, one is to update the 2D plot, the other to listen to the gamepad.        
         
         self.graph_timer = QTimer(self)
-        self.graph_timer.setInterval(279)  # Update every half second (change depending on your computer speed)
+        self.graph_timer.setInterval(graph_interval)  # Frames without new data are skipped, so this can be short (see the frame time in the GUI)
         self.graph_timer.timeout.connect(self.update_visualization)
-        self.graph_timer.start()
+        if not args.no_plot:
+            self.graph_timer.start()
         
         #Start polling for gamepad inputs
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.update_gamepad_state)
-        self.timer.start(2)  # Update every 50 ms  
+        self.timer.start(10)  # Buttons are events now, this only has to be fast enough for the joystick and hold repeats
         
     # Useful functions.          
     def value_xminchanged(self, value):
@@ -491,13 +818,58 @@ class GamepadMonitor(QWidget):
     def value_maxchanged_str(self, str_value):
         global zmin,zmax
         zmax=float(str_value)
+
+    def value_pathchanged(self, str_value):
+        global path_kind
+        path_kind=str_value
+
+    def show_path_progress(self, done, total, eta):
+        self.path_bar.setMaximum(total)
+        self.path_bar.setValue(done)
+        if done == total:
+            self.path_label.setText('Path finished')
+        elif not path_runner.running.is_set():
+            self.path_label.setText(f'{path_description}{done}/{total} moves, paused')
+        elif eta == eta: # Not NaN
+            self.path_label.setText(f'{path_description}{done}/{total} moves, {eta:.0f} s left')
+
+    def pause_path(self):
+        if path_runner is None or not path_runner.is_alive():
+            return
+        if path_runner.running.is_set():
+            path_runner.pause()
+            self.pause_button.setText('Resume')
+            self.path_label.setText('Paused')
+        else:
+            path_runner.resume()
+            self.pause_button.setText('Pause')
+
+    def cancel_path(self):
+        if path_runner is not None and path_runner.is_alive():
+            path_runner.cancel()
+            self.pause_button.setText('Pause')
+            self.path_label.setText('Path cancelled')
+
+    def value_layerchanged(self, str_value):
+        global maplayer
+        maplayer=str_value
+        self.contrast.reset()
+
+    def value_levelingchanged(self, str_value):
+        global leveling
+        leveling=str_value
+        self.contrast.reset()
+
+    def value_autocontrastchanged(self, checked):
+        global auto_contrast
+        auto_contrast=checked
+        self.contrast.reset()
         
     #This runs at the beguining, creating a newimagefile.
         
         
     def newimagefile(self):
-        print("New file created")
-        global X, Y, Z,idj,idk, filepath, scansize, x0, y0, buferlenght,zmin,zmax, xmin,xmax,ymin,ymax
+        global scansize, numofpoints, x0, y0, buferlenght,zmin,zmax, xmin,xmax,ymin,ymax, maplayer, graph_interval, view_range, leveling, auto_contrast, map_extent
 
         # Define parameters for the plot
         scansize = 1023
@@ -505,38 +877,87 @@ class GamepadMonitor(QWidget):
         buferlenght=3
         zmin=0
         zmax=1023
+        graph_interval=100 # ms between plot updates
+        map_extent=(-50, 50, -50, 50) # um the whole map covers (xmin, xmax, ymin, ymax), the scan range
         xmin=-50
         xmax=50
         ymin=-50
         ymax=50
-        x = np.linspace(0,1023, numofpoints)
-        y = np.linspace(0,1023, numofpoints)
-        X, Y = np.meshgrid(x, y)
-        Z = np.ones((numofpoints, numofpoints))
-        idj=0
-        idk=0
-        #Initialize data format
-        data1={
-            "X":[],
-            "Y":[],
-            "Z":[],
-            "timestamp":[]
-        }    
-        df1=pd.DataFrame(data1)
-        df3=pd.DataFrame(data1)
-        data2={
-            "X":[np.nan],
-            "Y":[np.nan],
-            "Z":[np.nan],
-            "timestamp":[np.nan]
-        }
-        df2=pd.DataFrame(data2)
-
-        #To save the dataframe to CSV
-        t=datetime.datetime.now()
-        filename=t.strftime('%Y_%m_%d_%H_%M_%S')
-        filepath = Path(filename+'.csv') 
-        df1.to_csv(filepath,index=False)
+        maplayer="mean"
+        leveling="none" # Tilt or line offsets taken out of the live view, see leveling.py
+        auto_contrast=False # Z limits from the percentiles of the shown values instead of Z min/Z max
+        view_range=5000 # um, how far the plot limits go (the mosaic can be larger than the scan range)
+
+        resume = args.resume
+        if resume == "latest":
+            resume = latest_resumable()
+            if resume is None:
+                print("No session with a checkpoint to resume, starting a new one")
+        elif resume is None and latest_resumable() is not None:
+            print(f"Session {latest_resumable()} can be continued with --resume or the Resume session button")
+        self.open_session(resume)
+
+    def open_session(self, resume=None):
+        # Starts a new session file, or continues the given one from its last checkpoint (see checkpoint.py). The new binner and writer
+        # replace the old ones, then the writer thread of the previous session finishes what it has queued and closes it.
+        # With --acquisition-process the acquisition process does all of this, here we only tell it which file to use.
+        global binner, writer, filepath, checkpointer, session, leveler
+        old_writer, old_checkpointer = globals().get('writer'), globals().get('checkpointer')
+        metadata = {"numofpoints": numofpoints, "scansize": scansize, "clock": clock}
+        if resume is not None:
+            new_path = Path(resume)
+        else:
+            t=datetime.datetime.now()
+            filename=t.strftime('%Y_%m_%d_%H_%M_%S')
+            new_path = Path(filename+'.npys') 
+        if args.acquisition_process:
+            session = (str(new_path), metadata, resume is not None) # Opened by the process when it starts, see connect_acquisition_process.
+            if acquisition is not None:
+                acquisition.open(*session)
+            new_binner = acquisition.map if acquisition is not None else PixelBinner(numofpoints, 0, scansize)
+            new_writer = new_checkpointer = RemoteSession(metrics)
+        elif resume is not None:
+            start = time.perf_counter()
+            new_binner, replayed = resume_session(resume)
+            new_writer = SessionWriter(new_path, metadata=metadata, metrics=metrics, resume=True)
+            new_checkpointer = Checkpointer(new_path, checkpoint_interval)
+            print(f"Resumed {new_path}: {new_binner.samples} samples, {replayed} of them replayed after the checkpoint, in {(time.perf_counter() - start)*1000:.0f} ms")
+        else:
+            new_binner = PixelBinner(numofpoints, 0, scansize)
+            new_writer = SessionWriter(new_path, metadata=metadata, metrics=metrics)
+            new_checkpointer = Checkpointer(new_path, checkpoint_interval)
+            print("New file created")
+        new_leveler = Leveler.from_binner(new_binner) # Empty for a new session, from the map for a resumed one.
+        binner, writer, filepath, checkpointer, leveler = new_binner, new_writer, new_path, new_checkpointer, new_leveler
+        if old_writer is not None:
+            old_writer.close()
+            old_checkpointer.close()
+
+    def choose_session(self):
+        latest = latest_resumable()
+        path, _ = QFileDialog.getOpenFileName(self, 'Resume session', str(latest or '.'), 'Sessions (*.npys)')
+        if not path:
+            return
+        if Path(path).resolve() == filepath.resolve():
+            return # Already the current session.
+        if read_pointer(path) is None:
+            self.writer_label.setText(f'{Path(path).name} has no checkpoint')
+            return
+        self.open_session(path)
+
+    def fit_mosaic(self):
+        # Sets the plot limits to everything the mosaic holds so far, then select a mosaic layer to see it.
+        bounds = mosaic.bounds()
+        if bounds is None:
+            return
+        for spinbox, value in zip(self.limit_spinboxes, bounds):
+            spinbox.setValue(value*1e6)
+
+    def save_mosaic(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Save mosaic', 'mosaic.npz', 'Mosaic (*.npz)')
+        if path:
+            mosaic.save(path) # MosaicMap.load reads it back.
+            self.writer_label.setText(f'Mosaic saved to {Path(path).name}')
 
     def create_control_menu(self, layout, control_name, default_action):
         """Creates a control menu with a dropdown for each button."""
@@ -552,100 +973,316 @@ class GamepadMonitor(QWidget):
         h_layout.addWidget(combo_box)
 
         setattr(self, f'{control_name}_menu', combo_box)
+        combo_box.currentTextChanged.connect(self.rebuild_dispatch_table)
         layout.addLayout(h_layout)
 
     
 
+    def rebuild_dispatch_table(self, *_):
+        # Button number -> (function, repeats) from the current combo box choices, only rebuilt when a choice changes.
+        table = {}
+        for control_name, button in BUTTONS.items():
+            menu = getattr(self, f'{control_name}_menu', None)
+            if menu is not None and menu.currentText() in function_dic:
+                table[button] = (functools.partial(self.run_command, menu.currentText()), menu.currentText() in repeating_actions)
+        self.dispatcher.set_table(table)
+
+    def run_command(self, name):
+        # Button actions run on the executor thread, the label shows when they are done.
+        self.studio_label.setText(f'Studio: {name}...')
+        future = executor.submit(function_dic[name])
+        future.add_done_callback(lambda f: self.command_done.emit(self.describe(name, f)))
+        if name in invalidating_actions:
+            executor.submit(cache.invalidate)
+            executor.submit(read_mosaic_origin) # The mosaic needs it on the merge thread, where it can't be read.
+            self.resync_position() # Read the position again before the next joystick move.
+
+    def describe(self, name, future):
+        if future.cancelled():
+            return f'Studio: {name} skipped'
+        if future.exception() is not None:
+            return f'Studio: {name} failed ({future.exception()})'
+        return f'Studio: {name} done'
+
+    def refresh_cache(self):
+        # Slow background refresh of the cached Studio values. If the offset was changed outside this program, start from there.
+        future = executor.submit(refresh_cache, key='refresh_cache')
+        future.add_done_callback(self.cache_refreshed)
+        stats = cache.stats()
+        self.cache_label.setText(f"Cache: {stats['hits']} hits, {stats['misses']} misses, {stats['writes']} writes ({stats['skipped_writes']} skipped)")
+
+    def cache_refreshed(self, future):
+        if not future.cancelled() and future.exception() is None and (OFFSET_X in future.result() or OFFSET_Y in future.result()):
+            self.resync_position()
+
+    def resync_position(self):
+        self.motion.position = None
+        self.offset_request = None
+
+    def show_device(self, name, connected, detail, seconds):
+        label = self.device_labels[name]
+        if connected:
+            label.setText(f'{name}: ready ({seconds:.1f} s)')
+            label.setStyleSheet('color: green')
+        else:
+            label.setText(f'{name}: failed')
+            label.setStyleSheet('color: red')
+        label.setToolTip(detail)
+        self.devices_pending.discard(name)
+        if not self.devices_pending:
+            log_phase("startup (all devices reported)", startup_t0)
+
     def update_gamepad_state(self):
-        global t1,t2,x
-        pygame.event.pump()  # Process events
-
-        # Button states
-        button_states = {
-            'A': gamepad.get_button(1),
-            'B': gamepad.get_button(0),
-            'X': gamepad.get_button(3),
-            'Y': gamepad.get_button(2),
-            'Plus': gamepad.get_button(7),
-            'Minus': gamepad.get_button(6),
-            'Home': gamepad.get_button(10),
-            'Capture': gamepad.get_button(10),
-            'L': gamepad.get_button(4),
-            'ZL': gamepad.get_button(8),
-            'R': gamepad.get_button(5),
-            'ZR': gamepad.get_button(9),
-        }
-
-        # Update button trigger actions
-        for button, state in button_states.items():
-            
-            if state:  # If the button is pressed
-                action = getattr(self, f'{button}_menu', None)
-                if action:
-                    action = action.currentText()
-                    if action == "H_curve":
-                        H_curve()
-                    elif action == "decrease_setpoint":
-                        decrease_setpoint()
-                    elif action == "increase_setpoint":
-                        increase_setpoint()
-                    elif action == "Aproach":
-                        Aproach()
-                    elif action == "interact":
-                        interact()
-                    elif action == "Withdraw":
-                        Withdraw()
-                    elif action == "startstop":
-                        startstop()
-                    elif action == "Select":
-                        select()
-
-        # Joystick positions
-        left_x = gamepad.get_axis(0)
-        left_y = gamepad.get_axis(1)
-        try:            
-            offsetx=spm.workflow.imaging.property.image_offset_x.value #read x offset
-            offsety=spm.workflow.imaging.property.image_offset_y.value #read y offset
-            t2=datetime.datetime.now()
-            x=t2-t1
-            if x.microseconds>100:
-                t1=datetime.datetime.now()
-                if left_x>0.5:                    
-                    spm.workflow.imaging.property.image_offset_x.value=offsetx+0.5e-6 #Set x offset
-                if left_x<-0.5:
-                    spm.workflow.imaging.property.image_offset_x.value=offsetx-0.5e-6 #Set x offset
-                if left_y>0.5:
-                    spm.workflow.imaging.property.image_offset_y.value=offsety-0.5e-6 #Set y offset
-                if left_y<-0.5:
-                    spm.workflow.imaging.property.image_offset_y.value=offsety+0.5e-6 #Set y offset
-        except:
-                print("Couldn't move the tip")
-        # Button joystick positions (nothing is done here at the moment).        
-        right_x = gamepad.get_axis(2)
-        right_y = gamepad.get_axis(3)       
-        
+        # Time between polls, should stay near 10 ms. More means the GUI thread is busy and the joystick lags.
+        now = time.perf_counter()
+        if self.last_poll is not None:
+            self.gamepad_interval.observe(now - self.last_poll)
+        self.last_poll = now
+        # Button presses run their action once (see gamepadinput.py), stick moves update the axis values.
+        self.dispatcher.handle(get_events())
 
-    def update_visualization(self):
+        # Joystick positions, right stick for fine positioning
+        left_x = self.dispatcher.axis(0)
+        left_y = self.dispatcher.axis(1)
+        right_x = self.dispatcher.axis(2)
+        right_y = self.dispatcher.axis(3)
+        # The position is read from Studio once, after that the motion controller keeps the target and we only send writes. Writes that
+        # are still waiting when the next one comes are replaced by it, so Studio always gets the latest target and never a backlog.
+        if self.motion.position is None:
+            if spm is None: # Studio not connected (yet)
+                return
+            if self.offset_request is None:
+                self.offset_request = executor.submit(read_offset, key='read_offset')
+            elif self.offset_request.done():
+                try:
+                    self.motion.set_position(*self.offset_request.result())
+                except Exception:
+                    print("Couldn't read the tip position")
+                    self.offset_request = None
+            return
+        target = self.motion.update(left_x, left_y, right_x, right_y)
+        if target is not None:
+            future = executor.submit(set_offset, *target, key='offset')
+            future.add_done_callback(lambda f: print("Couldn't move the tip") if not f.cancelled() and f.exception() else None)       
+        
 
-        self.ax.clear()
-        # Update plot with new colormap limits
-        RZ = ndimage.rotate(Z, 90)
-        self.ax.imshow(RZ, cmap='viridis', vmin=zmin, vmax=zmax,extent=[-50,50,-50,50])
-        #self.ax.imshow(Z2, cmap='hot', alpha=0.9) #To overlay another image semitransparent.
-        self.ax.plot([-50, 50], [100/1023*idk-50, 100/1023*idk-50], color='red', lw=0.5)  # Horizontal line marking last point
-        self.ax.plot([100/1023*idj-50, 100/1023*idj-50], [-50, 50], color='red', lw=0.5)  # Vertical line marking last point
+    def create_figure(self):
+        # The matplotlib version of the plot (--view matplotlib).
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+        from matplotlib.figure import Figure
+        self.figure = Figure(facecolor='white')
+        self.canvas = FigureCanvas(self.figure)
+        
+        ##self.ax = self.figure.add_subplot(111, projection='3d')
+        self.ax = self.figure.add_subplot(111)
+        
+        self.ax.set_facecolor('white')         # Axes background
+        self.ax.tick_params(colors='black')  # Tick labels
+        self.ax.xaxis.label.set_color('black')  # X-axis label
+        self.ax.yaxis.label.set_color('black')  # Y-axis label
+        for spine in self.ax.spines.values():   # Axes spines
+            spine.set_edgecolor('black')
         self.ax.set_xlabel("X Axis")
         self.ax.set_ylabel("Y Axis")
-        # Normalize color mapping
         self.ax.set_xlim(xmin,xmax)
-        self.ax.set_ylim(ymin,ymax)      
-    
-        self.canvas.draw()
-        # Update GUI
-        self.update()    
-
-# Create application and window
-app = QApplication(sys.argv)
-window = GamepadMonitor()
-window.show()
-sys.exit(app.exec())
\ No newline at end of file
+        self.ax.set_ylim(ymin,ymax)
+        self.layout.addWidget(self.canvas,1,0) 
+
+        # The image and the cursor lines are created once and only their data is changed afterwards. They are "animated", so a full
+        # canvas.draw() only paints the axes and ticks, which we keep as background, and each frame just blits the image and lines on top.
+        # Z is stored as Z[x index, y index], its transpose with origin='lower' shows x to the right and y up without copying the map.
+        self.image = self.ax.imshow(self.pyramid.levels[-1].T, cmap='viridis', vmin=zmin, vmax=zmax, extent=list(map_extent), origin='lower', interpolation='nearest', animated=True)
+        #self.ax.imshow(Z2, cmap='hot', alpha=0.9) #To overlay another image semitransparent.
+        self.hline, = self.ax.plot(map_extent[:2], [0, 0], color='red', lw=0.5, animated=True)  # Horizontal line marking last point
+        self.vline, = self.ax.plot([0, 0], map_extent[2:], color='red', lw=0.5, animated=True)  # Vertical line marking last point
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        # A full redraw happened (start up, resize, axis limits changed): keep the new background, the next timer tick paints the image
+        # and lines on it (blitting from inside the paint event would be a recursive repaint).
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.drawn_state = None
+
+    def blit_artists(self):
+        self.canvas.restore_region(self.background)
+        self.ax.draw_artist(self.image)
+        self.ax.draw_artist(self.hline)
+        self.ax.draw_artist(self.vline)
+        self.canvas.blit(self.ax.bbox)
+
+    def update_stats(self):
+        if acquisition is not None:
+            acquisition.poll() # Its metrics snapshot, and news about the session file.
+        snapshot = metrics.snapshot()
+        rate = rates(self.last_snapshot, snapshot)
+        self.last_snapshot = snapshot
+        gauges, counters, histograms = snapshot['gauges'], snapshot['counters'], snapshot['histograms']
+        def ms(name, key='p90'):
+            value = histograms.get(name, {}).get(key)
+            return '-' if value is None else f'{value*1000:.1f}'
+        lines = []
+        if acquisition is not None and acquisition.error:
+            lines.append(f"Acquisition process: {acquisition.error}")
+        for name in (acquisition.sources if acquisition is not None else [reader.source for reader in sources]):
+            label = f'{{source="{name}"}}'
+            lines.append(f"{name[:8]:8s} {rate.get('serial_lines_total' + label, 0):9.0f} samples/s  {rate.get('serial_parse_errors_total' + label, 0):6.1f} errors/s  ({gauges.get('serial_parse_errors_total' + label)} errors)  backlog {gauges.get('source_backlog' + label)}  lost {gauges.get('source_overruns_total' + label)}")
+        lines += [
+            f"Merge    {rate.get('merged_samples_total', 0):9.0f} samples/s  lag p90 {ms('merge_lag_seconds')} ms  {gauges.get('merged_stale_samples_total', 0)} without fresh values of all boards",
+            f"Binning  {rate.get('samples_binned_total', 0):9.0f} samples/s  flush p90 {ms('flush_seconds')} ms  backlog {gauges['ring_backlog']}  lost {gauges['ring_overruns_total']}",
+            f"Writer   {rate.get('writer_bytes_total', 0)/1e6:9.2f} MB/s  queue {gauges['writer_queue']}  chunk p90 {ms('writer_chunk_seconds')} ms  dropped {gauges['writer_dropped_samples_total']}",
+            f"Frame    p50 {ms('frame_seconds', 'p50')} ms  p90 {ms('frame_seconds')} ms  max {ms('frame_seconds', 'max')} ms  gamepad poll interval p90 {ms('gamepad_poll_interval_seconds')} ms",
+            f"Studio   queue {gauges['studio_queue']}",
+        ]
+        for name, values in sorted(histograms.items()):
+            if name.startswith(('studio_rpc_seconds', 'studio_command_seconds')) and values['count']:
+                label = name.partition('{')[2].rstrip('}').replace('"', '').replace('path=', '').replace('command=', '').replace('op=', '').replace(',', ' ')
+                lines.append(f"  {label[-60:]:60s} {values['count']:6d}x  p50 {values['p50']*1000:7.1f} ms  p90 {values['p90']*1000:7.1f} ms")
+        self.stats_label.setText('\n'.join(lines))
+
+    def update_visualization(self):
+        start = time.perf_counter()
+        self.writer_label.setText(f'Writer queue: {writer.queue_depth()} (max {writer.max_depth}), {writer.bytes_written/1e6:.1f} MB, {writer.dropped_samples} dropped')
+        limits = (xmin, xmax, ymin, ymax)
+        if limits != self.drawn_limits:
+            if self.raster is not None:
+                self.raster.set_limits(*limits)
+            else:
+                # New axis limits change the ticks, so this needs a full redraw (on_draw paints the image on top).
+                self.ax.set_xlim(xmin,xmax)
+                self.ax.set_ylim(ymin,ymax)
+                self.background = None
+            self.drawn_limits = limits
+            self.drawn_state = None
+        if maplayer.startswith('mosaic'):
+            self.show_mosaic(maplayer.split()[1])
+            return
+        state = (id(binner), binner.version, maplayer, zmin, zmax, leveling, auto_contrast)
+        if state == self.drawn_state:
+            return # Nothing new to show.
+        self.drawn_state = state
+
+        # Update plot with new data and colormap limits
+        self.pyramid.update(binner, maplayer) # Only the tiles that got samples since the last frame.
+        if self.raster is not None:
+            rect = self.raster.plot_rect()
+            level, data, extent = self.pyramid.select((xmin, xmax), (ymin, ymax), rect.width(), rect.height(), map_extent)
+            data = self.leveled(data, extent)
+            self.raster.set_map(data, extent, *self.shown_limits)
+            self.raster.set_cursor(*self.cursor_position())
+            self.raster.repaint() # Right away, so the frame time includes the painting.
+        else:
+            level, data, extent = self.pyramid.select((xmin, xmax), (ymin, ymax), self.ax.bbox.width, self.ax.bbox.height, map_extent)
+            data = self.leveled(data, extent)
+            self.image.set_data(data.T)
+            self.image.set_extent(extent)
+            self.image.set_clim(*self.shown_limits)
+            x, y = self.cursor_position()
+            self.hline.set_ydata([y, y])
+            self.vline.set_xdata([x, x])
+            if self.background is None:
+                self.canvas.draw() # on_draw runs and the next tick blits.
+            else:
+                self.blit_artists()
+
+        frame_time = (time.perf_counter() - start)*1000
+        self.frame_seconds.observe(frame_time/1000)
+        self.frame_time = frame_time if self.frame_time == 0 else 0.9*self.frame_time + 0.1*frame_time
+        self.frame_label.setText(f'Frame: {self.frame_time:.1f} ms, {data.shape[0]}x{data.shape[1]} pixels of level {level}'
+                                 + (f', Z {self.shown_limits[0]:.1f} to {self.shown_limits[1]:.1f}' if auto_contrast else ''))
+
+    def leveled(self, data, extent):
+        # The shown part of the map with the leveling taken out, and the Z limits to show it with (in self.shown_limits). The fit only
+        # uses the running sums, so this costs one pass over the shown pixels whatever the number of samples.
+        global leveler
+        self.shown_limits = (zmin, zmax)
+        if maplayer == 'count':
+            return data
+        if acquisition is not None and leveling != 'none' and time.monotonic() - self.leveler_time > 1:
+            leveler = Leveler.from_binner(binner) # The samples are binned in the acquisition process, so the sums come from its map.
+            self.leveler_time = time.monotonic()
+        data = leveler.apply(data, extent, leveling, map_extent)
+        if auto_contrast:
+            self.shown_limits = self.contrast.update(data) or self.shown_limits
+        return data
+
+    def cursor_position(self):
+        # Centre of the pixel of the last sample, in the units of the axes.
+        x0, x1, y0, y1 = map_extent
+        n = binner.numofpoints
+        return x0 + (binner.idj + 0.5)*(x1 - x0)/n, y0 + (binner.idk + 0.5)*(y1 - y0)/n
+
+    def show_mosaic(self, layer):
+        # The mosaic in um, with the same limits as the map. It is in physical coordinates, so it is mirrored compared to the map of the
+        # scan when the calibration gain is negative (the map is drawn in Arduino counts).
+        state = ('mosaic', mosaic.version, layer, zmin, zmax)
+        if state == self.drawn_state:
+            return
+        self.drawn_state = state
+        start = time.perf_counter()
+        rect = self.raster.plot_rect()
+        data, extent = mosaic.render((xmin*1e-6, xmax*1e-6), (ymin*1e-6, ymax*1e-6), rect.width(), rect.height(), layer)
+        self.raster.set_map(data, tuple(value*1e6 for value in extent), zmin, zmax)
+        x, y = mosaic_position(binner.lo + binner.idj/binner.scale, binner.lo + binner.idk/binner.scale) # Pixel indices back to Arduino counts.
+        self.raster.set_cursor(x*1e6, y*1e6)
+        self.raster.repaint()
+        frame_time = (time.perf_counter() - start)*1000
+        self.frame_seconds.observe(frame_time/1000)
+        self.frame_time = frame_time if self.frame_time == 0 else 0.9*self.frame_time + 0.1*frame_time
+        self.frame_label.setText(f'Frame: {self.frame_time:.1f} ms, mosaic {data.shape[0]}x{data.shape[1]} pixels, {len(mosaic.tiles)} tiles, {mosaic.nbytes/1e6:.1f} MB')
+
+#%%%%%%%%%%%%%%%%%%
+# Start up
+#%%%%%%%%%%%%%%%%%%
+
+def setup(argv=None):
+    # Reads the command line and creates what the window and the devices share: the metrics, the Studio executor and cache, the
+    # connect pool and the mosaic. Not done at import, so importing this file (benchmark.py does) starts nothing. Returns the
+    # options meant for Qt.
+    global args, metrics, executor, cache, device_pool, clock, samples_binned, flush_time, mosaic
+    log_phase("imports", startup_t0)
+    args, qt_args = parse_arguments(argv)
+    if args.second_board:
+        SOURCES.append(SECOND_BOARD)
+    metrics = Metrics()
+    executor = StudioExecutor(metrics=metrics)
+    cache = PropertyCache(None, max_age=5.0, metrics=metrics) # Gets spm once Studio is connected.
+    device_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="connect")
+    clock = clock_anchor()
+    samples_binned = metrics.counter("samples_binned_total")
+    flush_time = metrics.histogram("flush_seconds")
+    mosaic = MosaicMap(mosaic_pixel)
+    metrics.gauge("mosaic_tiles", lambda: len(mosaic.tiles))
+    metrics.gauge("mosaic_bytes", lambda: mosaic.nbytes)
+    metrics.gauge("ring_backlog", lambda: map_reader.available())
+    metrics.gauge("ring_overruns_total", lambda: sum(ring.overruns().values()))
+    metrics.gauge("writer_queue", lambda: writer.queue_depth())
+    metrics.gauge("writer_bytes_total", lambda: writer.bytes_written)
+    metrics.gauge("writer_dropped_samples_total", lambda: writer.dropped_samples)
+    metrics.gauge("studio_queue", executor.queue_depth)
+    metrics.gauge("checkpoints_total", lambda: checkpointer.saved)
+    metrics.gauge("checkpoint_save_seconds", lambda: checkpointer.save_time)
+    return qt_args
+
+def main(argv=None):
+    qt_args = setup(argv)
+    start = time.perf_counter()
+    app = QApplication([sys.argv[0]] + qt_args)
+    window = GamepadMonitor()
+    window.show()
+    log_phase("window", start)
+    start_devices(window)
+    start_metrics_export()
+    if args.run_seconds:
+        QTimer.singleShot(int(args.run_seconds*1000), app.quit)
+    code = app.exec()
+    stop_acquisition()
+    if read_sampler is not None:
+        read_sampler.stop()
+        read_sampler.join()
+        print(f"Acquisition profile saved to {args.profile_read} ({read_sampler.samples} samples)")
+    return code
+
+# Only when run as a script, benchmark.py imports this file, calls setup() and makes its own window.
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+#Event driven gamepad buttons: actions fire once when a button goes down instead of on every poll while it is held.
+#pygame already queues JOYBUTTONDOWN/JOYBUTTONUP/JOYAXISMOTION events, so the GUI only has to hand them over here. Presses that follow
+#a release within the debounce time are ignored (contact bounce). Actions listed as repeating (e.g. setpoint steps) fire again after
+#the button has been held for hold_delay, then every repeat_interval, like a keyboard key. The button -> function table is built once
+#from the combo boxes and rebuilt only when one of them changes.
+
+#Event types of pygame 2 (pygame.JOYAXISMOTION...). They are written out instead of imported so that importing this module does not
+#load pygame, which takes a while and is only needed once a real gamepad is connected.
+JOYAXISMOTION, JOYBUTTONDOWN, JOYBUTTONUP = 1536, 1539, 1540
+
+import time
+
+# Button number of each control name of the GUI (as reported by pygame for the gamepads we use).
+BUTTONS = {'A': 1, 'B': 0, 'X': 3, 'Y': 2, 'LB': 4, 'RB': 5, 'Start': 7, 'Select': 6, 'ZL': 8, 'ZR': 9, 'Home': 10}
+
+
+class InputDispatcher:
+    def __init__(self, debounce=0.03, hold_delay=0.5, repeat_interval=0.25):
+        self.debounce = debounce
+        self.hold_delay = hold_delay
+        self.repeat_interval = repeat_interval
+        self.table = {} #button number -> (function, repeats while held)
+        self.held = {} #button number -> time of the next repeat (None if the action does not repeat)
+        self.last_change = {} #button number -> time of the last accepted press or release
+        self.axes = {} #axis number -> last value
+        self.fired = 0 #Number of actions run, to check that one press gives one action.
+
+    def set_table(self, table):
+        #table: button number -> (function, repeats). Buttons held at that moment keep their state but use the new functions.
+        self.table = dict(table)
+
+    def handle(self, events, now=None):
+        #Processes a list of pygame (or simulated) events and the hold repeats that are due.
+        now = time.monotonic() if now is None else now
+        for event in events:
+            if event.type == JOYBUTTONDOWN:
+                self.press(event.button, now)
+            elif event.type == JOYBUTTONUP:
+                self.release(event.button, now)
+            elif event.type == JOYAXISMOTION:
+                self.axes[event.axis] = event.value
+        self.repeat(now)
+
+    def press(self, button, now):
+        if button in self.held or now - self.last_change.get(button, -1e9) < self.debounce:
+            return
+        self.last_change[button] = now
+        function, repeats = self.table.get(button, (None, False))
+        self.held[button] = now + self.hold_delay if repeats else None
+        self.fire(function)
+
+    def release(self, button, now):
+        if self.held.pop(button, False) is not False:
+            self.last_change[button] = now
+
+    def repeat(self, now):
+        for button, next_time in self.held.items():
+            if next_time is not None and now >= next_time:
+                self.held[button] = max(next_time + self.repeat_interval, now)
+                self.fire(self.table.get(button, (None, False))[0])
+
+    def fire(self, function):
+        if function is None:
+            return
+        self.fired += 1
+        function()
+
+    def axis(self, axis):
+        return self.axes.get(axis, 0.0)
@@ -0,0 +1,114 @@
+#Planner that sends the tip to the parts of the map that have not been visited yet.
+#The hit counts of the map are reduced to a coarse grid of cells (about one tip path pitch each), a cell with too few visited pixels is a
+#gap, and the gaps are grouped into regions with connected-component labelling (scipy.ndimage.label). The regions are put in order with
+#a nearest neighbour tour from the current position, improved with 2-opt, and each region is covered with a serpentine through the
+#centres of its cells. The result is a list of vertices for scanpaths.PathExecutor, which moves through them with the position
+#controller and reports the progress and time left.
+#Only gaps inside the bounding box of what was visited are planned, so the planner fills holes instead of the whole scanner range.
+
+import time
+import numpy as np
+from scipy import ndimage
+
+
+def gap_cells(count, cell=16, min_fill=0.5):
+    #Boolean grid of cells (cell x cell pixels of count) where less than min_fill of the pixels have samples, limited to the bounding
+    #box of the visited cells. Returns the grid and the offset (in cells) of its first cell.
+    n = len(count)//cell
+    visited = np.asarray(count[:n*cell, :n*cell]) > 0
+    fill = visited.reshape(n, cell, n, cell).mean(axis=(1, 3))
+    touched = np.argwhere(fill > 0)
+    if len(touched) == 0:
+        return np.zeros((0, 0), dtype=bool), (0, 0)
+    (i0, j0), (i1, j1) = touched.min(axis=0), touched.max(axis=0) + 1
+    return fill[i0:i1, j0:j1] < min_fill, (int(i0), int(j0))
+
+
+def nearest_neighbour(points, start):
+    #Greedy open tour through points starting from start, as indices into points.
+    left = np.ones(len(points), dtype=bool)
+    order = np.empty(len(points), dtype=np.intp)
+    here = np.asarray(start, dtype=np.float64)
+    for k in range(len(points)):
+        distance = np.hypot(*(points - here).T)
+        distance[~left] = np.inf
+        nearest = int(np.argmin(distance))
+        order[k] = nearest
+        left[nearest] = False
+        here = points[nearest]
+    return order
+
+
+def two_opt(points, order, start, max_passes=20):
+    #Improves the open tour start -> points[order] by reversing stretches of it while that makes it shorter (the start stays fixed,
+    #the end is free). Every candidate reversal of one stretch start is evaluated at once.
+    route = np.vstack((np.asarray(start, dtype=np.float64)[None, :], points[order]))
+    order = np.array(order)
+    n = len(route)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n - 1):
+            a, b = route[i - 1], route[i]
+            c = route[i + 1:]
+            d = route[i + 2:]
+            #Reversing route[i:j + 1] swaps the edges (a, b), (c, d) for (a, c), (b, d). For the last j there is no d.
+            delta = np.hypot(*(c - a).T) - np.hypot(*(b - a).T)
+            delta[:-1] += np.hypot(*(d - b).T) - np.hypot(*(d - c[:-1]).T)
+            j = int(np.argmin(delta))
+            if delta[j] < -1e-12:
+                j += i + 1
+                route[i:j + 1] = route[i:j + 1][::-1].copy()
+                order[i - 1:j] = order[i - 1:j][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return order
+
+
+def serpentine_cells(cells, entry):
+    #Cell centres of one region, row by row (along the first index) in alternating directions, starting from the corner closest to
+    #entry (in cell units).
+    cells = cells[np.lexsort((cells[:, 0], cells[:, 1]))]
+    best = None
+    for flip_rows in (False, True):
+        for flip_first in (False, True):
+            rows = np.unique(cells[:, 1])[::-1] if flip_rows else np.unique(cells[:, 1])
+            parts = []
+            for k, row in enumerate(rows):
+                part = cells[cells[:, 1] == row]
+                parts.append(part[::-1] if (k % 2 == 1) != flip_first else part)
+            path = np.concatenate(parts)
+            distance = np.hypot(*(path[0] - entry))
+            if best is None or distance < best[0]:
+                best = (distance, path)
+    return best[1]
+
+
+def plan_gaps(count, position, origin, pitch, cell=16, min_fill=0.5, min_cells=1):
+    #Vertices (m) of a path from position through every gap of the map. count is the hit count layer (indexed [x, y]), and pixel (i, j)
+    #of it is at origin + pitch*(i, j) for the position controller (pitch may be negative). Regions smaller than min_cells cells are
+    #left out. Returns the vertices and a dict with the numbers of the plan.
+    start = time.perf_counter()
+    gaps, (i0, j0) = gap_cells(count, cell, min_fill)
+    labels, regions = ndimage.label(gaps)
+    origin = np.asarray(origin, dtype=np.float64)
+    pitch = np.asarray(pitch, dtype=np.float64)
+    #Positions of cell centres, and the current position in cell units.
+    to_position = lambda cells: origin + pitch*((cells + (i0, j0))*cell + (cell - 1)/2)
+    here = (np.asarray(position, dtype=np.float64) - origin)/pitch/cell - (cell - 1)/2/cell - (i0, j0)
+    cells = [np.argwhere(labels[box] == k) + (box[0].start, box[1].start) for k, box in enumerate(ndimage.find_objects(labels) if regions else [], 1)]
+    cells = [c for c in cells if len(c) >= min_cells]
+    info = {"gap_cells": int(sum(len(c) for c in cells)), "regions": len(cells), "cell": cell}
+    if not cells:
+        info.update(length=0.0, planning_seconds=time.perf_counter() - start)
+        return np.zeros((0, 2)), info
+    centres = np.array([c.mean(axis=0) for c in cells])
+    order = two_opt(centres, nearest_neighbour(centres, here), here)
+    path = []
+    for k in order:
+        path.append(serpentine_cells(cells[k], here))
+        here = path[-1][-1]
+    vertices = to_position(np.concatenate(path).astype(np.float64))
+    lengths = np.hypot(*np.diff(np.vstack((position, vertices)), axis=0).T)
+    info.update(length=float(lengths.sum()), planning_seconds=time.perf_counter() - start)
+    return vertices, info
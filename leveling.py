@@ -0,0 +1,153 @@
+#Live leveling of the map: the tilt of the sample (a plane), a curved background (polynomial of order 2) or the offset of every scan line
+#is fitted while the samples come in and subtracted from what the live view shows, so the Z limits do not have to follow the tilt.
+#A least squares fit of z to the terms x^a y^b only needs the sums of x^a y^b and of z x^a y^b over the samples, so every batch adds
+#its sums (two small matrix products, a constant amount of work per sample) and the fit itself is a 6x6 solve when the view needs it.
+#x and y are scaled to -1..1 over the map to keep the sums well conditioned. The line mode keeps the sum and count of z of every row
+#(the samples with the same y pixel) and subtracts each row's mean. The leveled map keeps the overall mean, so it stays in the range
+#of the raw values. AutoContrast picks Z limits from running percentiles of the shown values.
+
+import threading
+import numpy as np
+
+LEVELING = ("none", "plane", "lines", "poly2")
+ORDERS = {"plane": 1, "poly2": 2}
+
+
+class Leveler:
+    def __init__(self, numofpoints=1024, lo=0, hi=1023):
+        #Same grid as the PixelBinner the samples go to.
+        self.numofpoints = numofpoints
+        self.lo = lo
+        self.hi = hi
+        self.moments = np.zeros((5, 5)) #[a, b] = sum of u^a v^b, u and v are x and y scaled to -1..1
+        self.zmoments = np.zeros((3, 3)) #[a, b] = sum of z u^a v^b
+        self.row_sum = np.zeros(numofpoints)
+        self.row_count = np.zeros(numofpoints)
+        self.version = 0
+        self.lock = threading.Lock() #Samples are added on the merge thread, the fit is done on the GUI thread.
+        self.fitted = {} #mode -> (version, coefficients)
+
+    def scaled(self, values):
+        return (np.asarray(values, dtype=np.float64) - self.lo)*(2/(self.hi - self.lo)) - 1
+
+    def powers(self, values, order=4):
+        #Columns 1, s, s^2... of the scaled values s.
+        s = self.scaled(values)
+        out = np.empty((s.size, order + 1))
+        out[:, 0] = 1
+        out[:, 1] = s
+        for k in range(2, order + 1):
+            np.multiply(out[:, k - 1], s, out=out[:, k])
+        return out
+
+    def rows(self, values):
+        idx = np.rint((np.asarray(values, dtype=np.float64) - self.lo)*((self.numofpoints - 1)/(self.hi - self.lo))).astype(np.intp)
+        return np.clip(idx, 0, self.numofpoints - 1, out=idx)
+
+    def add(self, x, y, z):
+        z = np.asarray(z, dtype=np.float64)
+        if z.size == 0:
+            return
+        u = self.powers(x)
+        v = self.powers(y)
+        moments = u.T @ v
+        zmoments = (u[:, :3]*z[:, None]).T @ v[:, :3]
+        rows = self.rows(y)
+        row_sum = np.bincount(rows, weights=z, minlength=self.numofpoints)
+        row_count = np.bincount(rows, minlength=self.numofpoints)
+        with self.lock:
+            self.moments += moments
+            self.zmoments += zmoments
+            self.row_sum += row_sum
+            self.row_count += row_count
+            self.version += 1
+
+    @classmethod
+    def from_binner(cls, binner):
+        #The same sums from the pixels of a map (every sample counted at the centre of its pixel), e.g. for a resumed session or a map
+        #binned in the acquisition process. One pass over the map.
+        leveler = cls(binner.numofpoints, binner.lo, binner.hi)
+        centres = leveler.powers(binner.lo + np.arange(binner.numofpoints)/binner.scale)
+        count = np.asarray(binner.count, dtype=np.float64)
+        total = np.asarray(binner.sum, dtype=np.float64)
+        leveler.moments = centres.T @ count @ centres
+        leveler.zmoments = centres[:, :3].T @ total @ centres[:, :3]
+        leveler.row_sum = total.sum(axis=0)
+        leveler.row_count = count.sum(axis=0)
+        leveler.version = 1
+        return leveler
+
+    def coefficients(self, mode):
+        #Least squares coefficients of the terms u^a v^b, a + b <= order, as a dict (a, b) -> c. Refitted only after new samples.
+        fitted = self.fitted.get(mode)
+        if fitted is not None and fitted[0] == self.version:
+            return fitted[1]
+        with self.lock:
+            version, moments, zmoments = self.version, self.moments.copy(), self.zmoments.copy()
+        terms = [(a, b) for a in range(ORDERS[mode] + 1) for b in range(ORDERS[mode] + 1 - a)]
+        matrix = np.array([[moments[a + c, b + d] for c, d in terms] for a, b in terms])
+        rhs = np.array([zmoments[a, b] for a, b in terms])
+        solution = np.linalg.lstsq(matrix, rhs, rcond=None)[0] #Also fine while the samples are still on a line.
+        coefficients = dict(zip(terms, solution))
+        self.fitted[mode] = (version, coefficients)
+        return coefficients
+
+    def mean(self):
+        with self.lock:
+            return self.moments[0, 0] and self.zmoments[0, 0]/self.moments[0, 0]
+
+    def apply(self, data, extent, mode, full_extent=(-50, 50, -50, 50)):
+        #data[x, y] is a part of the map (any level of pyramid.py) covering extent, in the units of full_extent, which the whole map
+        #covers. Returns a new float32 array with the fitted background taken away, data itself is not changed.
+        if mode == "none" or self.moments[0, 0] == 0:
+            return data
+        #Map pixel position of the centres of the data pixels, and the x y values they stand for.
+        x0, x1, y0, y1 = full_extent
+        px = ((extent[0] + (np.arange(data.shape[0]) + 0.5)*(extent[1] - extent[0])/data.shape[0]) - x0)/(x1 - x0)*self.numofpoints - 0.5
+        py = ((extent[2] + (np.arange(data.shape[1]) + 0.5)*(extent[3] - extent[2])/data.shape[1]) - y0)/(y1 - y0)*self.numofpoints - 0.5
+        scale = (self.numofpoints - 1)/(self.hi - self.lo)
+        out = np.array(data, dtype=np.float32)
+        if mode == "lines":
+            mean = self.mean()
+            with self.lock:
+                row_sum, count = self.row_sum.copy(), self.row_count.copy()
+            offsets = np.divide(row_sum, count, out=np.full(self.numofpoints, mean), where=count > 0)
+            rows = np.clip(np.rint(py).astype(np.intp), 0, self.numofpoints - 1)
+            out -= (offsets[rows] - mean).astype(np.float32)[None, :]
+            return out
+        order = ORDERS[mode]
+        u = self.powers(self.lo + px/scale, order)
+        v = self.powers(self.lo + py/scale, order)
+        #background = sum of c[a, b] u^a v^b = (u powers) @ (c @ v powers), one small matrix product for the whole array.
+        c = np.zeros((order + 1, order + 1))
+        for (a, b), value in self.coefficients(mode).items():
+            c[a, b] = value
+        c[0, 0] -= self.mean() #The mean is added back, so the leveled map stays at the same level.
+        out -= (u @ (c @ v.T)).astype(np.float32)
+        return out
+
+
+class AutoContrast:
+    #Z limits from the low and high percentiles of the shown values, smoothed over the frames so the colors do not flicker.
+    def __init__(self, low=1.0, high=99.0, smoothing=0.3, max_values=65536):
+        self.low = low
+        self.high = high
+        self.smoothing = smoothing #Weight of the newest frame.
+        self.max_values = max_values #Larger frames are subsampled for the percentiles.
+        self.limits = None
+
+    def update(self, data):
+        step = max(1, int(np.ceil(np.sqrt(data.size/self.max_values))))
+        values = data[::step, ::step]
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return self.limits
+        limits = np.percentile(values, (self.low, self.high))
+        if self.limits is None:
+            self.limits = (float(limits[0]), float(limits[1]))
+        else:
+            self.limits = tuple(float(old + self.smoothing*(new - old)) for old, new in zip(self.limits, limits))
+        return self.limits
+
+    def reset(self):
+        self.limits = None
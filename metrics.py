@@ -0,0 +1,302 @@
+#Counters, gauges and latency histograms for the acquisition and control pipeline, so a missing sample or a lagging joystick can be
+#traced to the stage that causes it (serial parsing, binning, the session writer, drawing or a Studio RPC) instead of guessed from prints.
+#Each stage gets its instruments from one Metrics registry. Updating them is cheap (an addition, a bisect), the registry is only read
+#when a snapshot is taken: by the stats panel of the GUI, by JsonLinesExporter (rotating JSON-lines file) or by PrometheusServer
+#(a local http://127.0.0.1:port/metrics page in the Prometheus text format).
+#StackSampler is an opt-in sampling profiler for a few threads (the acquisition threads), it writes collapsed stacks that flamegraph.pl
+#or speedscope can show.
+
+import bisect
+import collections
+import datetime
+import http.server
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+
+# Upper bounds of the histogram buckets in s, from 50 us to about 13 s. Values above the last one go to an overflow bucket.
+BUCKETS = tuple(50e-6*2**k for k in range(19))
+
+
+def metric_key(name, labels):
+    #"name" or 'name{label="value",...}', the same string is used in the snapshots and on the Prometheus page.
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+class Counter:
+    #Only ever increases. Every counter has a single writing thread, so no lock is needed.
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    #Current value of something, either set() or read from function when a snapshot is taken (queue depths...).
+    def __init__(self, function=None):
+        self.function = function
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def read(self):
+        return self.function() if self.function is not None else self.value
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def time(self):
+        #with histogram.time(): ... observes how long the block took.
+        return Timer(self)
+
+    def quantile(self, q):
+        #Upper bound of the bucket the q quantile falls in (the largest value seen for the overflow bucket).
+        if self.count == 0:
+            return None
+        rank = q*self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.lock = threading.Lock() #Only for creating instruments.
+        self.imported = {} #Latest snapshot of every other process that sends us its metrics, see import_snapshot.
+
+    def get(self, table, kind, name, labels):
+        key = metric_key(name, labels)
+        instrument = table.get(key)
+        if instrument is None:
+            with self.lock:
+                instrument = table.setdefault(key, kind())
+        return instrument
+
+    def counter(self, name, **labels):
+        return self.get(self.counters, Counter, name, labels)
+
+    def gauge(self, name, function=None, **labels):
+        gauge = self.get(self.gauges, Gauge, name, labels)
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name, **labels):
+        return self.get(self.histograms, Histogram, name, labels)
+
+    def import_snapshot(self, snapshot, source="acquisition"):
+        #Instruments of another process (the acquisition process sends its snapshots, see acquisitionprocess.py). They show up in our
+        #snapshots as if they were ours, and replace ours of the same name (which are not updated while that process does the work).
+        self.imported[source] = snapshot
+
+    def snapshot(self):
+        gauges = {}
+        for key, gauge in list(self.gauges.items()):
+            try:
+                gauges[key] = gauge.read()
+            except Exception: #e.g. the object behind the function is being replaced.
+                gauges[key] = None
+        snapshot = {"time": datetime.datetime.now().isoformat(timespec="milliseconds"), "monotonic": time.monotonic(),
+                    "counters": {key: c.value for key, c in list(self.counters.items())},
+                    "gauges": gauges,
+                    "histograms": {key: {"count": h.count, "sum": h.sum, "p50": h.quantile(0.5), "p90": h.quantile(0.9),
+                                         "p99": h.quantile(0.99), "max": h.max} for key, h in list(self.histograms.items())}}
+        for imported in list(self.imported.values()):
+            for table in ("counters", "gauges", "histograms"):
+                snapshot[table].update(imported[table])
+        return snapshot
+
+    def prometheus(self):
+        #All instruments in the Prometheus text exposition format. The tables are copied first (like in snapshot()), other threads may
+        #add instruments while the page is served.
+        lines = []
+        imports = list(self.imported.values())
+        shadowed = {key for imported in imports for table in ("counters", "gauges", "histograms") for key in imported[table]}
+        for key, counter in sorted(list(self.counters.items())):
+            if key not in shadowed:
+                lines.append(f"{key} {counter.value}")
+        for key, gauge in sorted(list(self.gauges.items())):
+            if key in shadowed:
+                continue
+            try:
+                lines.append(f"{key} {float(gauge.read())}")
+            except Exception:
+                pass
+        for key, histogram in sorted(list(self.histograms.items())):
+            if key in shadowed:
+                continue
+            name, _, labels = key.partition("{")
+            labels = labels.rstrip("}")
+            seen = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                seen += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{name}_bucket{{{labels + "," if labels else ""}le="{le}"}} {seen}')
+            suffix = "{" + labels + "}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {histogram.sum}")
+            lines.append(f"{name}_count{suffix} {histogram.count}")
+        for imported in imports: #Only the totals of their histograms, the buckets stay in the other process.
+            for key, value in sorted(imported["counters"].items()):
+                lines.append(f"{key} {value}")
+            for key, value in sorted(imported["gauges"].items()):
+                if value is not None:
+                    lines.append(f"{key} {float(value)}")
+            for key, histogram in sorted(imported["histograms"].items()):
+                name, _, labels = key.partition("{")
+                suffix = "{" + labels if labels else ""
+                lines.append(f"{name}_sum{suffix} {histogram['sum']}")
+                lines.append(f"{name}_count{suffix} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def totals(snapshot):
+    #Counters, plus the gauges named *_total (totals kept by other objects, like the bytes written by the session writer).
+    values = dict(snapshot["counters"])
+    values.update((key, value) for key, value in snapshot["gauges"].items() if key.partition("{")[0].endswith("_total") and value is not None)
+    return values
+
+
+def rates(previous, current):
+    #Per second increase of every counter (and *_total gauge) between two snapshots.
+    if previous is None:
+        return {}
+    elapsed = current["monotonic"] - previous["monotonic"]
+    if elapsed <= 0:
+        return {}
+    before = totals(previous)
+    return {key: (value - before.get(key, 0))/elapsed for key, value in totals(current).items()}
+
+
+class JsonLinesExporter(threading.Thread):
+    #Appends a snapshot (with the counter rates) to path every interval s. The file is rotated at max_bytes, keeping backups old files.
+    def __init__(self, metrics, path, interval=5.0, max_bytes=10_000_000, backups=5):
+        super().__init__(name="metrics-export", daemon=True)
+        self.metrics = metrics
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+
+    def run(self):
+        previous = None
+        while not self.stopped.wait(self.interval):
+            current = self.metrics.snapshot()
+            current["rates"] = rates(previous, current)
+            self.export(current)
+            previous = current
+
+    def export(self, snapshot):
+        self.handler.emit(logging.makeLogRecord({"msg": json.dumps(snapshot)}))
+
+    def stop(self):
+        self.stopped.set()
+        self.handler.close()
+
+
+class PrometheusServer(threading.Thread):
+    #Serves metrics.prometheus() on http://127.0.0.1:port/metrics (only on this computer).
+    def __init__(self, metrics, port=9100):
+        super().__init__(name="metrics-http", daemon=True)
+        registry = metrics
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+class StackSampler(threading.Thread):
+    #Looks at the stacks of the given threads every interval s and counts the stacks it sees. Unlike cProfile it does not slow the
+    #sampled threads down, and it can be attached to threads that never return. write() saves "thread;outer;inner count" lines.
+    def __init__(self, threads, path, interval=0.005, write_interval=10.0):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.targets = list(threads)
+        self.path = path
+        self.interval = interval
+        self.write_interval = write_interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        next_write = time.monotonic() + self.write_interval
+        while not self.stopped.wait(self.interval) and any(thread.is_alive() for thread in self.targets):
+            frames = sys._current_frames()
+            for thread in self.targets:
+                frame = frames.get(thread.ident)
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[";".join([thread.name] + stack[::-1])] += 1
+            self.samples += 1
+            if time.monotonic() > next_write:
+                self.write()
+                next_write = time.monotonic() + self.write_interval
+        self.write()
+
+    def write(self):
+        with open(self.path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def stop(self):
+        self.stopped.set()
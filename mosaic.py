@@ -0,0 +1,149 @@
+#Mosaic map: the samples of every scan, wherever the scanner (and the stage) were, in one map in physical coordinates (m).
+#The map is a dict of square tiles that are only allocated when the first sample lands in them, so its memory grows with the area that
+#was visited and not with the bounding box. Each tile keeps, per pixel, the sum (float64), the hit count (uint32) and the last value
+#(float32), 16 bytes per pixel instead of the 24 of the live map. A pixel whose count is full (a tip parked for days) takes no more
+#samples into its sum either, so its mean stays right.
+#The X and Y readings of the Arduino are turned into positions with the user output calibration Studio was set up with at startup
+#(calib_gain and calib_offset, see counts_to_metres), and the origin of the scan (a stage position, or the image offset if the position
+#outputs do not include it) is added, so scans done at different places stitch into one map.
+
+import threading
+import numpy as np
+
+MOSAIC_LAYERS = ("mean", "last", "count")
+COUNT_LIMIT = np.iinfo(np.uint32).max
+
+
+def counts_to_metres(counts, calib_gain, calib_offset, volts_per_count=5/1023, full_scale_volts=10.0, full_scale=100e-6):
+    #Position in m from the Arduino reading of a Studio user output. The output gives (calib_gain*signal + calib_offset) times its full
+    #scale of full_scale_volts, where signal is the position as a fraction of full_scale m. With the -0.5 and 0.25 of connect_studio the
+    #0 to 5 V the Arduino reads cover +50 to -50 um (the negative gain flips the sign, like the 1024-Z of the live map).
+    fraction = np.asarray(counts, dtype=np.float64)*volts_per_count/full_scale_volts
+    return (fraction - calib_offset)/calib_gain*full_scale
+
+
+class MosaicTile:
+    __slots__ = ("sum", "count", "last")
+
+    def __init__(self, size):
+        self.sum = np.zeros((size, size), dtype=np.float64)
+        self.count = np.zeros((size, size), dtype=np.uint32)
+        self.last = np.full((size, size), np.nan, dtype=np.float32)
+
+    @property
+    def nbytes(self):
+        return self.sum.nbytes + self.count.nbytes + self.last.nbytes
+
+    def layer(self, name, region):
+        count = self.count[region]
+        if name == "count":
+            return count.astype(np.float32)
+        if name == "last":
+            return self.last[region]
+        out = np.full(count.shape, np.nan, dtype=np.float32)
+        np.divide(self.sum[region], count, out=out, where=count > 0)
+        return out
+
+
+class MosaicMap:
+    #Pixels of pixel m, tiles of tile x tile pixels. Pixel (i, j) covers x from i*pixel to (i + 1)*pixel, the same for y.
+    #add() runs on the acquisition thread and render() on the GUI thread, the lock keeps the tile dict consistent between them.
+    def __init__(self, pixel=100e-9, tile=256):
+        self.pixel = pixel
+        self.tile = tile
+        self.tiles = {} #(tile i, tile j) -> MosaicTile
+        self.lock = threading.Lock()
+        self.samples = 0
+        self.version = 0 #Increases with every add, so the view knows when to redraw.
+
+    def add(self, x, y, z):
+        #x and y in m, z the value to accumulate.
+        z = np.asarray(z, dtype=np.float32)
+        if z.size == 0:
+            return
+        i = np.floor(np.asarray(x)/self.pixel).astype(np.int64)
+        j = np.floor(np.asarray(y)/self.pixel).astype(np.int64)
+        ti, tj = i//self.tile, j//self.tile
+        local = (i - ti*self.tile)*self.tile + (j - tj*self.tile)
+        #Samples grouped by tile, in their original order within a tile (so the last value is the latest one).
+        key = ti*(1 << 32) + (tj + (1 << 31))
+        order = np.argsort(key, kind="stable")
+        key, local, z, ti, tj = key[order], local[order], z[order], ti[order], tj[order]
+        starts = np.flatnonzero(np.concatenate(([True], key[1:] != key[:-1])))
+        ends = np.append(starts[1:], len(key))
+        size = self.tile*self.tile
+        with self.lock:
+            for start, end in zip(starts, ends):
+                name = (int(ti[start]), int(tj[start]))
+                tile = self.tiles.get(name)
+                if tile is None:
+                    tile = self.tiles[name] = MosaicTile(self.tile)
+                pixels = local[start:end]
+                total = np.bincount(pixels, weights=z[start:end], minlength=size)
+                hits = np.bincount(pixels, minlength=size)
+                count = tile.count.reshape(-1)
+                room = COUNT_LIMIT - count.astype(np.int64)
+                if (hits > room).any():
+                    #Only as many samples as still fit in the count go into the sum (their share of the batch sum).
+                    kept = np.minimum(hits, room)
+                    total *= np.divide(kept, hits, out=np.zeros(size), where=hits > 0)
+                    hits = kept
+                tile.sum.reshape(-1)[:] += total
+                count += hits.astype(np.uint32)
+                tile.last.reshape(-1)[pixels] = z[start:end]
+            self.samples += z.size
+            self.version += 1
+
+    @property
+    def nbytes(self):
+        with self.lock:
+            return sum(tile.nbytes for tile in self.tiles.values())
+
+    def bounds(self):
+        #(x0, x1, y0, y1) in m of the tiles that were visited, None if there are none yet.
+        with self.lock:
+            if not self.tiles:
+                return None
+            names = np.array(list(self.tiles))
+        side = self.tile*self.pixel
+        return names[:, 0].min()*side, (names[:, 0].max() + 1)*side, names[:, 1].min()*side, (names[:, 1].max() + 1)*side
+
+    def render(self, xlim, ylim, width, height, layer="mean"):
+        #The part of the map inside xlim, ylim (m) with about width x height pixels at most: every step-th pixel of the visited tiles
+        #(nearest neighbour), empty pixels are NaN. Returns the array (indexed [x, y]) and its extent (x0, x1, y0, y1) in m.
+        i0, i1 = int(np.floor(min(xlim)/self.pixel)), int(np.ceil(max(xlim)/self.pixel))
+        j0, j1 = int(np.floor(min(ylim)/self.pixel)), int(np.ceil(max(ylim)/self.pixel))
+        step = max(1, int(np.ceil(max((i1 - i0)/max(width, 1), (j1 - j0)/max(height, 1)))))
+        out = np.full((-(-(i1 - i0)//step), -(-(j1 - j0)//step)), np.nan, dtype=np.float32)
+        with self.lock:
+            for (ti, tj), tile in self.tiles.items():
+                #Pixels of this tile on the grid i0 + k*step inside the range, in tile coordinates.
+                a0, b0 = ti*self.tile, tj*self.tile
+                ka = max(0, -(-(a0 - i0)//step))
+                kb = max(0, -(-(b0 - j0)//step))
+                ia, ib = i0 + ka*step - a0, j0 + kb*step - b0
+                ia_end, ib_end = min(self.tile, i1 - a0), min(self.tile, j1 - b0)
+                if ia >= ia_end or ib >= ib_end:
+                    continue
+                values = tile.layer(layer, (slice(ia, ia_end, step), slice(ib, ib_end, step)))
+                out[ka:ka + values.shape[0], kb:kb + values.shape[1]] = values
+        return out, (i0*self.pixel, (i0 + out.shape[0]*step)*self.pixel, j0*self.pixel, (j0 + out.shape[1]*step)*self.pixel)
+
+    def save(self, path):
+        with self.lock:
+            names = list(self.tiles)
+            tiles = [self.tiles[name] for name in names]
+            np.savez_compressed(path, pixel=self.pixel, tile=self.tile, names=np.array(names, dtype=np.int64).reshape(-1, 2),
+                                sum=np.array([t.sum for t in tiles]), count=np.array([t.count for t in tiles]),
+                                last=np.array([t.last for t in tiles]), samples=self.samples)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            mosaic = cls(float(data["pixel"]), int(data["tile"]))
+            for k, (ti, tj) in enumerate(data["names"]):
+                tile = MosaicTile(mosaic.tile)
+                tile.sum[:], tile.count[:], tile.last[:] = data["sum"][k], data["count"][k], data["last"][k]
+                mosaic.tiles[(int(ti), int(tj))] = tile
+            mosaic.samples = int(data["samples"])
+        return mosaic
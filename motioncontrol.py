@@ -0,0 +1,56 @@
+#Turns the analog sticks into smooth tip motion.
+#Stick deflection (after a deadzone and a response curve, so small deflections give fine control) sets a velocity, and the velocity
+#is integrated over the real time between updates, so the speed does not depend on how often the GUI manages to call update().
+#The left stick moves fast for traversal, the right stick slowly for fine positioning. New targets are only handed out at a fixed
+#command rate and only if the target moved, so Studio gets a steady, small stream of writes instead of one per poll.
+
+import time
+
+
+class MotionController:
+    def __init__(self, deadzone=0.15, exponent=2.0, max_speed=20e-6, fine_speed=1e-6, command_rate=20, max_step_time=0.25):
+        self.deadzone = deadzone
+        self.exponent = exponent #1 is linear, larger values give finer control near the center.
+        self.max_speed = max_speed #m/s at full left stick deflection
+        self.fine_speed = fine_speed #m/s at full right stick deflection
+        self.command_rate = command_rate #Targets per second at most
+        self.max_step_time = max_step_time #Longer gaps between updates (GUI busy) are not integrated, to avoid jumps.
+        self.position = None #Current target [x, y] in m, None until set_position() is called.
+        self.last_sent = None
+        self.last_time = None
+        self.next_command = 0
+
+    def set_position(self, x, y):
+        #Starts integrating from the actual position (read from Studio).
+        self.position = [x, y]
+        self.last_sent = (x, y)
+        self.last_time = None
+
+    def shape(self, value):
+        magnitude = abs(value)
+        if magnitude <= self.deadzone:
+            return 0.0
+        magnitude = min((magnitude - self.deadzone)/(1 - self.deadzone), 1.0)
+        return magnitude**self.exponent if value > 0 else -magnitude**self.exponent
+
+    def velocity(self, left_x, left_y, right_x=0.0, right_y=0.0):
+        vx = self.shape(left_x)*self.max_speed + self.shape(right_x)*self.fine_speed
+        vy = -(self.shape(left_y)*self.max_speed + self.shape(right_y)*self.fine_speed) #Pushing a stick up gives negative values.
+        return vx, vy
+
+    def update(self, left_x, left_y, right_x=0.0, right_y=0.0, now=None):
+        #Integrates the stick positions, returns the new (x, y) target when one should be sent, otherwise None.
+        now = time.monotonic() if now is None else now
+        if self.position is None:
+            return None
+        dt = 0.0 if self.last_time is None else min(now - self.last_time, self.max_step_time)
+        self.last_time = now
+        vx, vy = self.velocity(left_x, left_y, right_x, right_y)
+        self.position[0] += vx*dt
+        self.position[1] += vy*dt
+        target = (self.position[0], self.position[1])
+        if now < self.next_command or target == self.last_sent:
+            return None
+        self.next_command = now + 1/self.command_rate
+        self.last_sent = target
+        return target
@@ -1,54 +1,108 @@
-import pandas as pd
+#Offline reconstruction of the map from a recorded session.
+#Works with the session files written by gamepad_2_7.py (.npys, see sessionfile.py) and with the older CSV files (X,Y,Z,timestamp).
+#The file is read in chunks and every chunk is binned as soon as it is read (see binning.py), so memory stays bounded no matter how
+#long the session was. Timestamps are parsed for the whole chunk at once and the time window is applied as a mask.
+#Usage:
+#   python plotdata.py                                  (asks for the file and shows the plots, like before)
+#   python plotdata.py session.npys --start "2025-01-01 12:00" --end "2025-01-01 12:30" --output map
+#                                                       (writes map_2d.png and map_3d.png without opening any window)
+#It can also be used from other scripts: binner = reconstruct("session.npys"); Z = binner.mean()
+
+import argparse
 import numpy as np
-import matplotlib.pyplot as plt
-from tkinter import Tk     # from tkinter import Tk for Python 3.x
-from tkinter.filedialog import askopenfilename
-import pandas as pd
-from datetime import datetime
-#Ask user for file to be loaded
-Tk().withdraw() # we don't want a full GUI, so keep the root window from appearing
-filename = askopenfilename() # show an "Open" dialog box and return the path to the selected file
-#Load the data
-df = pd.read_csv(filename)
-xdata = df["X"].tolist()
-ydata = df["Y"].tolist()
-zdata = df["Z"].tolist()
-tdata = df["timestamp"].tolist()
-
-# print(df.to_string()) Use this to visualize the data structure.
-
-# Next, we need an square array to visualize the data, which is not square, so we create an array
-# and change its values according to proximity.
+from pathlib import Path
+from binning import PixelBinner, LAYERS
+from sessionfile import iter_chunks
+
+# Parameters of the map, same as in the live view.
 zmin=490
 zmax=535
-xmin=-50
-xmax=50
-ymin=-50
-ymax=50
 scansize = 1023
 numofpoints = 1024
-x = np.linspace(0,1023, numofpoints)
-y = np.linspace(0,1023, numofpoints)
-tdata_time=[]
-for i in range(len(xdata)):
-    tdata_time.append(pd.to_datetime(tdata[i], format='%Y-%m-%d %H:%M:%S.%f'))
-X, Y = np.meshgrid(x, y)
-Z = np.ones((numofpoints, numofpoints))
-idj=0
-idk=0
-#For each data point, we find the closest point in our square array    
-for i in range(len(xdata)):
-    pos_x = float(xdata[i])
-    pos_y = float(ydata[i])
-    pos_z = float(zdata[i])
-    if tdata_time[i]>=tdata_time[0]:# Here we can use this to restrict the data visualization to a specific range.
-        if tdata_time[i]<=tdata_time[-1]:
-            idj = (np.abs(X[0, :] - pos_x)).argmin()
-            idk = (np.abs(Y[:, 0] - pos_y)).argmin()
-            Z[idj, idk] =1024-pos_z #Z data is inverted    
-#Plot the data in 2D
-plt.imshow(Z, cmap='viridis', vmin=zmin, vmax=zmax,extent=[-50,50,-50,50])   
-plt.show()
-#Plot the data in 3D
-fig, ax = plt.subplots(subplot_kw={"projection": "3d"})
-ax.plot_surface(X, Y, Z, cmap='viridis')  # Plot the updated data
\ No newline at end of file
+
+
+def to_ns(value):
+    #Date/time string (or anything np.datetime64 understands) -> int64 ns, None stays None.
+    if value is None:
+        return None
+    return np.datetime64(value, "ns").astype(np.int64)
+
+
+def iter_session(path, chunksize=1000000):
+    #Yields (X, Y, Z, timestamp) arrays, timestamp as int64 ns, a chunk at a time.
+    path = Path(path)
+    if path.suffix == ".csv":
+        import pandas as pd
+        for df in pd.read_csv(path, chunksize=chunksize):
+            t = pd.to_datetime(df["timestamp"], format="ISO8601").to_numpy().astype("datetime64[ns]").astype(np.int64)
+            yield df["X"].to_numpy(np.float64), df["Y"].to_numpy(np.float64), df["Z"].to_numpy(np.float64), t
+    else:
+        for _, records in iter_chunks(path):
+            yield records["X"], records["Y"], records["Z"], records["timestamp"]
+
+
+def reconstruct(path, start=None, end=None, binner=None, chunksize=1000000):
+    #Bins every sample with start <= timestamp <= end (both optional, int64 ns or date strings) and returns the PixelBinner.
+    start, end = to_ns(start), to_ns(end)
+    if binner is None:
+        binner = PixelBinner(numofpoints, 0, scansize)
+    for x, y, z, t in iter_session(path, chunksize):
+        keep = np.ones(len(t), dtype=bool)
+        if start is not None:
+            keep &= t >= start
+        if end is not None:
+            keep &= t <= end
+        binner.add(x[keep], y[keep], 1024-np.asarray(z[keep], dtype=np.float64)) #Z data is inverted
+    return binner
+
+
+def plot_map(binner, layer="mean", vmin=zmin, vmax=zmax, output=None):
+    #2D image and 3D surface of the map. With output the figures are saved as <output>_2d.png and <output>_3d.png instead of shown.
+    import matplotlib
+    if output is not None:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    Z = binner.layer(layer, fill=1)
+    #Plot the data in 2D
+    fig2d, ax2d = plt.subplots()
+    ax2d.imshow(Z, cmap='viridis', vmin=vmin, vmax=vmax, extent=[-50,50,-50,50])
+    #Plot the data in 3D
+    x = np.linspace(0, scansize, numofpoints)
+    X, Y = np.meshgrid(x, x)
+    fig3d, ax3d = plt.subplots(subplot_kw={"projection": "3d"})
+    ax3d.plot_surface(X, Y, Z, cmap='viridis')
+    if output is None:
+        plt.show()
+    else:
+        fig2d.savefig(f"{output}_2d.png", dpi=200)
+        fig3d.savefig(f"{output}_3d.png", dpi=200)
+        plt.close(fig2d)
+        plt.close(fig3d)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the AFM map from a session file (.npys) or an old CSV file.")
+    parser.add_argument("file", nargs="?", help="Session file, if not given a file dialog is shown")
+    parser.add_argument("--start", help="Only use samples from this time on, e.g. '2025-01-01 12:00:00'")
+    parser.add_argument("--end", help="Only use samples up to this time")
+    parser.add_argument("--layer", default="mean", choices=LAYERS)
+    parser.add_argument("--zmin", type=float, default=zmin)
+    parser.add_argument("--zmax", type=float, default=zmax)
+    parser.add_argument("--chunksize", type=int, default=1000000, help="Samples read at a time")
+    parser.add_argument("--output", help="Save the figures as <output>_2d.png and <output>_3d.png instead of showing them")
+    args = parser.parse_args(argv)
+
+    filename = args.file
+    if filename is None:
+        #Ask user for file to be loaded
+        from tkinter import Tk
+        from tkinter.filedialog import askopenfilename
+        Tk().withdraw() # we don't want a full GUI, so keep the root window from appearing
+        filename = askopenfilename() # show an "Open" dialog box and return the path to the selected file
+    binner = reconstruct(filename, args.start, args.end, chunksize=args.chunksize)
+    print(f"{binner.samples} samples binned, {int((binner.count > 0).sum())} pixels filled")
+    plot_map(binner, args.layer, args.zmin, args.zmax, args.output)
+
+
+if __name__ == "__main__":
+    main()
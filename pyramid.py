@@ -0,0 +1,117 @@
+#Multi-resolution copy of a map layer (1024, 512, 256... pixels per side) for the live view.
+#Each level is the one below reduced by 2x2 blocks, so a zoomed out view can show a level with about as many pixels as the screen has
+#instead of making matplotlib resample the whole grid every frame, and a zoomed in view only shows the few pixels inside the axes.
+#The pyramid is kept up to date tile by tile: only the tiles the binner marked as dirty (see binning.py) are copied and reduced again.
+#The binner keeps adding samples on the read thread while the GUI thread copies from it, so tiles are first copied to a back buffer and
+#only go into the levels if their sequence number did not change meanwhile. A torn copy is dropped (the tile shows its previous, complete
+#content) and the tile is marked dirty again, so neither thread ever waits for the other.
+
+import numpy as np
+
+# How 2x2 blocks of each layer are reduced to one pixel of the next level. Empty pixels (NaN) are ignored.
+REDUCTIONS = {"mean": "mean", "last": "mean", "min": "min", "max": "max", "count": "sum"}
+
+
+def reduce2x2(block, how, out):
+    #Reduces block (2n x 2m) to out (n x m).
+    quads = (block[0::2, 0::2], block[1::2, 0::2], block[0::2, 1::2], block[1::2, 1::2])
+    if how == "sum":
+        np.copyto(out, quads[0] + quads[1] + quads[2] + quads[3])
+    elif how == "min":
+        np.copyto(out, np.fmin(np.fmin(quads[0], quads[1]), np.fmin(quads[2], quads[3])))
+    elif how == "max":
+        np.copyto(out, np.fmax(np.fmax(quads[0], quads[1]), np.fmax(quads[2], quads[3])))
+    else:
+        valid = ~np.isnan(block)
+        values = np.where(valid, block, 0)
+        total = values[0::2, 0::2] + values[1::2, 0::2] + values[0::2, 1::2] + values[1::2, 1::2]
+        count = valid[0::2, 0::2].astype(np.float32) + valid[1::2, 0::2] + valid[0::2, 1::2] + valid[1::2, 1::2]
+        out.fill(np.nan)
+        np.divide(total, count, out=out, where=count > 0)
+    return out
+
+
+class MapPyramid:
+    def __init__(self, numofpoints=1024, tile=64, min_size=64):
+        #Levels are halved while they stay even and larger than min_size, and while a tile is still at least one pixel.
+        self.levels = [np.full((numofpoints, numofpoints), np.nan, dtype=np.float32)]
+        size = numofpoints
+        while size % 2 == 0 and size//2 >= min_size and tile >> len(self.levels) >= 1:
+            size //= 2
+            self.levels.append(np.full((size, size), np.nan, dtype=np.float32))
+        self.back = np.full((numofpoints, numofpoints), np.nan, dtype=np.float32) #Copies land here first, see update.
+        self.tile = tile
+        self.source = None #(binner, layer) the levels were built from, anything else means a full rebuild.
+        self.tiles_updated = 0
+        self.torn_tiles = 0 #Tile copies dropped because samples were added to the tile while copying.
+
+    def update(self, binner, layer):
+        #Brings the levels up to date with the binner. Returns the number of tiles that were updated.
+        dirty = binner.take_dirty()
+        if self.source != (id(binner), layer) or binner.tile != self.tile or binner.numofpoints != len(self.levels[0]):
+            if binner.numofpoints != len(self.levels[0]) or binner.tile != self.tile:
+                self.__init__(binner.numofpoints, binner.tile)
+            self.source = (id(binner), layer)
+            dirty = np.argwhere(np.ones((binner.tiles, binner.tiles), dtype=bool))
+        if len(dirty) == 0:
+            return 0
+        how = REDUCTIONS[layer]
+        torn = np.zeros(binner.dirty.shape, dtype=bool)
+        if len(dirty) > binner.tiles*binner.tiles//4:
+            #Most of the map changed, whole array operations are cheaper than many small ones. The back buffer becomes the front one,
+            #except for the torn tiles, which keep what the front one had.
+            before = binner.tile_seq.copy()
+            self.copy_layer(binner, layer, (slice(None), slice(None)))
+            torn[:] = (before % 2 == 1) | (binner.tile_seq != before)
+            for i, j in np.argwhere(torn):
+                region = self.tile_region(i, j)
+                self.back[region] = self.levels[0][region]
+            self.levels[0], self.back = self.back, self.levels[0]
+            for k in range(1, len(self.levels)):
+                reduce2x2(self.levels[k - 1], how, self.levels[k])
+        else:
+            for i, j in dirty:
+                region = self.tile_region(i, j)
+                before = binner.tile_seq[i, j]
+                self.copy_layer(binner, layer, region)
+                if before % 2 == 1 or binner.tile_seq[i, j] != before:
+                    torn[i, j] = True
+                    continue
+                self.levels[0][region] = self.back[region]
+                for k in range(1, len(self.levels)):
+                    reduce2x2(self.levels[k - 1][self.tile_region(i, j, k - 1)], how, self.levels[k][self.tile_region(i, j, k)])
+        if torn.any():
+            binner.mark_dirty(torn)
+            self.torn_tiles += int(torn.sum())
+        self.tiles_updated += len(dirty)
+        return len(dirty)
+
+    def tile_region(self, i, j, level=0):
+        side = self.tile >> level
+        return (slice(i*side, (i + 1)*side), slice(j*side, (j + 1)*side))
+
+    def copy_layer(self, binner, layer, region):
+        #Into the back buffer.
+        if layer == "count":
+            np.copyto(self.back[region], binner.count[region])
+        else:
+            binner.layer(layer, out=self.back[region], region=region)
+
+    def select(self, xlim, ylim, width, height, extent=(-50, 50, -50, 50)):
+        #Picks the coarsest level that still has at least one pixel per screen pixel over the visible range, and the part of it inside
+        #xlim/ylim (plus one pixel). width and height are the size of the axes on screen in pixels, extent is what the full map covers.
+        #Returns the level number, the sub-array (indexed [x, y] like the binner) and its extent.
+        x0, x1, y0, y1 = extent
+        n = len(self.levels[0])
+        visible = max(n*abs(xlim[1] - xlim[0])/(x1 - x0), 1), max(n*abs(ylim[1] - ylim[0])/(y1 - y0), 1)
+        level = 0
+        while level + 1 < len(self.levels) and min(visible[0]/width, visible[1]/height) >= 2**(level + 1):
+            level += 1
+        data = self.levels[level]
+        size = len(data)
+        pitch_x, pitch_y = (x1 - x0)/size, (y1 - y0)/size
+        i0 = int(np.clip(np.floor((min(xlim) - x0)/pitch_x) - 1, 0, size - 1))
+        i1 = int(np.clip(np.ceil((max(xlim) - x0)/pitch_x) + 1, i0 + 1, size))
+        j0 = int(np.clip(np.floor((min(ylim) - y0)/pitch_y) - 1, 0, size - 1))
+        j1 = int(np.clip(np.ceil((max(ylim) - y0)/pitch_y) + 1, j0 + 1, size))
+        return level, data[i0:i1, j0:j1], (x0 + i0*pitch_x, x0 + i1*pitch_x, y0 + j0*pitch_y, y0 + j1*pitch_y)
@@ -0,0 +1,98 @@
+#Live view of the map painted directly with Qt, a much lighter alternative to the matplotlib canvas for the live loop (matplotlib stays
+#for the offline figures of plotdata.py). Each frame the part of the map on screen is scaled to 0..255 with the z limits, turned into
+#ARGB pixels with a 256 entry colormap table (one fancy-indexing lookup), wrapped in a QImage without copying and painted with QPainter,
+#together with the axes frame, the limits and the red cursor lines.
+
+import numpy as np
+from PySide6.QtCore import Qt, QRectF, QPointF
+from PySide6.QtGui import QImage, QPainter, QPen, QColor
+from PySide6.QtWidgets import QWidget
+
+EMPTY = 0xFFFFFFFF #Pixels without samples, white like the background.
+
+
+def colormap_lut(name="viridis"):
+    #The 256 colors of a matplotlib colormap as 0xAARRGGBB, the pixel layout of QImage.Format_ARGB32.
+    from matplotlib import colormaps
+    rgba = np.round(colormaps[name](np.linspace(0, 1, 256))*255).astype(np.uint32)
+    return (np.uint32(255) << 24) | (rgba[:, 0] << 16) | (rgba[:, 1] << 8) | rgba[:, 2]
+
+
+class RasterView(QWidget):
+    def __init__(self, parent=None, cmap="viridis"):
+        super().__init__(parent)
+        self.lut = colormap_lut(cmap)
+        self.limits = (-50, 50, -50, 50) #xmin, xmax, ymin, ymax shown.
+        self.extent = (-50, 50, -50, 50) #What the image covers.
+        self.cursor = None
+        self.scaled = None #float32 work array, reused while the shape stays the same.
+        self.pixels = None #The QImage points into this array, so it is kept as long as the image.
+        self.image = None
+        self.margin = (45, 10, 10, 25) #left, top, right, bottom, room for the limits.
+        self.setMinimumSize(200, 200)
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+
+    def set_limits(self, xmin, xmax, ymin, ymax):
+        self.limits = (xmin, xmax, ymin, ymax)
+
+    def set_cursor(self, x, y):
+        self.cursor = (x, y)
+
+    def set_map(self, data, extent, zmin, zmax):
+        #data is indexed [x, y] like the binner (see pyramid.select) and covers extent (x0, x1, y0, y1).
+        if self.scaled is None or self.scaled.shape != data.shape:
+            self.scaled = np.empty(data.shape, dtype=np.float32)
+        scaled = self.scaled
+        np.subtract(data, zmin, out=scaled, casting="unsafe")
+        np.multiply(scaled, 256/(zmax - zmin) if zmax != zmin else 0, out=scaled)
+        np.clip(scaled, 0, 255, out=scaled)
+        empty = np.isnan(scaled)
+        scaled[empty] = 0
+        #Rows of the image go from the top (largest y) down, columns along x.
+        rows = scaled.T[::-1].astype(np.uint8, order="C")
+        pixels = self.lut[rows]
+        pixels[empty.T[::-1]] = EMPTY
+        self.pixels = pixels
+        self.image = QImage(pixels.data, pixels.shape[1], pixels.shape[0], pixels.strides[0], QImage.Format_ARGB32)
+        self.extent = extent
+
+    def plot_rect(self):
+        #Area of the widget the limits are mapped to, with the aspect ratio of the limits (square pixels, like the matplotlib view).
+        left, top, right, bottom = self.margin
+        width = max(self.width() - left - right, 1)
+        height = max(self.height() - top - bottom, 1)
+        xmin, xmax, ymin, ymax = self.limits
+        aspect = abs(xmax - xmin)/abs(ymax - ymin) if ymax != ymin else 1
+        if width > height*aspect:
+            width = height*aspect
+        else:
+            height = width/aspect
+        return QRectF(left + (self.width() - left - right - width)/2, top + (self.height() - top - bottom - height)/2, width, height)
+
+    def to_screen(self, rect, x, y):
+        xmin, xmax, ymin, ymax = self.limits
+        return QPointF(rect.left() + (x - xmin)/(xmax - xmin)*rect.width(), rect.top() + (ymax - y)/(ymax - ymin)*rect.height())
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+        rect = self.plot_rect()
+        if self.image is not None:
+            x0, x1, y0, y1 = self.extent
+            painter.save()
+            painter.setClipRect(rect)
+            painter.drawImage(QRectF(self.to_screen(rect, x0, y1), self.to_screen(rect, x1, y0)), self.image)
+            if self.cursor is not None:
+                x, y = self.cursor
+                painter.setPen(QPen(QColor("red"), 1))
+                painter.drawLine(QPointF(rect.left(), self.to_screen(rect, x, y).y()), QPointF(rect.right(), self.to_screen(rect, x, y).y()))
+                painter.drawLine(QPointF(self.to_screen(rect, x, y).x(), rect.top()), QPointF(self.to_screen(rect, x, y).x(), rect.bottom()))
+            painter.restore()
+        painter.setPen(QPen(QColor("black"), 1))
+        painter.drawRect(rect)
+        xmin, xmax, ymin, ymax = self.limits
+        painter.drawText(QRectF(rect.left() - 30, rect.bottom() + 3, 60, 20), Qt.AlignHCenter | Qt.AlignTop, f"{xmin:g}")
+        painter.drawText(QRectF(rect.right() - 30, rect.bottom() + 3, 60, 20), Qt.AlignHCenter | Qt.AlignTop, f"{xmax:g}")
+        painter.drawText(QRectF(rect.left() - 45, rect.bottom() - 10, 40, 20), Qt.AlignRight | Qt.AlignVCenter, f"{ymin:g}")
+        painter.drawText(QRectF(rect.left() - 45, rect.top() - 10, 40, 20), Qt.AlignRight | Qt.AlignVCenter, f"{ymax:g}")
+        painter.end()
@@ -1,27 +1,55 @@
-
 //Reads 3 analog voltages and writes them to the serial port as fast as possible.
 //Note that there is no conditioning of the values to speed up the process, hence 0-5V reads as 0-1023 integer
-const int analogInPinx = A3;   
-const int analogInPiny = A4; 
-const int analogInPinz = A5; 
+//With BINARY_MODE 0 each sample is sent as the text line "x,y,z". With BINARY_MODE 1 each sample is sent as a 10 byte frame
+//(sync 0xAA 0x55, sequence counter, x y z as little endian uint16, checksum), see serialprotocol.py. Set SERIAL_MODE in gamepad_2_7.py to match.
+#define BINARY_MODE 0
+
+const int analogInPinx = A3;
+const int analogInPiny = A4;
+const int analogInPinz = A5;
 
-int x = 0;    
-int y = 0;    
-int z = 0;       
+int x = 0;
+int y = 0;
+int z = 0;
+uint8_t seq = 0;
+uint8_t frame[10];
 
 void setup() {
   // initialize serial communications. Tested on an Arduino UNo and 1m USB cable up to 2M bauds:
   Serial.begin(115200);
 }
 
+#if BINARY_MODE
 void loop() {
-  /We alternate the analog reads and the serial prints to let the analog to digital converter time to update.
+  x = analogRead(analogInPinx);
+  y = analogRead(analogInPiny);
+  z = analogRead(analogInPinz);
+  frame[0] = 0xAA;
+  frame[1] = 0x55;
+  frame[2] = seq++;
+  frame[3] = x & 0xFF;
+  frame[4] = x >> 8;
+  frame[5] = y & 0xFF;
+  frame[6] = y >> 8;
+  frame[7] = z & 0xFF;
+  frame[8] = z >> 8;
+  uint8_t check = 0;
+  for (int i = 2; i < 9; i++) {
+    check += frame[i];
+  }
+  frame[9] = check;
+  Serial.write(frame, 10);
+}
+#else
+void loop() {
+  //We alternate the analog reads and the serial prints to let the analog to digital converter time to update.
     x = analogRead(analogInPinx);
   Serial.print(x);
-  Serial.print(","); 
+  Serial.print(",");
   y = analogRead(analogInPiny);
   Serial.print(y);
-  Serial.print(",");   
+  Serial.print(",");
   z = analogRead(analogInPinz);
   Serial.println(z); // Newline at the end
-}
\ No newline at end of file
+}
+#endif
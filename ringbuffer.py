@@ -0,0 +1,95 @@
+#Fixed-capacity columnar ring buffer used to move samples from the serial reader to the map and the data file.
+#The reader fills preallocated NumPy columns in place (no per-sample DataFrame), and each consumer (map updater, file writer...) drains
+#everything new in one bulk copy. Every consumer has its own read cursor, so one slow consumer does not steal samples from the others.
+#If a consumer falls more than one full buffer behind, the oldest samples are lost for that consumer and counted as an overrun.
+
+import threading
+import numpy as np
+
+#Default sample layout: the three 10-bit ADC readings from the Arduino plus an int64 timestamp in ns.
+SAMPLE_FIELDS = (("X", np.uint16), ("Y", np.uint16), ("Z", np.uint16), ("timestamp", np.int64))
+
+
+class RingReader:
+    #Read cursor of one consumer, created by SampleRingBuffer.add_reader().
+    def __init__(self, ring, name, position):
+        self.ring = ring
+        self.name = name
+        self.position = position #Absolute index (samples ever written) of the next sample to read.
+        self.overruns = 0 #Samples that were overwritten before this consumer could read them.
+
+    def available(self):
+        return self.ring.written - self.position
+
+    def drain(self, max_samples=None):
+        return self.ring.drain(self, max_samples)
+
+
+class SampleRingBuffer:
+    def __init__(self, capacity=1 << 18, fields=SAMPLE_FIELDS):
+        self.capacity = int(capacity)
+        self.fields = tuple((name, np.dtype(dtype)) for name, dtype in fields)
+        self.columns = {name: np.zeros(self.capacity, dtype=dtype) for name, dtype in self.fields}
+        self.written = 0 #Total number of samples ever pushed (never wraps).
+        self.readers = []
+        self._lock = threading.Lock()
+
+    def add_reader(self, name):
+        #New consumers only see samples pushed after they registered.
+        with self._lock:
+            reader = RingReader(self, name, self.written)
+            self.readers.append(reader)
+        return reader
+
+    def push(self, *values):
+        #Single sample, values in the order of self.fields.
+        with self._lock:
+            i = self.written % self.capacity
+            for (name, _), value in zip(self.fields, values):
+                self.columns[name][i] = value
+            self.written += 1
+
+    def extend(self, *arrays):
+        #Block of samples, one array per field (in the order of self.fields), all the same length.
+        n = len(arrays[0])
+        if n == 0:
+            return
+        if n > self.capacity: #Only the newest samples fit, the rest is lost for every reader anyway.
+            arrays = [a[-self.capacity:] for a in arrays]
+            skipped = n - self.capacity
+            n = self.capacity
+        else:
+            skipped = 0
+        with self._lock:
+            self.written += skipped
+            start = self.written % self.capacity
+            first = min(n, self.capacity - start) #Samples that fit before wrapping around.
+            for (name, _), a in zip(self.fields, arrays):
+                column = self.columns[name]
+                column[start:start + first] = a[:first]
+                column[:n - first] = a[first:]
+            self.written += n
+
+    def drain(self, reader, max_samples=None):
+        #Returns a dict of freshly allocated arrays with everything the reader has not seen yet (or at most max_samples of it).
+        with self._lock:
+            lag = self.written - reader.position
+            if lag > self.capacity:
+                reader.overruns += lag - self.capacity
+                reader.position = self.written - self.capacity
+                lag = self.capacity
+            n = lag if max_samples is None else min(lag, max_samples)
+            start = reader.position % self.capacity
+            first = min(n, self.capacity - start)
+            out = {}
+            for name, dtype in self.fields:
+                column = self.columns[name]
+                a = np.empty(n, dtype=dtype)
+                a[:first] = column[start:start + first]
+                a[first:] = column[:n - first]
+                out[name] = a
+            reader.position += n
+        return out
+
+    def overruns(self):
+        return {reader.name: reader.overruns for reader in self.readers}
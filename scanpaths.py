@@ -0,0 +1,129 @@
+#Space-filling tip paths (Hilbert, serpentine, spiral) and a thread that drives the tip along them.
+#Paths are generated directly as NumPy arrays of (x, y) vertices in m, and consecutive steps in the same direction are merged into one
+#long move (a serpentine becomes one move per line, a Hilbert curve loses about a fifth of its moves). The executor sends one move at a time
+#and waits until the position readback arrives at the target (instead of sleeping a fixed time), and can be paused, resumed or cancelled.
+
+import time
+import threading
+import numpy as np
+
+
+def hilbert_vertices(order, step, origin=(0.0, 0.0)):
+    #The 4**order points of a Hilbert curve with step m between neighbours, starting at origin and filling the square to the right
+    #and up of it. Vectorized version of the classic index -> (x, y) conversion.
+    d = np.arange(4**order, dtype=np.int64)
+    x = np.zeros_like(d)
+    y = np.zeros_like(d)
+    t = d.copy()
+    s = 1
+    while s < 2**order:
+        rx = 1 & (t//2)
+        ry = 1 & (t ^ rx)
+        swap = ry == 0
+        flip = swap & (rx == 1)
+        x[flip] = s - 1 - x[flip]
+        y[flip] = s - 1 - y[flip]
+        x[swap], y[swap] = y[swap], x[swap].copy()
+        x += s*rx
+        y += s*ry
+        t //= 4
+        s *= 2
+    return np.column_stack((origin[0] + step*x, origin[1] + step*y))
+
+
+def serpentine_vertices(width, height, pitch, origin=(0.0, 0.0)):
+    #Back and forth lines along x, pitch m apart, covering width x height from origin. Only the line ends are vertices.
+    y = origin[1] + np.arange(0, height + pitch/2, pitch)
+    x0 = np.where(np.arange(len(y)) % 2 == 0, origin[0], origin[0] + width)
+    x1 = np.where(np.arange(len(y)) % 2 == 0, origin[0] + width, origin[0])
+    return np.column_stack((np.column_stack((x0, x1)).reshape(-1), np.repeat(y, 2)))
+
+
+def spiral_vertices(radius, pitch, center=(0.0, 0.0), points_per_turn=64):
+    #Archimedean spiral from center outwards, pitch m between turns, as a polygon with points_per_turn vertices per turn.
+    theta = np.linspace(0, 2*np.pi*radius/pitch, int(points_per_turn*radius/pitch) + 1)
+    r = pitch*theta/(2*np.pi)
+    return np.column_stack((center[0] + r*np.cos(theta), center[1] + r*np.sin(theta)))
+
+
+def merge_collinear(vertices, tolerance=1e-12):
+    #Drops repeated vertices and the ones where the path goes on in the same direction, so each straight stretch becomes a single move.
+    vertices = np.asarray(vertices, dtype=np.float64)
+    if len(vertices) < 3:
+        return vertices
+    step = np.diff(vertices, axis=0)
+    length = np.hypot(step[:, 0], step[:, 1])
+    moving = length > tolerance
+    vertices = vertices[np.concatenate(([True], moving))]
+    step, length = step[moving], length[moving]
+    if len(vertices) < 3:
+        return vertices
+    direction = step/length[:, None]
+    cross = direction[:-1, 0]*direction[1:, 1] - direction[:-1, 1]*direction[1:, 0]
+    dot = np.sum(direction[:-1]*direction[1:], axis=1)
+    keep = np.ones(len(vertices), dtype=bool)
+    keep[1:-1] = (np.abs(cross) > 1e-9) | (dot < 0)
+    return vertices[keep]
+
+
+class PathExecutor(threading.Thread):
+    #Moves along vertices with move(x, y), waiting after each move until position() is within tolerance of the target (or timeout).
+    #on_progress(done, total, eta in s) is called after every vertex, from this thread.
+    def __init__(self, vertices, move, position, tolerance=0.2e-6, timeout=5.0, poll=0.02, on_progress=None):
+        super().__init__(daemon=True)
+        self.vertices = np.asarray(vertices, dtype=np.float64)
+        self.move = move
+        self.position = position
+        self.tolerance = tolerance
+        self.timeout = timeout
+        self.poll = poll
+        self.on_progress = on_progress
+        self.done = 0
+        self.timeouts = 0 #Moves that did not reach the target within timeout.
+        self.cancelled = threading.Event()
+        self.running = threading.Event() #Cleared while paused.
+        self.running.set()
+        lengths = np.hypot(*np.diff(self.vertices, axis=0).T) if len(self.vertices) > 1 else np.zeros(0)
+        self.remaining_length = np.concatenate((np.cumsum(lengths[::-1])[::-1], [0.0])) #Path length left from each vertex.
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.running.set()
+
+    def wait_arrival(self, x, y):
+        deadline = time.monotonic() + self.timeout
+        while not self.cancelled.is_set():
+            px, py = self.position()
+            if abs(px - x) <= self.tolerance and abs(py - y) <= self.tolerance:
+                return True
+            if time.monotonic() > deadline:
+                self.timeouts += 1
+                return False
+            time.sleep(self.poll)
+        return False
+
+    def run(self):
+        start = time.monotonic()
+        paused_time = 0.0
+        total = len(self.vertices)
+        for i, (x, y) in enumerate(self.vertices):
+            if not self.running.is_set():
+                pause_start = time.monotonic()
+                self.running.wait()
+                paused_time += time.monotonic() - pause_start
+            if self.cancelled.is_set():
+                break
+            self.move(x, y)
+            self.wait_arrival(x, y)
+            self.done = i + 1
+            if self.on_progress is not None:
+                travelled = self.remaining_length[0] - self.remaining_length[i]
+                elapsed = time.monotonic() - start - paused_time
+                eta = elapsed/travelled*self.remaining_length[i] if travelled > 0 else float("nan")
+                self.on_progress(self.done, total, eta)
@@ -0,0 +1,127 @@
+#Binary framed protocol between the Arduino (readanalogandwriteserial_3.ino with BINARY_MODE 1) and Python.
+#Each sample is one 10 byte frame:
+#   byte 0-1  sync 0xAA 0x55
+#   byte 2    sequence counter (uint8, wraps around), used to count frames lost on the way
+#   byte 3-8  x, y, z as little endian uint16 (raw 10-bit ADC counts)
+#   byte 9    checksum, sum of bytes 2-8 modulo 256
+#Instead of readline/decode/split/float for every sample, the decoder reads whatever arrived into a preallocated bytearray and parses
+#the whole block at once with np.frombuffer. Corrupt frames (bad sync or checksum) are skipped by searching for the next sync word.
+#The ASCII "x,y,z\n" format is still the default in gamepad_2_7.py, this is an opt-in mode.
+
+import numpy as np
+
+SYNC0 = 0xAA
+SYNC1 = 0x55
+FRAME_SIZE = 10
+FRAME_DTYPE = np.dtype([("sync0", "u1"), ("sync1", "u1"), ("seq", "u1"), ("X", "<u2"), ("Y", "<u2"), ("Z", "<u2"), ("check", "u1")])
+
+
+def encode_frames(x, y, z, first_seq=0):
+    #Builds the byte stream the Arduino sends for the given samples (used by the simulator and the self test below).
+    n = len(x)
+    frames = np.zeros(n, dtype=FRAME_DTYPE)
+    frames["sync0"] = SYNC0
+    frames["sync1"] = SYNC1
+    frames["seq"] = (first_seq + np.arange(n)) % 256
+    frames["X"] = x
+    frames["Y"] = y
+    frames["Z"] = z
+    raw = frames.view(np.uint8).reshape(n, FRAME_SIZE)
+    frames["check"] = raw[:, 2:9].sum(axis=1, dtype=np.uint8)
+    return frames.tobytes()
+
+
+class BinaryFrameDecoder:
+    def __init__(self, buffer_size=1 << 16):
+        self.buffer = bytearray(buffer_size) #Preallocated, serial data is read straight into it.
+        self.fill = 0 #Number of valid bytes at the start of self.buffer.
+        self.last_seq = None
+        self.frames = 0 #Good frames decoded.
+        self.dropped_frames = 0 #Frames missing according to the sequence counter (lost or corrupt).
+        self.corrupt_frames = 0 #Frames with a sync word but a wrong checksum or truncated by the next sync word.
+        self.skipped_bytes = 0 #Bytes thrown away while searching for a sync word.
+
+    def read_from(self, port):
+        #Reads what the serial port has into the free part of the buffer and decodes it. Returns x, y, z arrays (possibly empty).
+        if self.fill == len(self.buffer): #Only happens if the buffer is full of garbage without a single sync word.
+            self.skipped_bytes += self.fill - 1
+            self.buffer[0] = self.buffer[self.fill - 1]
+            self.fill = 1
+        with memoryview(self.buffer) as view:
+            n = port.readinto(view[self.fill:])
+        self.fill += n or 0
+        return self.decode()
+
+    def feed(self, data):
+        #Same as read_from but for bytes we already have (tests, replays). data can be longer than the free space.
+        out = []
+        data = memoryview(data)
+        while len(data):
+            n = min(len(data), len(self.buffer) - self.fill)
+            self.buffer[self.fill:self.fill + n] = data[:n]
+            self.fill += n
+            data = data[n:]
+            out.append(self.decode())
+            if n == 0:
+                break
+        if len(out) == 1:
+            return out[0]
+        return tuple(np.concatenate(parts) for parts in zip(*out))
+
+    def _find_sync(self, view, pos):
+        hits = np.flatnonzero((view[pos:-1] == SYNC0) & (view[pos + 1:] == SYNC1))
+        return pos + int(hits[0]) if hits.size else -1
+
+    def decode(self):
+        view = np.frombuffer(self.buffer, dtype=np.uint8, count=self.fill)
+        good_blocks = []
+        pos = 0
+        while True:
+            start = self._find_sync(view, pos)
+            if start < 0:
+                #Keep a trailing 0xAA, it may be the first half of the next sync word.
+                keep_from = self.fill - 1 if self.fill and view[-1] == SYNC0 else self.fill
+                self.skipped_bytes += max(keep_from - pos, 0)
+                pos = max(keep_from, pos)
+                break
+            self.skipped_bytes += start - pos
+            n = (self.fill - start)//FRAME_SIZE
+            if n == 0:
+                pos = start
+                break
+            rows = view[start:start + n*FRAME_SIZE].reshape(n, FRAME_SIZE)
+            ok = (rows[:, 0] == SYNC0) & (rows[:, 1] == SYNC1) & (rows[:, 2:9].sum(axis=1, dtype=np.uint8) == rows[:, 9])
+            bad = np.flatnonzero(~ok)
+            good = n if bad.size == 0 else int(bad[0])
+            if good:
+                good_blocks.append(rows[:good])
+            if good == n:
+                pos = start + n*FRAME_SIZE
+                break
+            #The frame at index good is broken, start looking for a sync word one byte after its start.
+            self.corrupt_frames += 1
+            self.skipped_bytes += 1
+            pos = start + good*FRAME_SIZE + 1
+
+        if len(good_blocks) == 1:
+            frames = good_blocks[0].reshape(-1).view(FRAME_DTYPE)
+        elif good_blocks:
+            frames = np.concatenate(good_blocks).reshape(-1).view(FRAME_DTYPE)
+        else:
+            frames = np.zeros(0, dtype=FRAME_DTYPE)
+        x = frames["X"].copy()
+        y = frames["Y"].copy()
+        z = frames["Z"].copy()
+        if frames.size:
+            seq = frames["seq"].astype(np.int64)
+            previous = seq[0] - 1 if self.last_seq is None else self.last_seq
+            gaps = (np.diff(seq, prepend=previous) - 1) % 256
+            self.dropped_frames += int(gaps.sum())
+            self.last_seq = int(seq[-1])
+            self.frames += frames.size
+        del frames, good_blocks, view
+        #Move the unparsed tail to the front, it is at most a few bytes long.
+        remaining = self.fill - pos
+        self.buffer[:remaining] = self.buffer[pos:self.fill]
+        self.fill = remaining
+        return x, y, z
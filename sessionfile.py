@@ -0,0 +1,172 @@
+#Session files: the raw samples of a measurement, written by a background thread so the acquisition never waits on the disk.
+#A session file (.npys) is simply a sequence of .npy chunks written one after the other in the same file, each holding a structured
+#array with one record per sample (X, Y, Z, timestamp). np.load can read them back one by one from an open file, any chunk starts at a
+#known byte offset, and a chunk cut short by a crash only loses that chunk. Next to it, a small .json file describes the session.
+#Timestamps are int64 ns of local time. The readers stamp samples with the monotonic clock, the "clock" entry of the .json is the
+#anchor that was used to turn them into wall clock time (see acquisition.clock_anchor), so they never jump when the clock is set.
+#To get the old readable format: python sessionfile.py export 2025_01_01_12_00_00.npys [output.csv]
+
+import os
+import sys
+import json
+import time
+import queue
+import datetime
+import threading
+from pathlib import Path
+import numpy as np
+
+FORMAT_NAME = "npy-chunks"
+FORMAT_VERSION = 1
+
+
+def metadata_path(path):
+    return Path(path).with_suffix(".json")
+
+
+def read_metadata(path):
+    with open(metadata_path(path)) as f:
+        return json.load(f)
+
+
+def to_records(batch):
+    #dict of equally long columns -> structured array
+    records = np.empty(len(next(iter(batch.values()))), dtype=[(name, column.dtype) for name, column in batch.items()])
+    for name, column in batch.items():
+        records[name] = column
+    return records
+
+
+class SessionWriter:
+    def __init__(self, path, max_queue=256, fsync_interval=2.0, metadata=None, metrics=None, resume=False):
+        #With resume the samples are appended to an existing session (see checkpoint.py) and its .json is only updated.
+        self.path = Path(path)
+        self.fsync_interval = fsync_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.max_depth = 0 #Deepest the queue has been, to see how close we got to dropping data.
+        self.bytes_written = 0
+        self.samples_written = 0
+        self.dropped_samples = 0 #Samples thrown away because the queue was full (disk too slow).
+        self.submitted_samples = 0 #Samples accepted by submit(), written or still in the queue.
+        self.error = None
+        self.write_time = metrics.histogram("writer_chunk_seconds") if metrics is not None else None #Optional, see metrics.py.
+        if resume and metadata_path(self.path).exists():
+            info = read_metadata(self.path)
+            info.setdefault("resumed", []).append(datetime.datetime.now().isoformat())
+        else:
+            info = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "created": datetime.datetime.now().isoformat()}
+        info.update(metadata or {})
+        with open(metadata_path(self.path), "w") as f:
+            json.dump(info, f, indent=1)
+        self.file = open(self.path, "ab")
+        self.bytes_written = self.file.tell()
+        self.progress = (self.bytes_written, 0) #(file size, samples written) after the last complete chunk, updated together.
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, batch):
+        #Called from the acquisition thread with a dict of columns. Never blocks: if the writer fell too far behind the batch is dropped.
+        n = len(next(iter(batch.values())))
+        if n == 0:
+            return
+        try:
+            self.queue.put_nowait(batch)
+        except queue.Full:
+            self.dropped_samples += n
+            return
+        self.submitted_samples += n
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def run(self):
+        last_fsync = time.monotonic()
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            try:
+                #Write everything that is waiting as one chunk, so a backlog is cleared with few, large writes.
+                batches = [batch]
+                while len(batches) < 64:
+                    try:
+                        batch = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if batch is None:
+                        self.queue.put(None)
+                        break
+                    batches.append(batch)
+                start = time.perf_counter()
+                records = np.concatenate([to_records(b) for b in batches])
+                np.save(self.file, records)
+                self.bytes_written = self.file.tell()
+                self.samples_written += len(records)
+                self.progress = (self.bytes_written, self.samples_written)
+                if time.monotonic() - last_fsync > self.fsync_interval:
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+                    last_fsync = time.monotonic()
+                if self.write_time is not None:
+                    self.write_time.observe(time.perf_counter() - start)
+            except Exception as e: #Keep the thread (and the queue) alive, but remember what went wrong.
+                self.error = e
+                print(f"Error writing session file: {e}")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def iter_chunks(path, offset=0):
+    #Yields (byte offset, records) for every chunk of a session file, starting at the chunk that begins at offset.
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            start = f.tell()
+            try:
+                records = np.load(f)
+            except (EOFError, ValueError): #End of file, or a chunk that was only partly written.
+                return
+            yield start, records
+
+
+def truncate_incomplete(path, offset=0):
+    #Cuts off a chunk that was only partly written (the program was killed while writing), so new chunks can be appended after the
+    #last complete one. offset must be the start of a chunk, only the chunks from there on are read. Returns the new file size.
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        end = offset
+        while True:
+            try:
+                np.load(f)
+            except (EOFError, ValueError):
+                break
+            end = f.tell()
+        if end < os.fstat(f.fileno()).st_size:
+            f.truncate(end)
+    return end
+
+
+def export_csv(path, csvpath=None):
+    #Writes the session in the CSV layout the program used to write directly (X,Y,Z,timestamp).
+    import pandas as pd
+    csvpath = Path(csvpath) if csvpath else Path(path).with_suffix(".csv")
+    header = True
+    for _, records in iter_chunks(path):
+        df = pd.DataFrame({name: records[name] for name in records.dtype.names})
+        df["timestamp"] = records["timestamp"].astype("datetime64[ns]")
+        df.to_csv(csvpath, mode="w" if header else "a", index=False, header=header)
+        header = False
+    return csvpath
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "export":
+        print("Usage: python sessionfile.py export <session.npys> [output.csv]")
+        sys.exit(1)
+    print("Written", export_csv(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None))
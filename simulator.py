@@ -0,0 +1,385 @@
+#In-process stand-ins for the three devices gamepad_2_7.py talks to, so it can run (and be benchmarked) on any computer:
+#   SimulatedSerial  behaves like the serial.Serial of the Arduino. It replays a recorded session (.npys or .csv) or synthesizes a
+#                    raster or spiral scan over a tilted, bumpy surface, at a given number of samples per second, in ASCII or binary mode.
+#   ScriptedGamepad  behaves like a pygame joystick. Buttons and sticks follow a script of timed events, or are set by hand.
+#   FakeStudio       behaves like nanosurf.Studio(). Its spm object accepts any property/method path used in this project, stores the
+#                    values written to it and waits a configurable time on every access to mimic the RPC latency of Studio.
+#Run the GUI on them with: python gamepad_2_7.py --simulate   (add QT_QPA_PLATFORM=offscreen to run without a screen)
+
+import json
+import time
+import threading
+import collections
+import numpy as np
+import types
+from serialprotocol import encode_frames
+from gamepadinput import JOYAXISMOTION, JOYBUTTONDOWN, JOYBUTTONUP
+
+
+#%%%%%%%%%%%%%%%%%%
+# Serial port / Arduino
+#%%%%%%%%%%%%%%%%%%
+
+def surface(x, y, rng):
+    #Synthetic sample: a tilted plane with some bumps and ADC noise, in raw counts (before the inversion done by the binning).
+    z = 512 + 0.1*(x - 512) + 0.05*(y - 512) + 40*np.sin(x/40)*np.cos(y/55) + rng.normal(0, 3, len(x))
+    return np.clip(np.rint(z), 0, 1023).astype(np.uint16)
+
+
+class PatternSource:
+    #Endless x, y, z blocks following a raster (back and forth lines) or an outward spiral. period is the time of a full frame in samples.
+    def __init__(self, pattern="raster", period=2000000, lines=256, seed=0):
+        self.pattern = pattern
+        self.period = period
+        self.lines = lines
+        self.i = 0
+        self.rng = np.random.default_rng(seed)
+
+    def next_block(self, n):
+        i = (self.i + np.arange(n)) % self.period
+        self.i += n
+        phase = i/self.period
+        if self.pattern == "spiral":
+            r = 511*np.sqrt(phase)
+            theta = 2*np.pi*np.sqrt(phase)*self.lines/2
+            x = 511.5 + r*np.cos(theta)
+            y = 511.5 + r*np.sin(theta)
+        else:
+            line = phase*self.lines
+            fraction = line % 1
+            x = 1023*np.where(line.astype(np.int64) % 2 == 0, fraction, 1 - fraction)
+            y = 1023*line/self.lines
+        x = np.clip(np.rint(x), 0, 1023).astype(np.uint16)
+        y = np.clip(np.rint(y), 0, 1023).astype(np.uint16)
+        return x, y, surface(x.astype(np.float64), y.astype(np.float64), self.rng)
+
+
+class ReplaySource:
+    #x, y, z blocks taken from a recorded session file (.npys or .csv), starting over at the end if loop is True.
+    def __init__(self, path, loop=True):
+        self.path = path
+        self.loop = loop
+        self.chunks = None
+        self.pending = [np.zeros(0, np.uint16)]*3
+
+    def next_block(self, n):
+        from plotdata import iter_session
+        parts = [[p] for p in self.pending]
+        have = len(self.pending[0])
+        while have < n:
+            if self.chunks is None:
+                self.chunks = iter_session(self.path)
+            try:
+                x, y, z, _ = next(self.chunks)
+            except StopIteration:
+                self.chunks = None
+                if not self.loop:
+                    break
+                continue
+            for part, values in zip(parts, (x, y, z)):
+                part.append(np.asarray(values).astype(np.uint16))
+            have += len(x)
+        block = [np.concatenate(part) for part in parts]
+        self.pending = [b[n:] for b in block]
+        return tuple(b[:n] for b in block)
+
+
+class SimulatedSerial:
+    #Produces the byte stream of the Arduino in real time (rate samples per second) and offers the parts of the serial.Serial
+    #interface used by gamepad_2_7.py: readline, readinto, read, in_waiting, close.
+    def __init__(self, source="raster", rate=20000, mode="ascii", timeout=0.01):
+        if source in ("raster", "spiral"):
+            self.source = PatternSource(source)
+        else:
+            self.source = ReplaySource(source)
+        self.rate = rate
+        self.mode = mode
+        self.timeout = timeout
+        self.buffer = bytearray()
+        self.pos = 0
+        self.seq = 0
+        self.samples_sent = 0
+        self.start = time.monotonic()
+        self.max_backlog = rate #Like the USB buffer, at most about a second of data waits to be read, the rest is lost.
+        self.is_open = True
+
+    def encode(self, x, y, z):
+        if self.mode == "binary":
+            data = encode_frames(x, y, z, self.seq)
+            self.seq = (self.seq + len(x)) % 256
+            return data
+        return "".join(f"{a},{b},{c}\r\n" for a, b, c in zip(x.tolist(), y.tolist(), z.tolist())).encode()
+
+    def generate(self):
+        #Adds the samples the Arduino would have sent since the last call.
+        due = int((time.monotonic() - self.start)*self.rate) - self.samples_sent
+        if due <= 0:
+            return
+        if due > self.max_backlog:
+            self.samples_sent += due - self.max_backlog
+            due = self.max_backlog
+        x, y, z = self.source.next_block(due)
+        self.samples_sent += due
+        if self.pos > 1 << 20: #Drop what was already read now and then.
+            del self.buffer[:self.pos]
+            self.pos = 0
+        self.buffer += self.encode(x, y, z)
+
+    @property
+    def in_waiting(self):
+        self.generate()
+        return len(self.buffer) - self.pos
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + (self.timeout or 0)
+        while True:
+            self.generate()
+            if condition() or time.monotonic() >= deadline:
+                return
+            time.sleep(0.0005)
+
+    def readline(self):
+        end = -1
+        def has_line():
+            nonlocal end
+            end = self.buffer.find(b"\n", self.pos)
+            return end >= 0
+        self.wait_for(has_line)
+        if end < 0:
+            return b""
+        line = bytes(self.buffer[self.pos:end + 1])
+        self.pos = end + 1
+        return line
+
+    def readinto(self, b):
+        self.wait_for(lambda: len(self.buffer) > self.pos)
+        n = min(len(b), len(self.buffer) - self.pos)
+        b[:n] = self.buffer[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def read(self, size=1):
+        out = bytearray(size)
+        n = self.readinto(out)
+        return bytes(out[:n])
+
+    def close(self):
+        self.is_open = False
+
+
+#%%%%%%%%%%%%%%%%%%
+# Gamepad
+#%%%%%%%%%%%%%%%%%%
+
+class ScriptedGamepad:
+    #Stand-in for pygame.joystick.Joystick. script is a list of [time in s, "button" or "axis", index, value], e.g.
+    #[[1.0, "button", 1, 1], [1.1, "button", 1, 0], [2.0, "axis", 0, 0.8], [3.0, "axis", 0, 0]] presses A at 1 s and pushes the
+    #left stick right between 2 and 3 s. It can also be a path to a JSON file with that list. press() and set_axis() work at any time.
+    #Changes are reported by get_events() as pygame-like JOYBUTTONDOWN/JOYBUTTONUP/JOYAXISMOTION events.
+    def __init__(self, script=None, numbuttons=12, numaxes=6, loop=False):
+        if isinstance(script, str):
+            with open(script) as f:
+                script = json.load(f)
+        self.script = sorted(script or [], key=lambda event: event[0])
+        self.loop = loop
+        self.buttons = [0]*numbuttons
+        self.axes = [0.0]*numaxes
+        self.next_event = 0
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+        self.events = []
+
+    def init(self):
+        pass
+
+    def get_name(self):
+        return "Scripted gamepad"
+
+    def get_numbuttons(self):
+        return len(self.buttons)
+
+    def get_numaxes(self):
+        return len(self.axes)
+
+    def pump(self):
+        #Applies the scripted events that are due, like pygame.event.pump does for a real gamepad.
+        now = time.monotonic() - self.start
+        with self.lock:
+            while self.next_event < len(self.script) and self.script[self.next_event][0] <= now:
+                _, kind, index, value = self.script[self.next_event]
+                self.next_event += 1
+                if kind == "button":
+                    self.set_button(index, value)
+                else:
+                    self.set_axis_value(index, value)
+            if self.loop and self.script and self.next_event == len(self.script):
+                self.next_event = 0
+                self.start = time.monotonic()
+
+    def set_button(self, button, pressed):
+        if self.buttons[button] != int(pressed):
+            self.buttons[button] = int(pressed)
+            self.events.append(types.SimpleNamespace(type=JOYBUTTONDOWN if pressed else JOYBUTTONUP, button=button, instance_id=0))
+
+    def set_axis_value(self, axis, value):
+        if self.axes[axis] != float(value):
+            self.axes[axis] = float(value)
+            self.events.append(types.SimpleNamespace(type=JOYAXISMOTION, axis=axis, value=float(value), instance_id=0))
+
+    def press(self, button, pressed=True):
+        with self.lock:
+            self.set_button(button, pressed)
+
+    def set_axis(self, axis, value):
+        with self.lock:
+            self.set_axis_value(axis, value)
+
+    def get_events(self):
+        #Like pygame.event.get(): applies the due script events and returns (and forgets) everything that changed.
+        self.pump()
+        with self.lock:
+            events, self.events = self.events, []
+        return events
+
+    def get_button(self, button):
+        return self.buttons[button]
+
+    def get_axis(self, axis):
+        return self.axes[axis]
+
+
+#%%%%%%%%%%%%%%%%%%
+# Studio
+#%%%%%%%%%%%%%%%%%%
+
+class FakeEnum:
+    #Stands for the enum types of Studio properties, any member name is accepted (e.g. generator.value.Spiral_Scan).
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return name
+
+
+class FakeNode:
+    #One element of the spm object tree. Any attribute is another node, .value reads/writes a property and calling it runs a method.
+    def __init__(self, spm, path):
+        self._spm = spm
+        self._path = path
+        self._children = {}
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        child = self._children.get(name)
+        if child is None:
+            child = FakeNode(self._spm, f"{self._path}.{name}" if self._path else name)
+            self._children[name] = child
+        return child
+
+    @property
+    def value(self):
+        return self._spm.read(self._path)
+
+    @value.setter
+    def value(self, new_value):
+        self._spm.write(self._path, new_value)
+
+    def __call__(self, *args):
+        return self._spm.call(self._path, args)
+
+    def __repr__(self):
+        return f"FakeNode({self._path})"
+
+
+class FakeSPM(FakeNode):
+    #Root of the fake object tree (studio.spm). latency is the time in s every read, write or call takes, like an RPC to Studio.
+    DEFAULTS = {
+        "core.z_controller.property.setpoint.value": 0.1,
+        "workflow.imaging.property.generator.value": FakeEnum(),
+        "workflow.imaging.property.image_offset_x.value": 0.0,
+        "workflow.imaging.property.image_offset_y.value": 0.0,
+        "lu.position_control.instance.attribute.current_pos_x.value": 0.0,
+        "lu.position_control.instance.attribute.current_pos_y.value": 0.0,
+    }
+
+    def __init__(self, latency=0.0, move_speed=None):
+        super().__init__(self, "")
+        self.latency = latency
+        self.move_speed = move_speed #m/s of the position controller moves, None for instant moves.
+        self.values = dict(self.DEFAULTS)
+        self.segments = []
+        self.scanning = False
+        self.state_lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+        self.calls = 0
+        self.history = collections.deque(maxlen=100000) #(time.perf_counter(), "read"/"write"/"call", path, value)
+        self.on_write = None #Optional callback(path, value), e.g. to measure when a command reaches "Studio".
+
+    def rpc(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def read(self, path):
+        self.rpc()
+        key = path + ".value"
+        with self.state_lock:
+            self.reads += 1
+            value = self.values.get(key, 0.0)
+            self.history.append((time.perf_counter(), "read", path, value))
+        return value
+
+    def write(self, path, value):
+        self.rpc()
+        with self.state_lock:
+            self.writes += 1
+            self.values[path + ".value"] = value
+            self.history.append((time.perf_counter(), "write", path, value))
+        if self.on_write is not None:
+            self.on_write(path, value)
+
+    def call(self, path, args):
+        self.rpc()
+        with self.state_lock:
+            self.calls += 1
+            self.history.append((time.perf_counter(), "call", path, args))
+            name = path.rsplit(".", 1)[-1]
+            if name == "segment_count":
+                return len(self.segments)
+            if name == "add_new_segment":
+                self.segments.append(None)
+            elif name == "remove_segment":
+                self.segments.pop(args[0])
+            elif name == "transform_segment":
+                self.segments[args[0]] = args[1]
+            elif name == "is_scanning":
+                return self.scanning
+            elif name == "start_imaging":
+                self.scanning = True
+            elif name == "stop_imaging":
+                self.scanning = False
+            elif name == "move_to_target_fix_speed_xy":
+                threading.Thread(target=self.move_to_target, daemon=True).start()
+        return None
+
+    def move_to_target(self):
+        attribute = "lu.position_control.instance.attribute."
+        with self.state_lock:
+            x0 = self.values.get(attribute + "current_pos_x.value", 0.0)
+            y0 = self.values.get(attribute + "current_pos_y.value", 0.0)
+            x1 = self.values.get(attribute + "target_move_pos_x.value", x0)
+            y1 = self.values.get(attribute + "target_move_pos_y.value", y0)
+        if self.move_speed:
+            time.sleep(float(np.hypot(x1 - x0, y1 - y0))/self.move_speed)
+        with self.state_lock:
+            self.values[attribute + "current_pos_x.value"] = x1
+            self.values[attribute + "current_pos_y.value"] = y1
+
+
+class FakeStudio:
+    #Stand-in for nanosurf.Studio().
+    def __init__(self, latency=0.0, move_speed=None):
+        self.spm = FakeSPM(latency, move_speed)
+
+    def connect(self):
+        pass
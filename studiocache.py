@@ -0,0 +1,108 @@
+#Local mirror of the Studio properties this program uses, so reading them does not cost an RPC every time.
+#Values we write go to Studio and into the mirror at the same time (write-through), reads are served from the mirror while they are
+#younger than max_age, and a slow periodic refresh (or invalidate() after approach, withdraw, scan start...) picks up the changes made
+#by Studio itself or by the user in the Studio window. It is meant to be used from the executor thread only (see studioexecutor.py).
+#Paths are written like in the Studio scripting interface, without the spm and the .value: "core.z_controller.property.setpoint".
+
+import time
+import threading
+
+SETPOINT = "core.z_controller.property.setpoint"
+OFFSET_X = "workflow.imaging.property.image_offset_x"
+OFFSET_Y = "workflow.imaging.property.image_offset_y"
+POS_X = "lu.position_control.instance.attribute.current_pos_x"
+POS_Y = "lu.position_control.instance.attribute.current_pos_y"
+
+
+class PropertyCache:
+    def __init__(self, spm, max_age=5.0, metrics=None):
+        self.spm = spm
+        self.metrics = metrics #Optional, gets the latency of every RPC by property (see metrics.py).
+        self.max_age = max_age
+        self.values = {} #path -> (value, time it was read or written)
+        self.nodes = {} #path -> property object, so the attribute chain is only walked once
+        self.lock = threading.Lock() #Only for the counters and values, GUI threads may look at them.
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.skipped_writes = 0 #Writes of the value Studio already has.
+        self.refreshes = 0
+
+    def node(self, path):
+        node = self.nodes.get(path)
+        if node is None:
+            node = self.spm
+            for name in path.split("."):
+                node = getattr(node, name)
+            self.nodes[path] = node
+        return node
+
+    def get(self, path, max_age=None):
+        max_age = self.max_age if max_age is None else max_age
+        with self.lock:
+            cached = self.values.get(path)
+            if cached is not None and time.monotonic() - cached[1] <= max_age:
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+        return self.read(path)
+
+    def rpc_time(self, kind, path, start):
+        if self.metrics is not None:
+            self.metrics.histogram("studio_rpc_seconds", op=kind, path=path).observe(time.perf_counter() - start)
+
+    def read(self, path):
+        start = time.perf_counter()
+        value = self.node(path).value
+        self.rpc_time("read", path, start)
+        with self.lock:
+            self.values[path] = (value, time.monotonic())
+        return value
+
+    def peek(self, path, default=0.0):
+        #Last known value however old, without ever asking Studio, so any thread can use it (see mosaic_position in gamepad_2_7.py).
+        with self.lock:
+            cached = self.values.get(path)
+        return default if cached is None else cached[0]
+
+    def set(self, path, value, force=False):
+        #Writes to Studio unless the (fresh) cached value is already the same.
+        with self.lock:
+            cached = self.values.get(path)
+            if not force and cached is not None and cached[0] == value and time.monotonic() - cached[1] <= self.max_age:
+                self.skipped_writes += 1
+                return
+            self.writes += 1
+        start = time.perf_counter()
+        self.node(path).value = value
+        self.rpc_time("write", path, start)
+        with self.lock:
+            self.values[path] = (value, time.monotonic())
+
+    def invalidate(self, *paths):
+        #Forgets the given paths (or everything), the next get() reads them from Studio again.
+        with self.lock:
+            if paths:
+                for path in paths:
+                    self.values.pop(path, None)
+            else:
+                self.values.clear()
+
+    def refresh(self, older_than=None):
+        #Reads again every cached property older than older_than seconds (all of them if None). Returns the paths that changed.
+        with self.lock:
+            now = time.monotonic()
+            paths = [path for path, (_, t) in self.values.items() if older_than is None or now - t > older_than]
+        changed = []
+        for path in paths:
+            before = self.values.get(path, (None, 0))[0]
+            if self.read(path) != before:
+                changed.append(path)
+        with self.lock:
+            self.refreshes += 1
+        return changed
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "writes": self.writes, "skipped_writes": self.skipped_writes,
+                    "refreshes": self.refreshes, "cached": len(self.values)}
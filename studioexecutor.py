@@ -0,0 +1,81 @@
+#Runs the commands for Studio on a worker thread, so the GUI never waits for an RPC to come back.
+#Every command goes into a queue and submit() returns a concurrent.futures.Future right away, which the GUI can use to show when
+#(and whether) the command finished. Commands submitted with a key replace a command with the same key that is still waiting: a stream
+#of joystick moves becomes a single write of the latest target, and the stale ones are cancelled instead of piling up behind a slow RPC.
+
+import threading
+import time
+import collections
+from concurrent.futures import Future
+
+
+class StudioExecutor:
+    def __init__(self, name="studio", metrics=None):
+        self.queue = collections.deque() #Waiting commands: [function, args, future, key]
+        self.pending = {} #key -> waiting command with that key
+        self.condition = threading.Condition()
+        self.submitted = 0
+        self.executed = 0
+        self.coalesced = 0 #Commands replaced by a newer one with the same key before they ran.
+        self.failed = 0
+        self.running = None #Name of the command being executed, for the GUI.
+        self.stopped = False
+        self.metrics = metrics #Optional, gets the run time of every command by name (see metrics.py).
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, function, *args, key=None):
+        future = Future()
+        with self.condition:
+            self.submitted += 1
+            command = self.pending.get(key) if key is not None else None
+            if command is not None:
+                #Same place in the queue, newest arguments. The replaced command is reported as cancelled.
+                command[0], command[1], old_future = function, args, command[2]
+                command[2] = future
+                self.coalesced += 1
+                old_future.cancel()
+            else:
+                command = [function, args, future, key]
+                self.queue.append(command)
+                if key is not None:
+                    self.pending[key] = command
+                self.condition.notify()
+        return future
+
+    def queue_depth(self):
+        return len(self.queue)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.stopped:
+                    self.condition.wait()
+                if self.stopped and not self.queue:
+                    return
+                function, args, future, key = self.queue.popleft()
+                if key is not None:
+                    del self.pending[key]
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.running = getattr(function, "__name__", str(function))
+            start = time.perf_counter()
+            try:
+                result = function(*args)
+            except Exception as e:
+                self.failed += 1
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                if self.metrics is not None:
+                    self.metrics.histogram("studio_command_seconds", command=self.running).observe(time.perf_counter() - start)
+                self.executed += 1
+                self.running = None
+
+    def shutdown(self, wait=True):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if wait:
+            self.thread.join()
@@ -0,0 +1,60 @@
+#Readers and merger on fake boards.
+import time
+import numpy as np
+from acquisition import SourceReader, StreamMerger, spread
+from ringbuffer import SampleRingBuffer
+
+
+class FakePort:
+    #Sends the time in ms (mod 1024) on every channel, rate lines per second.
+    def __init__(self, rate):
+        self.interval = 1/rate
+
+    def read(self, size=1):
+        time.sleep(self.interval)
+        n = int(time.monotonic()*1000) % 1024
+        return f"{n},{n},{n}\r\n".encode()
+
+
+def test_spread():
+    t = spread(1000, 2000, 4)
+    assert t.dtype == np.int64 and list(t) == [1250, 1500, 1750, 2000]
+
+
+def test_ascii_block_with_bad_lines():
+    import io
+    reader = SourceReader("test", io.BytesIO(b"1,2,3\r\n4,5\r\nx,1,2\r\n7,8,9\r\n10,11"))
+    assert reader.read_ascii() == 2
+    batch = reader.merge_reader.drain()
+    assert list(batch["X"]) == [1, 7] and list(batch["Z"]) == [3, 9]
+    assert reader.parse_errors == 2 and reader.pending == b"10,11"
+
+
+def test_out_of_range_values_are_bad_lines():
+    #Noise can turn a line into numbers the uint16 columns cannot hold, they must not wrap around into valid looking samples.
+    import io
+    reader = SourceReader("test", io.BytesIO(b"1,2,3\r\n-1,5,6\r\n7,65536,9\r\n65535,0,1023\r\n4,5,99999999999999999999\r\n"))
+    assert reader.read_ascii() == 2
+    batch = reader.merge_reader.drain()
+    assert list(batch["X"]) == [1, 65535] and list(batch["Z"]) == [3, 1023]
+    assert reader.parse_errors == 3
+
+
+def test_merged_channels_come_from_the_same_moment():
+    #After merging, the channels of the second board must show (nearly) the same time as the X channel of the first one.
+    primary = SourceReader("arduino", FakePort(2000))
+    second = SourceReader("signals", FakePort(500), ("deflection", "amplitude", "phase"))
+    out = SampleRingBuffer(1 << 18, StreamMerger.merged_fields([primary, second]))
+    reader = out.add_reader("check")
+    merger = StreamMerger([primary, second], out)
+    for thread in (primary, second, merger):
+        thread.start()
+    time.sleep(1.5)
+    for thread in (primary, second, merger):
+        thread.stop()
+    merger.join()
+    batch = reader.drain()
+    assert list(batch) == ["X", "Y", "Z", "deflection", "amplitude", "phase", "timestamp"]
+    assert len(batch["X"]) > 100
+    difference = (batch["X"].astype(int) - batch["deflection"] + 512) % 1024 - 512
+    assert abs(np.median(difference)) <= 5
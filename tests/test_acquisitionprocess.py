@@ -0,0 +1,70 @@
+#Acquisition process: the map in shared memory, seen from both sides, and a short run on the simulated Arduino.
+import time
+import numpy as np
+from acquisitionprocess import AcquisitionProcess, SharedMap
+from binning import PixelBinner
+from metrics import Metrics
+from pyramid import MapPyramid
+
+
+def test_shared_map_round_trip():
+    #The GUI side creates the arrays, the acquisition side maps the same ones by name and adds to them.
+    gui = SharedMap(64, 0, 63, tile=16)
+    try:
+        acquisition = SharedMap(64, 0, 63, tile=16, names=gui.names)
+        assert len(gui.take_dirty()) == 16 #Every tile once at the start, nothing was seen yet.
+        rng = np.random.default_rng(0)
+        x, y = rng.integers(0, 32, (2, 1000))
+        z = rng.random(1000)
+        acquisition.add(x, y, z)
+        expected = PixelBinner(64, 0, 63, tile=16)
+        expected.add(x, y, z)
+        assert gui.samples == 1000 and gui.version == 1 and (gui.idj, gui.idk) == (expected.idj, expected.idk)
+        assert np.array_equal(gui.count, expected.count)
+        assert np.array_equal(gui.mean(), expected.mean(), equal_nan=True)
+        assert np.array_equal(gui.layer("max"), expected.layer("max"), equal_nan=True)
+        assert sorted(map(tuple, gui.take_dirty())) == [(0, 0), (0, 1), (1, 0), (1, 1)]
+        assert len(gui.take_dirty()) == 0
+        marks = np.zeros((4, 4), dtype=bool)
+        marks[3, 3] = True
+        gui.mark_dirty(marks)
+        assert [tuple(t) for t in gui.take_dirty()] == [(3, 3)]
+        #A map attached later starts from the samples that are already there.
+        late = SharedMap(64, 0, 63, tile=16, names=gui.names)
+        assert late.samples == 1000 and np.array_equal(late.count, expected.count)
+        #A resumed session replaces the map in place, and a new one empties it.
+        resumed = PixelBinner(64, 0, 63, tile=16)
+        resumed.add([5], [6], [1.0])
+        acquisition.replace(resumed)
+        assert gui.samples == 1 and gui.count.sum() == 1 and gui.mean()[5, 6] == 1.0
+        assert np.all(gui.tile_seq % 2 == 0) and len(gui.take_dirty()) == 16
+        acquisition.replace()
+        assert gui.samples == 0 and gui.count.sum() == 0 and np.isnan(gui.layer("last")).all()
+    finally:
+        gui.unlink()
+
+
+def test_process_fills_the_shared_map(tmp_path):
+    #The map the GUI side sees fills up while this process does nothing but look at it, and the session file is written.
+    config = {"sources": [{"name": "arduino", "port": "sim", "channels": ("X", "Y", "Z"), "mode": "ascii"}],
+              "simulate": {"source": "raster", "rate": 50000}, "numofpoints": 1024, "scansize": 1023, "tile": 64, "capacity": 1 << 18,
+              "flush_samples": 3, "clock_offset_ns": 0, "checkpoint_interval": 30.0, "report_interval": 0.5,
+              "session": (str(tmp_path/"test.npys"), {}, False)}
+    metrics = Metrics()
+    acquisition = AcquisitionProcess(config, metrics)
+    try:
+        assert "arduino" in acquisition.wait_connected()
+        pyramid = MapPyramid(1024)
+        start = time.monotonic()
+        while time.monotonic() - start < 2:
+            pyramid.update(acquisition.map, "mean")
+            acquisition.poll()
+            time.sleep(0.05)
+        samples = acquisition.map.samples
+    finally:
+        acquisition.stop()
+    assert samples > 0 and np.nanmax(pyramid.levels[0]) > 0
+    assert acquisition.error is None and acquisition.process.exitcode == 0
+    assert metrics.snapshot()["gauges"]['serial_lines_total{source="arduino"}'] > 0
+    assert (tmp_path/"test.npys").stat().st_size > 0
+    assert (tmp_path/"test.ckpt").is_dir() #The last checkpoint, taken when the process stops.
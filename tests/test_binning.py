@@ -0,0 +1,81 @@
+#Pixel binning against a naive loop over the samples on a small grid.
+import numpy as np
+from binning import PixelBinner
+
+
+def naive(x, y, z, numofpoints, lo, hi):
+    #One sample at a time: closest grid point, then the running layers.
+    grid = np.linspace(lo, hi, numofpoints)
+    total = np.zeros((numofpoints, numofpoints))
+    count = np.zeros((numofpoints, numofpoints), dtype=int)
+    low = np.full((numofpoints, numofpoints), np.inf)
+    high = np.full((numofpoints, numofpoints), -np.inf)
+    last = np.full((numofpoints, numofpoints), np.nan)
+    for a, b, c in zip(x, y, z):
+        i = int(np.argmin(np.abs(grid - a)))
+        j = int(np.argmin(np.abs(grid - b)))
+        total[i, j] += c
+        count[i, j] += 1
+        low[i, j] = min(low[i, j], c)
+        high[i, j] = max(high[i, j], c)
+        last[i, j] = c
+    return total, count, low, high, last
+
+
+def test_layers_match_a_naive_loop():
+    #Few pixels and many samples, so most pixels get several samples in one batch (the np.add.at path).
+    rng = np.random.default_rng(0)
+    binner = PixelBinner(16, 0, 1023, tile=4)
+    x, y = rng.integers(0, 1024, (2, 3000))
+    z = rng.normal(500, 100, 3000).astype(np.float32).astype(np.float64) #float32 values, so min/max/last compare exactly.
+    for part in np.array_split(np.arange(3000), 7):
+        binner.add(x[part], y[part], z[part])
+    total, count, low, high, last = naive(x, y, z, 16, 0, 1023)
+    assert binner.samples == 3000
+    assert np.array_equal(binner.count, count)
+    assert np.allclose(binner.sum, total)
+    with np.errstate(invalid="ignore"):
+        assert np.allclose(binner.layer("mean"), total/count, equal_nan=True)
+    assert np.array_equal(binner.layer("min"), np.where(count > 0, low, np.nan), equal_nan=True)
+    assert np.array_equal(binner.layer("max"), np.where(count > 0, high, np.nan), equal_nan=True)
+    assert np.array_equal(binner.layer("last"), last, equal_nan=True)
+    assert np.array_equal(binner.layer("count"), count)
+
+
+def test_empty_pixels_and_out_buffer():
+    binner = PixelBinner(8, 0, 7)
+    binner.add([1, 1], [2, 2], [10.0, 20.0])
+    out = np.zeros((8, 8))
+    assert binner.layer("mean", fill=-1, out=out) is out
+    assert out[1, 2] == 15 and (out == -1).sum() == 63
+    region = (slice(0, 4), slice(0, 4))
+    assert binner.layer("last", region=region)[1, 2] == 20 and binner.layer("last", region=region).shape == (4, 4)
+    assert (binner.idj, binner.idk) == (1, 2)
+
+
+def test_out_of_range_samples_land_on_the_edge():
+    binner = PixelBinner(8, 0, 7)
+    binner.add([-5, 100, 3.4, 3.6], [3, -1, 1e9, 0], [1.0, 2.0, 3.0, 4.0])
+    assert binner.count[0, 3] == 1 and binner.count[7, 0] == 1
+    assert binner.count[3, 7] == 1 and binner.count[4, 0] == 1
+    assert binner.count.sum() == 4
+    binner.add([], [], [])
+    assert binner.samples == 4
+
+
+def test_dirty_tiles_and_sequence_numbers():
+    binner = PixelBinner(16, 0, 15, tile=4)
+    assert len(binner.take_dirty()) == 0
+    binner.add([0, 1, 13], [0, 2, 9], [1.0, 1.0, 1.0])
+    assert sorted(map(tuple, binner.take_dirty())) == [(0, 0), (3, 2)]
+    assert len(binner.take_dirty()) == 0
+    #Every add makes the touched tiles odd and even again: +2 per batch, other tiles untouched.
+    assert binner.tile_seq[0, 0] == 2 and binner.tile_seq[3, 2] == 2 and binner.tile_seq.sum() == 4
+    binner.add([0], [0], [2.0])
+    assert binner.tile_seq[0, 0] == 4 and binner.tile_seq[3, 2] == 2
+    assert np.all(binner.tile_seq % 2 == 0)
+    marks = np.zeros((4, 4), dtype=bool)
+    marks[1, 1] = True
+    binner.take_dirty()
+    binner.mark_dirty(marks)
+    assert [tuple(t) for t in binner.take_dirty()] == [(1, 1)]
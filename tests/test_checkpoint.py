@@ -0,0 +1,43 @@
+#Checkpoint halfway through a session plus the replayed tail must give the same map as binning everything.
+import numpy as np
+from binning import PixelBinner
+from checkpoint import Checkpointer, checkpoint_dir, read_pointer, resume
+from sessionfile import SessionWriter
+
+
+def write_session(session, batches, checkpoint_at=None):
+    rng = np.random.default_rng(0)
+    writer = SessionWriter(session)
+    binner = PixelBinner()
+    checkpointer = Checkpointer(session)
+    for i in range(batches):
+        x, y, z = (rng.integers(0, 1024, 5000).astype(np.uint16) for _ in range(3))
+        binner.add(x, y, 1024-z.astype(np.float64))
+        writer.submit({"X": x, "Y": y, "Z": z, "timestamp": np.full(5000, i, dtype=np.int64)})
+        if i == checkpoint_at:
+            checkpointer.take(binner, writer, wait=True)
+    return binner, writer, checkpointer
+
+
+def test_resume_replays_the_tail(tmp_path):
+    session = tmp_path/"test.npys"
+    binner, writer, checkpointer = write_session(session, 200, checkpoint_at=120)
+    writer.close()
+    checkpointer.close()
+    resumed, replayed = resume(session)
+    assert 0 < replayed < binner.samples
+    assert resumed.samples == binner.samples and np.array_equal(resumed.count, binner.count)
+    assert np.allclose(resumed.mean(), binner.mean(), equal_nan=True)
+
+
+def test_last_checkpoint_of_a_short_session(tmp_path):
+    #What the program does on quit: one checkpoint at the very end, then the writer is closed.
+    session = tmp_path/"short.npys"
+    binner, writer, checkpointer = write_session(session, 10)
+    assert not checkpoint_dir(session).exists() #Only made by the first checkpoint.
+    checkpointer.take(binner, writer, wait=True)
+    writer.close()
+    checkpointer.close()
+    assert read_pointer(session)["samples"] == binner.samples
+    resumed, replayed = resume(session)
+    assert resumed.samples == binner.samples and np.array_equal(resumed.count, binner.count)
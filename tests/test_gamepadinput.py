@@ -0,0 +1,91 @@
+#Gamepad button events: one action per press, debounce, hold-repeat, and the button numbers of the menus.
+import types
+from gamepadinput import InputDispatcher, BUTTONS, JOYAXISMOTION, JOYBUTTONDOWN, JOYBUTTONUP
+from simulator import ScriptedGamepad
+
+
+def down(button):
+    return types.SimpleNamespace(type=JOYBUTTONDOWN, button=button)
+
+
+def up(button):
+    return types.SimpleNamespace(type=JOYBUTTONUP, button=button)
+
+
+def dispatcher(repeats=False):
+    calls = []
+    inputs = InputDispatcher(debounce=0.03, hold_delay=0.5, repeat_interval=0.25)
+    inputs.set_table({1: (lambda: calls.append("A"), repeats)})
+    return inputs, calls
+
+
+def test_one_action_per_press():
+    inputs, calls = dispatcher()
+    inputs.handle([down(1)], now=0.0)
+    for k in range(1, 100): #Polls while the button is held.
+        inputs.handle([], now=0.01*k)
+    inputs.handle([down(1)], now=1.0) #A second down without an up is not a new press.
+    assert calls == ["A"]
+    inputs.handle([up(1)], now=1.1)
+    inputs.handle([down(1), up(1)], now=1.2)
+    assert calls == ["A", "A"] and inputs.fired == 2
+
+
+def test_debounce():
+    inputs, calls = dispatcher()
+    inputs.handle([down(1)], now=0.0)
+    inputs.handle([up(1)], now=0.1)
+    inputs.handle([down(1)], now=0.11) #Bounce right after the release.
+    inputs.handle([up(1)], now=0.12)
+    assert calls == ["A"]
+    inputs.handle([down(1)], now=0.2)
+    assert calls == ["A", "A"]
+
+
+def test_hold_repeat():
+    inputs, calls = dispatcher(repeats=True)
+    inputs.handle([down(1)], now=0.0)
+    inputs.handle([], now=0.49)
+    assert len(calls) == 1
+    inputs.handle([], now=0.5) #hold_delay
+    assert len(calls) == 2
+    inputs.handle([], now=0.74)
+    assert len(calls) == 2
+    inputs.handle([], now=0.75) #Then every repeat_interval.
+    inputs.handle([], now=1.0)
+    assert len(calls) == 4
+    inputs.handle([], now=3.0) #A late poll repeats once, it does not catch up.
+    assert len(calls) == 5
+    inputs.handle([up(1)], now=3.1)
+    inputs.handle([], now=10.0)
+    assert len(calls) == 5
+
+
+def test_buttons_without_action_and_axes():
+    inputs, calls = dispatcher()
+    inputs.handle([down(7), up(7), types.SimpleNamespace(type=JOYAXISMOTION, axis=0, value=0.8)], now=0.0)
+    assert calls == [] and inputs.fired == 0
+    assert inputs.axis(0) == 0.8 and inputs.axis(1) == 0.0
+
+
+def test_new_table_for_held_buttons():
+    inputs, calls = dispatcher(repeats=True)
+    inputs.handle([down(1)], now=0.0)
+    inputs.set_table({1: (lambda: calls.append("B"), True)})
+    inputs.handle([], now=0.5)
+    assert calls == ["A", "B"]
+
+
+def test_button_numbers():
+    assert BUTTONS["LB"] == 4 and BUTTONS["RB"] == 5 and BUTTONS["Start"] == 7 and BUTTONS["Select"] == 6
+    assert len(set(BUTTONS.values())) == len(BUTTONS)
+    #The menus of the shoulder and middle buttons fire for the buttons the gamepad reports.
+    calls = []
+    inputs = InputDispatcher()
+    inputs.set_table({BUTTONS[name]: (lambda name=name: calls.append(name), False) for name in ("LB", "RB", "Start", "Select")})
+    gamepad = ScriptedGamepad()
+    for button in (4, 5, 7, 6):
+        gamepad.press(button)
+        gamepad.press(button, False)
+    inputs.handle(gamepad.get_events(), now=0.0)
+    assert calls == ["LB", "RB", "Start", "Select"]
@@ -0,0 +1,32 @@
+#Gap planner: every gap cell is visited, and the tour ordering works.
+import numpy as np
+import pytest
+from gapplanner import gap_cells, nearest_neighbour, plan_gaps, two_opt
+
+
+@pytest.mark.parametrize("holes", [5, 50, 500])
+def test_every_gap_cell_is_planned(holes):
+    #A map that was visited everywhere except for some holes.
+    rng = np.random.default_rng(holes)
+    count = np.ones((1024, 1024), dtype=np.uint32)
+    for x, y in rng.integers(0, 1000, (holes, 2)):
+        count[x:x + 20, y:y + 20] = 0
+    vertices, info = plan_gaps(count, (0.0, 0.0), (-50e-6, -50e-6), (100e-6/1023, 100e-6/1023))
+    gaps, offset = gap_cells(count)
+    assert len(vertices) == info["gap_cells"] == gaps.sum()
+    assert 0 < info["regions"] <= holes
+    assert np.all(np.abs(vertices) <= 50e-6)
+
+
+def test_nothing_visited_nothing_planned():
+    vertices, info = plan_gaps(np.zeros((1024, 1024)), (0, 0), (0, 0), (1e-7, 1e-7))
+    assert len(vertices) == 0 and info["regions"] == 0
+
+
+def test_two_opt_does_not_make_the_tour_longer():
+    tour_length = lambda points, order, start: np.hypot(*np.diff(np.vstack((start, points[order])), axis=0).T).sum()
+    points = np.random.default_rng(0).random((300, 2))
+    greedy = nearest_neighbour(points, (0, 0))
+    improved = two_opt(points, greedy, (0, 0))
+    assert sorted(improved) == list(range(300))
+    assert tour_length(points, improved, (0, 0)) < tour_length(points, greedy, (0, 0))
@@ -0,0 +1,63 @@
+#Leveling from running sums.
+import numpy as np
+from binning import PixelBinner
+from leveling import Leveler, AutoContrast
+
+FULL = (-50, 50, -50, 50)
+
+
+def surface_map():
+    #A tilted and curved surface, sampled at random.
+    rng = np.random.default_rng(0)
+    binner = PixelBinner(1024, 0, 1023)
+    leveler = Leveler(1024, 0, 1023)
+    for _ in range(20):
+        x, y = rng.integers(0, 1024, (2, 50000))
+        z = 500 + 0.3*x - 0.2*y + 2e-4*(x - 512)**2 + rng.normal(0, 1, x.size)
+        binner.add(x, y, z)
+        leveler.add(x, y, z)
+    return binner, leveler
+
+
+def test_poly2_takes_out_the_surface():
+    binner, leveler = surface_map()
+    raw = binner.mean().astype(np.float32)
+    leveled = leveler.apply(raw, FULL, "poly2")
+    assert np.nanstd(raw) > 50 and np.nanstd(leveled) < 2
+    assert abs(np.nanmean(leveled) - np.nanmean(raw)) < 1 #The level stays.
+    assert np.nanstd(leveler.apply(raw, FULL, "plane")) < np.nanstd(raw)/2
+    assert leveler.apply(raw, FULL, "none") is raw
+
+
+def test_part_of_a_coarser_level():
+    #A zoomed part of a coarser level, like the live view shows it.
+    binner, leveler = surface_map()
+    coarse = np.nanmean(binner.mean().reshape(256, 4, 256, 4), axis=(1, 3))
+    assert np.nanstd(leveler.apply(coarse[64:128, 32:96], (-25, 0, -37.5, -12.5), "poly2")) < 2
+
+
+def test_sums_rebuilt_from_the_map():
+    binner, leveler = surface_map()
+    rebuilt = Leveler.from_binner(binner)
+    for (a, b), c in leveler.coefficients("poly2").items():
+        assert abs(c - rebuilt.coefficients("poly2")[(a, b)]) < 1e-2*max(1, abs(c))
+
+
+def test_line_offsets():
+    rng = np.random.default_rng(1)
+    lines = Leveler(1024, 0, 1023)
+    offsets = rng.normal(0, 50, 1024)
+    x, y = rng.integers(0, 1024, (2, 1000000))
+    lines.add(x, y, 500 + offsets[y] + rng.normal(0, 1, x.size))
+    grid = np.full((1024, 1024), 500, dtype=np.float32) + offsets[None, :].astype(np.float32)
+    assert np.std(lines.apply(grid, FULL, "lines")) < 1
+
+
+def test_auto_contrast():
+    contrast = AutoContrast(smoothing=0.5)
+    data = np.arange(10000, dtype=np.float32).reshape(100, 100)
+    low, high = contrast.update(data)
+    assert 90 < low < 110 and 9890 < high < 9910
+    low, high = contrast.update(data + 1000) #Smoothed, half way.
+    assert 590 < low < 610
+    assert contrast.update(np.full((10, 10), np.nan)) == (low, high)
@@ -0,0 +1,84 @@
+#Metrics registry: snapshots, rates and the Prometheus page.
+import threading
+import urllib.request
+from metrics import Metrics, PrometheusServer, rates
+
+
+def sample_metrics():
+    metrics = Metrics()
+    lines = metrics.counter("lines_read_total")
+    rpc = metrics.histogram("studio_rpc_seconds", path="core.z_controller.property.setpoint")
+    metrics.gauge("queue_depth", lambda: 3)
+    metrics.gauge("broken", lambda: 1/0)
+    for i in range(1000):
+        lines.inc()
+        rpc.observe(0.001*(i % 10))
+    return metrics
+
+
+def test_prometheus_format():
+    page = sample_metrics().prometheus()
+    lines = page.splitlines()
+    assert page.endswith("\n")
+    assert "lines_read_total 1000" in lines and "queue_depth 3.0" in lines
+    assert not any(line.startswith("broken") for line in lines) #A gauge that cannot be read is left out.
+    key = 'studio_rpc_seconds_bucket{path="core.z_controller.property.setpoint",le='
+    buckets = [line for line in lines if line.startswith(key)]
+    counts = [int(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert counts == sorted(counts) and buckets[-1] == key + '"+Inf"} 1000' #Cumulative, like Prometheus wants them.
+    assert buckets[0] == key + '"5e-05"} 100' #The observations of 0.
+    assert 'studio_rpc_seconds_count{path="core.z_controller.property.setpoint"} 1000' in lines
+    sums = [line for line in lines if line.startswith("studio_rpc_seconds_sum")]
+    assert len(sums) == 1 and abs(float(sums[0].rsplit(" ", 1)[1]) - 4.5) < 1e-9
+
+
+def test_imported_metrics_replace_ours():
+    metrics = sample_metrics()
+    other = Metrics()
+    other.counter("lines_read_total").inc(7)
+    other.histogram("binning_seconds", layer="mean").observe(0.5)
+    metrics.import_snapshot(other.snapshot())
+    lines = metrics.prometheus().splitlines()
+    assert "lines_read_total 7" in lines and "lines_read_total 1000" not in lines
+    assert 'binning_seconds_count{layer="mean"} 1' in lines and 'binning_seconds_sum{layer="mean"} 0.5' in lines
+    assert metrics.snapshot()["counters"]["lines_read_total"] == 7
+
+
+def test_rates():
+    metrics = Metrics()
+    counter = metrics.counter("samples_total")
+    first = metrics.snapshot()
+    counter.inc(500)
+    second = metrics.snapshot()
+    second["monotonic"] = first["monotonic"] + 0.5
+    assert rates(first, second) == {"samples_total": 1000.0}
+    assert rates(None, second) == {}
+
+
+def test_page_while_instruments_are_added():
+    #Instruments are created by the acquisition threads while the HTTP thread builds the page.
+    metrics = Metrics()
+    def register():
+        for k in range(3000):
+            metrics.counter("reads_total", source=str(k)).inc()
+            metrics.gauge("depth", lambda: 1, source=str(k))
+            metrics.histogram("read_seconds", source=str(k)).observe(0.001)
+    thread = threading.Thread(target=register, daemon=True)
+    thread.start()
+    while thread.is_alive():
+        metrics.prometheus()
+    thread.join()
+    assert metrics.prometheus().count("reads_total") == 3000
+
+
+def test_http_page():
+    metrics = sample_metrics()
+    server = PrometheusServer(metrics, port=0)
+    server.start()
+    try:
+        port = server.server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=10) as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert "lines_read_total 1000" in response.read().decode().splitlines()
+    finally:
+        server.stop()
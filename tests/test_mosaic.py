@@ -0,0 +1,77 @@
+#Mosaic map with tiles allocated on demand.
+import numpy as np
+import gamepad_2_7 as gp
+from mosaic import MosaicMap, MosaicTile, COUNT_LIMIT, counts_to_metres
+from simulator import FakeSPM
+from studiocache import PropertyCache, OFFSET_X, OFFSET_Y
+
+
+def test_calibration():
+    assert np.isclose(counts_to_metres(0, -0.5, 0.25), 50e-6)
+    assert np.isclose(counts_to_metres(1023, -0.5, 0.25), -50e-6)
+
+
+def test_two_scans_stitch_into_one_sparse_map(tmp_path):
+    #Two 100 um scans 300 um apart: only the tiles they touch are allocated, and a render at full resolution gives the same mean as
+    #binning the samples directly.
+    rng = np.random.default_rng(0)
+    mosaic = MosaicMap(pixel=1e-6, tile=64)
+    x, y, z = [], [], []
+    for origin in (0.0, 300e-6):
+        counts = rng.integers(0, 1024, (2, 200000))
+        px = counts_to_metres(counts[0], -0.5, 0.25) + origin
+        py = counts_to_metres(counts[1], -0.5, 0.25)
+        pz = rng.uniform(0, 1023, 200000)
+        mosaic.add(px, py, pz)
+        x.append(px), y.append(py), z.append(pz)
+    x, y, z = np.concatenate(x), np.concatenate(y), np.concatenate(z)
+    bounds = mosaic.bounds()
+    assert len(mosaic.tiles) == 10 #2 x 2 tiles per scan and 6 for the 64 um steps they straddle, none in between.
+    assert mosaic.nbytes < (bounds[1] - bounds[0])*(bounds[3] - bounds[2])/mosaic.pixel**2*16
+    data, extent = mosaic.render(bounds[:2], bounds[2:], 10000, 10000)
+    i = np.floor(x/mosaic.pixel).astype(int) - int(round(extent[0]/mosaic.pixel))
+    j = np.floor(y/mosaic.pixel).astype(int) - int(round(extent[2]/mosaic.pixel))
+    total = np.zeros(data.shape)
+    count = np.zeros(data.shape)
+    np.add.at(total, (i, j), z)
+    np.add.at(count, (i, j), 1)
+    with np.errstate(invalid="ignore"):
+        assert np.allclose(data, total/count, equal_nan=True, rtol=1e-4)
+    small, _ = mosaic.render(bounds[:2], bounds[2:], 200, 200)
+    assert max(small.shape) <= 200
+    path = tmp_path/"mosaic.npz"
+    mosaic.save(path)
+    assert np.array_equal(MosaicMap.load(path).render(bounds[:2], bounds[2:], 200, 200)[0], small, equal_nan=True)
+
+
+def test_full_count_keeps_the_mean():
+    #A pixel whose count is full takes no more samples into its sum, so its mean does not drift.
+    mosaic = MosaicMap(pixel=1e-6, tile=8)
+    tile = mosaic.tiles[(0, 0)] = MosaicTile(8)
+    tile.count[0, 0] = COUNT_LIMIT - 10
+    tile.sum[0, 0] = 500.0*(COUNT_LIMIT - 10)
+    mosaic.add(np.full(100, 0.5e-6), np.full(100, 0.5e-6), np.full(100, 500.0))
+    assert tile.count[0, 0] == COUNT_LIMIT
+    mosaic.add(np.full(100, 0.5e-6), np.full(100, 0.5e-6), np.full(100, 900.0))
+    assert tile.count[0, 0] == COUNT_LIMIT
+    assert np.isclose(mosaic.render((0, 8e-6), (0, 8e-6), 8, 8)[0][0, 0], 500.0)
+
+
+def test_origin_is_read_from_studio(monkeypatch):
+    #The image offset is seeded from Studio, read again after the cache is emptied, and only ever peeked at by mosaic_position.
+    spm = FakeSPM()
+    spm.values[OFFSET_X + ".value"] = 20e-6
+    spm.values[OFFSET_Y + ".value"] = -5e-6
+    monkeypatch.setattr(gp, "cache", PropertyCache(spm, 5.0))
+    assert gp.mosaic_origin == "offset"
+    assert np.allclose(gp.mosaic_position(0, 0), (counts_to_metres(0, gp.CALIB_GAIN, gp.CALIB_OFFSET),)*2)
+    gp.read_mosaic_origin()
+    x0 = counts_to_metres(0, gp.CALIB_GAIN, gp.CALIB_OFFSET)
+    assert np.allclose(gp.mosaic_position(0, 0), (x0 + 20e-6, x0 - 5e-6))
+    reads = spm.reads
+    gp.mosaic_position(np.arange(1024), np.arange(1024))
+    assert spm.reads == reads
+    gp.cache.invalidate()
+    spm.values[OFFSET_X + ".value"] = 40e-6
+    gp.refresh_cache()
+    assert np.allclose(gp.mosaic_position(0, 0), (x0 + 40e-6, x0 - 5e-6))
@@ -0,0 +1,55 @@
+#Joystick motion: deadzone and response curve, integration over real time, and the rate of the targets sent to Studio.
+import pytest
+from motioncontrol import MotionController
+
+
+def test_shape():
+    motion = MotionController(deadzone=0.2, exponent=2.0)
+    assert motion.shape(0.1) == 0.0 and motion.shape(-0.2) == 0.0
+    assert motion.shape(1.0) == 1.0 and motion.shape(-1.0) == -1.0
+    assert motion.shape(0.6) == pytest.approx(0.25) #Half way out of the deadzone, squared.
+    assert motion.shape(1.2) == 1.0
+
+
+def test_velocity():
+    motion = MotionController(deadzone=0.0, exponent=1.0, max_speed=20e-6, fine_speed=1e-6)
+    assert motion.velocity(1.0, 0.0) == (20e-6, -0.0)
+    assert motion.velocity(0.0, -1.0, 0.0, -1.0) == pytest.approx((0.0, 21e-6)) #Up is negative on the sticks.
+
+
+def test_nothing_before_the_position_is_known():
+    motion = MotionController()
+    assert motion.update(1.0, 0.0, now=0.0) is None and motion.position is None
+
+
+def test_distance_does_not_depend_on_the_update_rate():
+    ends = []
+    for step in (0.002, 0.01, 0.05):
+        motion = MotionController(deadzone=0.0, exponent=1.0, max_speed=10e-6)
+        motion.set_position(0.0, 0.0)
+        t = 0.0
+        while t < 1.0 + 1e-9:
+            motion.update(0.5, 0.0, now=t)
+            t += step
+        ends.append(motion.position[0])
+    assert ends == pytest.approx([5e-6]*3, rel=1e-6)
+
+
+def test_targets_at_the_command_rate_only():
+    motion = MotionController(deadzone=0.0, exponent=1.0, command_rate=20)
+    motion.set_position(1e-6, 2e-6)
+    assert motion.update(0.0, 0.0, now=0.0) is None #Not moved, nothing to send.
+    sent = [motion.update(1.0, 0.0, now=0.001*k) for k in range(1, 1001)]
+    sent = [target for target in sent if target is not None]
+    assert 19 <= len(sent) <= 21
+    assert all(b[0] > a[0] for a, b in zip(sent, sent[1:])) and all(target[1] == 2e-6 for target in sent)
+    motion.update(0.0, 0.0, now=2.0)
+    assert motion.update(0.0, 0.0, now=3.0) is None #Stick released: the last target stays.
+
+
+def test_long_gaps_are_not_integrated():
+    motion = MotionController(deadzone=0.0, exponent=1.0, max_speed=10e-6, max_step_time=0.25)
+    motion.set_position(0.0, 0.0)
+    motion.update(1.0, 0.0, now=0.0)
+    motion.update(1.0, 0.0, now=5.0) #The GUI was busy for 5 s.
+    assert motion.position[0] == pytest.approx(2.5e-6)
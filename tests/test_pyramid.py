@@ -0,0 +1,54 @@
+#Live view pyramid: incremental updates, the level picked for the screen, and tile copies taken while samples are being added.
+import threading
+import numpy as np
+from binning import PixelBinner
+from pyramid import MapPyramid
+
+
+def test_incremental_updates_match_a_full_build():
+    rng = np.random.default_rng(1)
+    binner = PixelBinner(1024, 0, 1023)
+    pyramid = MapPyramid(1024)
+    for layer in ("mean", "max"):
+        for _ in range(20):
+            x, y = rng.integers(0, 300, (2, 1)) + rng.integers(0, 60, (2, 500))
+            binner.add(x, y, rng.random(500))
+            pyramid.update(binner, layer)
+        full = MapPyramid(1024)
+        full.update(binner, layer)
+        for a, b in zip(pyramid.levels, full.levels):
+            assert np.allclose(a, b, equal_nan=True)
+
+
+def test_select_picks_the_level_for_the_screen():
+    pyramid = MapPyramid(1024)
+    level, data, extent = pyramid.select((-50, 50), (-50, 50), 400, 400)
+    assert level == 1 and data.shape == (512, 512) and extent == (-50, 50, -50, 50)
+    level, data, extent = pyramid.select((0, 2), (0, 2), 400, 400)
+    assert level == 0 and data.shape[0] < 30
+
+
+def test_no_torn_tiles_while_adding():
+    #Every sample has z = 1, so a torn copy would show up as a mean other than 1 (sum and count of different batches).
+    rng = np.random.default_rng(2)
+    binner = PixelBinner(1024, 0, 1023)
+    pyramid = MapPyramid(1024)
+    stop = threading.Event()
+    def add():
+        while not stop.is_set():
+            x, y = rng.integers(0, 900, (2, 1)) + rng.integers(0, 120, (2, 5000))
+            binner.add(x, y, np.ones(5000))
+    thread = threading.Thread(target=add, daemon=True)
+    thread.start()
+    try:
+        for _ in range(100):
+            pyramid.update(binner, "mean")
+            for a in pyramid.levels:
+                assert np.all(np.isnan(a) | (a == 1))
+    finally:
+        stop.set()
+        thread.join()
+    pyramid.update(binner, "mean")
+    full = MapPyramid(1024)
+    full.update(binner, "mean")
+    assert all(np.array_equal(a, b, equal_nan=True) for a, b in zip(pyramid.levels, full.levels))
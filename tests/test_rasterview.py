@@ -0,0 +1,59 @@
+#Raster view: z limits to colormap entries, empty pixels, and the orientation of the image.
+import os
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+import numpy as np
+import pytest
+from PySide6.QtWidgets import QApplication
+from rasterview import RasterView, colormap_lut, EMPTY
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QApplication.instance() or QApplication([])
+
+
+def test_lut():
+    lut = colormap_lut("viridis")
+    assert lut.dtype == np.uint32 and len(lut) == 256
+    assert np.all(lut >> 24 == 255) #Opaque.
+    assert lut[0] == 0xFF440154 and lut[255] == 0xFFFDE725 #The ends of viridis.
+
+
+def test_limits_map_to_the_ends_of_the_colormap(app):
+    view = RasterView()
+    #data[x, y]: x along the columns of the image, y from the top row (largest y) down.
+    data = np.array([[10.0, 20.0, np.nan],
+                     [15.0, 5.0, 30.0]], dtype=np.float32)
+    view.set_map(data, (-50, 50, -50, 50), 10, 20)
+    pixels = view.pixels
+    assert pixels.shape == (3, 2)
+    assert pixels[2, 0] == view.lut[0] #zmin
+    assert pixels[1, 0] == view.lut[255] #zmax
+    assert pixels[0, 0] == EMPTY #NaN, no samples
+    assert pixels[2, 1] == view.lut[128] #Half way.
+    assert pixels[1, 1] == view.lut[0] and pixels[0, 1] == view.lut[255] #Outside the limits: clipped to the ends.
+    assert view.image.width() == 2 and view.image.height() == 3
+    assert view.image.pixel(0, 0) == EMPTY and view.image.pixel(0, 1) == view.lut[255]
+
+
+def test_flat_limits_and_reused_buffers(app):
+    view = RasterView()
+    data = np.full((4, 4), 7.0)
+    data[0, 0] = np.nan
+    view.set_map(data, (0, 1, 0, 1), 7, 7) #zmin == zmax must not divide by zero.
+    assert np.all(view.pixels[:-1] == view.lut[0]) and view.pixels[-1, 0] == EMPTY
+    scaled = view.scaled
+    view.set_map(data*2, (0, 1, 0, 1), 0, 20)
+    assert view.scaled is scaled and view.extent == (0, 1, 0, 1)
+
+
+def test_paint(app):
+    view = RasterView()
+    view.resize(300, 300)
+    view.set_limits(-50, 50, -50, 50)
+    view.set_map(np.full((8, 8), np.nan), (-50, 50, -50, 50), 0, 1)
+    view.set_cursor(0, 0)
+    image = view.grab().toImage()
+    rect = view.plot_rect()
+    assert abs(rect.width() - rect.height()) < 1 #Square limits, square plot.
+    assert image.pixelColor(int(rect.center().x()), int(rect.center().y())).red() == 255 #The cursor lines cross at the centre.
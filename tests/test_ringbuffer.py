@@ -0,0 +1,73 @@
+#Ring buffer between the serial reader and its consumers: wrap-around, one cursor per consumer and overrun accounting.
+import numpy as np
+from ringbuffer import SampleRingBuffer, SAMPLE_FIELDS
+
+
+def block(start, n):
+    values = np.arange(start, start + n)
+    return values.astype(np.uint16), values.astype(np.uint16), values.astype(np.uint16), values.astype(np.int64)
+
+
+def test_extend_across_the_wrap():
+    ring = SampleRingBuffer(16)
+    reader = ring.add_reader("map")
+    ring.extend(*block(0, 10))
+    assert list(reader.drain()["timestamp"]) == list(range(10))
+    ring.extend(*block(10, 10)) #Starts at index 10 of 16, so 6 samples go to the end and 4 to the start.
+    assert reader.available() == 10
+    batch = reader.drain()
+    assert list(batch["timestamp"]) == list(range(10, 20)) and list(batch["X"]) == list(range(10, 20))
+    assert batch["X"].dtype == np.uint16 and batch["timestamp"].dtype == np.int64
+    assert list(ring.columns["timestamp"][:4]) == [16, 17, 18, 19]
+    assert reader.overruns == 0
+
+
+def test_push_and_extend_keep_the_order():
+    ring = SampleRingBuffer(8)
+    reader = ring.add_reader("file")
+    ring.push(1, 2, 3, 100)
+    ring.extend(*block(101, 3))
+    ring.push(4, 5, 6, 104)
+    batch = reader.drain()
+    assert list(batch["timestamp"]) == [100, 101, 102, 103, 104]
+    assert [batch[name][0] for name, _ in SAMPLE_FIELDS] == [1, 2, 3, 100]
+
+
+def test_readers_have_their_own_cursors():
+    ring = SampleRingBuffer(32)
+    fast = ring.add_reader("map")
+    ring.extend(*block(0, 5))
+    late = ring.add_reader("file") #Only sees what comes after it registered.
+    ring.extend(*block(5, 5))
+    assert fast.available() == 10 and late.available() == 5
+    assert list(fast.drain(max_samples=4)["timestamp"]) == [0, 1, 2, 3]
+    assert fast.available() == 6 and late.available() == 5
+    assert list(late.drain()["timestamp"]) == [5, 6, 7, 8, 9]
+    assert list(fast.drain()["timestamp"]) == [4, 5, 6, 7, 8, 9]
+    assert fast.available() == late.available() == 0
+    assert all(len(a) == 0 for a in fast.drain().values())
+
+
+def test_slow_reader_is_overrun():
+    ring = SampleRingBuffer(16)
+    slow = ring.add_reader("file")
+    fast = ring.add_reader("map")
+    for start in range(0, 40, 8):
+        ring.extend(*block(start, 8))
+        assert len(fast.drain()["timestamp"]) == 8
+    assert slow.available() == 40
+    batch = slow.drain() #Resyncs to the oldest sample still in the buffer.
+    assert list(batch["timestamp"]) == list(range(24, 40))
+    assert slow.overruns == 24 and fast.overruns == 0
+    assert ring.overruns() == {"file": 24, "map": 0}
+    ring.extend(*block(40, 3))
+    assert list(slow.drain()["timestamp"]) == [40, 41, 42] and slow.overruns == 24
+
+
+def test_block_larger_than_the_buffer():
+    ring = SampleRingBuffer(16)
+    reader = ring.add_reader("map")
+    ring.extend(*block(0, 50))
+    assert ring.written == 50 and reader.available() == 50
+    assert list(reader.drain()["timestamp"]) == list(range(34, 50))
+    assert reader.overruns == 34
@@ -0,0 +1,97 @@
+#Tip paths and the path executor, driven against the fake Studio position controller.
+import threading
+import numpy as np
+import pytest
+from scanpaths import hilbert_vertices, serpentine_vertices, spiral_vertices, merge_collinear, PathExecutor
+from simulator import FakeSPM
+
+ATTRIBUTE = "lu.position_control.instance.attribute."
+
+
+@pytest.mark.parametrize("order", [1, 2, 3, 5])
+def test_hilbert_visits_every_point_once_in_unit_steps(order):
+    points = np.rint(hilbert_vertices(order, 1.0)).astype(int)
+    assert len(points) == 4**order
+    assert len({tuple(p) for p in points}) == 4**order
+    assert points.min() == 0 and points.max() == 2**order - 1
+    assert np.all(np.abs(np.diff(points, axis=0)).sum(axis=1) == 1)
+
+
+def test_hilbert_step_and_origin():
+    points = hilbert_vertices(3, 0.5e-6, origin=(1e-6, -2e-6))
+    assert tuple(points[0]) == (1e-6, -2e-6)
+    assert np.allclose(np.hypot(*np.diff(points, axis=0).T), 0.5e-6)
+
+
+def test_merge_collinear():
+    path = [(0, 0), (1, 0), (2, 0), (2, 0), (2, 1), (2, 2), (1, 2), (3, 2)]
+    assert merge_collinear(path).tolist() == [[0, 0], [2, 0], [2, 2], [1, 2], [3, 2]] #A reversal is kept.
+    assert len(merge_collinear([(0, 0), (1, 1)])) == 2
+    #A serpentine is already one move per line end, a Hilbert curve loses the straight runs but not its shape.
+    serpentine = serpentine_vertices(10e-6, 4e-6, 1e-6)
+    assert np.array_equal(merge_collinear(serpentine), serpentine) and len(serpentine) == 10
+    hilbert = hilbert_vertices(4, 1.0)
+    merged = merge_collinear(hilbert)
+    assert len(merged) < len(hilbert)
+    assert {tuple(p) for p in merged} <= {tuple(p) for p in hilbert} and np.array_equal(merged[[0, -1]], hilbert[[0, -1]])
+
+
+def test_spiral():
+    points = spiral_vertices(10e-6, 1e-6, center=(5e-6, 0.0))
+    assert tuple(points[0]) == (5e-6, 0.0)
+    assert np.hypot(points[-1, 0] - 5e-6, points[-1, 1]) == pytest.approx(10e-6)
+
+
+def fake_controller(move_speed=None):
+    #move() and position() like gamepad_2_7.py gives them to the executor, on the fake Studio.
+    spm = FakeSPM(move_speed=move_speed)
+    def move(x, y):
+        spm.write(ATTRIBUTE + "target_move_pos_x", x)
+        spm.write(ATTRIBUTE + "target_move_pos_y", y)
+        spm.call("lu.position_control.instance.move_to_target_fix_speed_xy", ())
+    def position():
+        return spm.read(ATTRIBUTE + "current_pos_x"), spm.read(ATTRIBUTE + "current_pos_y")
+    return spm, move, position
+
+
+def test_executor_follows_the_path():
+    spm, move, position = fake_controller()
+    vertices = serpentine_vertices(4e-6, 2e-6, 1e-6)
+    progress = []
+    executor = PathExecutor(vertices, move, position, poll=0.001, on_progress=lambda *p: progress.append(p))
+    executor.start()
+    executor.join(10)
+    assert executor.done == len(vertices) and executor.timeouts == 0
+    assert position() == tuple(vertices[-1])
+    assert [p[:2] for p in progress] == [(k, len(vertices)) for k in range(1, len(vertices) + 1)]
+    assert progress[-1][2] == 0
+
+
+def test_pause_resume_and_cancel():
+    spm, move, position = fake_controller()
+    vertices = hilbert_vertices(2, 1e-6)
+    executor = PathExecutor(vertices, move, position, poll=0.001)
+    executor.pause()
+    executor.start()
+    executor.join(0.1)
+    assert executor.is_alive() and executor.done == 0 and spm.calls == 0
+    executor.resume()
+    executor.join(10)
+    assert executor.done == len(vertices)
+
+    reached = threading.Event()
+    def progress(done, total, eta):
+        if done == 3:
+            executor.cancel()
+            reached.set()
+    executor = PathExecutor(vertices, move, position, poll=0.001, on_progress=progress)
+    executor.start()
+    executor.join(10)
+    assert reached.is_set() and executor.done == 3 and not executor.is_alive()
+
+
+def test_timeout_when_the_tip_does_not_arrive():
+    executor = PathExecutor([(0.0, 0.0), (1e-6, 0.0)], lambda x, y: None, lambda: (0.0, 0.0), timeout=0.05, poll=0.001)
+    executor.start()
+    executor.join(10)
+    assert executor.done == 2 and executor.timeouts == 1
@@ -0,0 +1,40 @@
+#Decoder of the binary frames against synthetic byte streams: clean, split at arbitrary points, with garbage, corrupt and missing frames.
+import numpy as np
+from serialprotocol import BinaryFrameDecoder, encode_frames
+
+N = 5000
+
+
+def samples():
+    rng = np.random.default_rng(0)
+    x, y, z = (rng.integers(0, 1024, N, dtype=np.uint16) for _ in range(3))
+    return x, y, z, encode_frames(x, y, z)
+
+
+def test_clean_stream():
+    x, y, z, stream = samples()
+    decoder = BinaryFrameDecoder()
+    dx, dy, dz = decoder.feed(stream)
+    assert (dx == x).all() and (dy == y).all() and (dz == z).all()
+    assert decoder.dropped_frames == 0 and decoder.corrupt_frames == 0
+
+
+def test_frames_split_across_reads():
+    x, y, z, stream = samples()
+    decoder = BinaryFrameDecoder(buffer_size=97) #Small buffer, so frames get split across reads.
+    parts = [decoder.feed(stream[i:i + 33]) for i in range(0, len(stream), 33)]
+    assert (np.concatenate([p[0] for p in parts]) == x).all()
+
+
+def test_garbage_corrupt_and_lost_frames():
+    x, y, z, stream = samples()
+    broken = bytearray(b"\x13\xaa\x00" + stream)
+    broken[3 + 10*100 + 5] ^= 0xFF #Corrupt frame 100.
+    del broken[3 + 10*200:3 + 10*203] #Lose frames 200-202.
+    broken[3 + 10*300:3 + 10*300] = b"\xaa\x55garbage" #Garbage that starts like a sync word.
+    decoder = BinaryFrameDecoder()
+    dx, dy, dz = decoder.feed(bytes(broken))
+    expected = np.delete(np.arange(N), [100, 200, 201, 202])
+    assert (dx == x[expected]).all() and (dz == z[expected]).all()
+    assert decoder.dropped_frames == 4
+    assert decoder.corrupt_frames == 2
@@ -0,0 +1,100 @@
+#Session files: background writer, reading the chunks back, recovering from a chunk cut short, and the CSV export.
+import os
+import subprocess
+import sys
+import threading
+import numpy as np
+import sessionfile
+from sessionfile import SessionWriter, iter_chunks, read_metadata, truncate_incomplete
+
+
+def batch(start, n):
+    values = np.arange(start, start + n)
+    return {"X": values.astype(np.uint16), "Y": values.astype(np.uint16), "Z": values.astype(np.uint16),
+            "timestamp": values.astype(np.int64)*1000000}
+
+
+def write_session(path, chunks=5, n=100):
+    writer = SessionWriter(path, metadata={"numofpoints": 1024})
+    for k in range(chunks):
+        writer.submit(batch(k*n, n))
+        while writer.queue_depth(): #One chunk per batch, so the tests know where the chunks end.
+            threading.Event().wait(0.001)
+    writer.close()
+    return writer
+
+
+def test_write_and_read_back(tmp_path):
+    path = tmp_path/"session.npys"
+    writer = write_session(path)
+    assert writer.file.closed and writer.error is None
+    assert writer.samples_written == writer.submitted_samples == 500 and writer.dropped_samples == 0
+    assert writer.progress == (os.path.getsize(path), 500)
+    info = read_metadata(path)
+    assert info["format"] == sessionfile.FORMAT_NAME and info["numofpoints"] == 1024
+    chunks = list(iter_chunks(path))
+    records = np.concatenate([records for _, records in chunks])
+    assert list(records["X"]) == list(range(500)) and records["timestamp"][-1] == 499000000
+    assert records.dtype.names == ("X", "Y", "Z", "timestamp")
+    #Reading can start at any chunk.
+    assert [offset for offset, _ in iter_chunks(path, chunks[2][0])] == [offset for offset, _ in chunks[2:]]
+
+
+def test_truncated_tail_keeps_the_whole_chunks(tmp_path):
+    path = tmp_path/"session.npys"
+    write_session(path)
+    offsets = [offset for offset, _ in iter_chunks(path)]
+    size = os.path.getsize(path)
+    for cut in (1, 10, 100, size - offsets[-1] - 1): #Into the data of the last chunk, and into its header.
+        with open(path, "r+b") as f:
+            f.truncate(size - cut)
+        assert truncate_incomplete(path) == offsets[-1] == os.path.getsize(path)
+        assert sum(len(records) for _, records in iter_chunks(path)) == 400
+        write_session(tmp_path/"whole.npys") #Put the chopped file back together for the next cut.
+        os.replace(tmp_path/"whole.npys", path)
+    assert truncate_incomplete(path, offsets[3]) == size #Nothing to cut.
+    with open(path, "r+b") as f:
+        f.truncate(offsets[3] + 50)
+    assert truncate_incomplete(path, offsets[3]) == offsets[3]
+
+
+def test_resume_appends(tmp_path):
+    path = tmp_path/"session.npys"
+    write_session(path, chunks=2)
+    writer = SessionWriter(path, resume=True)
+    writer.submit(batch(200, 50))
+    writer.close()
+    assert sum(len(records) for _, records in iter_chunks(path)) == 250
+    assert len(read_metadata(path)["resumed"]) == 1
+
+
+def test_full_queue_drops_and_counts(tmp_path, monkeypatch):
+    #The writer thread is held in its first chunk, so the queue fills up and further batches are dropped without blocking.
+    taken = threading.Event()
+    release = threading.Event()
+    to_records = sessionfile.to_records
+    def slow_records(b):
+        taken.set()
+        release.wait(10)
+        return to_records(b)
+    monkeypatch.setattr(sessionfile, "to_records", slow_records)
+    writer = SessionWriter(tmp_path/"session.npys", max_queue=3)
+    writer.submit(batch(0, 10))
+    assert taken.wait(10)
+    for k in range(1, 6):
+        writer.submit(batch(k*10, 10))
+    assert writer.submitted_samples == 40 and writer.dropped_samples == 20 and writer.max_depth == 3
+    release.set()
+    writer.close()
+    assert writer.samples_written == 40
+
+
+def test_export_csv_command(tmp_path):
+    path = tmp_path/"session.npys"
+    write_session(path, chunks=3, n=10)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, os.path.join(root, "sessionfile.py"), "export", str(path)], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    lines = (tmp_path/"session.csv").read_text().splitlines()
+    assert lines[0] == "X,Y,Z,timestamp" and len(lines) == 31
+    assert lines[1].startswith("0,0,0,1970-01-01")
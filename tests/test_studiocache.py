@@ -0,0 +1,72 @@
+#Property cache on the fake Studio: reads served from the mirror, write-through, invalidate, refresh and peek.
+import time
+from metrics import Metrics
+from simulator import FakeSPM
+from studiocache import PropertyCache, SETPOINT, POS_X
+
+
+def test_hits_and_misses():
+    spm = FakeSPM()
+    cache = PropertyCache(spm, max_age=60, metrics=Metrics())
+    assert cache.get(SETPOINT) == 0.1
+    for _ in range(10):
+        assert cache.get(SETPOINT) == 0.1
+    assert spm.reads == 1
+    assert cache.stats()["hits"] == 10 and cache.stats()["misses"] == 1 and cache.stats()["cached"] == 1
+    assert cache.metrics.histogram("studio_rpc_seconds", op="read", path=SETPOINT).count == 1
+
+
+def test_old_values_are_read_again():
+    spm = FakeSPM()
+    cache = PropertyCache(spm, max_age=60)
+    cache.get(SETPOINT)
+    spm.values[SETPOINT + ".value"] = 0.3 #Changed in the Studio window.
+    assert cache.get(SETPOINT) == 0.1
+    assert cache.get(SETPOINT, max_age=0) == 0.3 and spm.reads == 2
+
+
+def test_write_through():
+    spm = FakeSPM()
+    cache = PropertyCache(spm, max_age=60)
+    cache.set(SETPOINT, 0.2)
+    assert spm.values[SETPOINT + ".value"] == 0.2 and spm.writes == 1
+    assert cache.get(SETPOINT) == 0.2 and spm.reads == 0
+    cache.set(SETPOINT, 0.2) #Studio already has it.
+    assert spm.writes == 1 and cache.skipped_writes == 1
+    cache.set(SETPOINT, 0.2, force=True)
+    assert spm.writes == 2
+
+
+def test_invalidate():
+    spm = FakeSPM()
+    cache = PropertyCache(spm, max_age=60)
+    cache.get(SETPOINT)
+    cache.get(POS_X)
+    spm.values[SETPOINT + ".value"] = 0.5
+    cache.invalidate(SETPOINT)
+    assert cache.get(SETPOINT) == 0.5 and cache.get(POS_X) == 0.0 and spm.reads == 3
+    cache.invalidate()
+    assert cache.stats()["cached"] == 0
+    cache.get(POS_X)
+    assert spm.reads == 4
+
+
+def test_refresh_reports_the_changes():
+    spm = FakeSPM()
+    cache = PropertyCache(spm, max_age=60)
+    cache.get(SETPOINT)
+    cache.get(POS_X)
+    spm.values[POS_X + ".value"] = 1e-6
+    assert cache.refresh() == [POS_X]
+    assert cache.peek(POS_X) == 1e-6 and cache.stats()["refreshes"] == 1
+    assert cache.refresh(older_than=60) == [] and spm.reads == 4 #Nothing old enough.
+
+
+def test_peek_never_reads():
+    spm = FakeSPM(latency=0.05)
+    cache = PropertyCache(spm)
+    start = time.perf_counter()
+    assert cache.peek(POS_X) == 0.0 and cache.peek(POS_X, None) is None
+    assert time.perf_counter() - start < 0.05 and spm.reads == 0
+    cache.set(POS_X, 2e-6)
+    assert cache.peek(POS_X) == 2e-6 and spm.reads == 0
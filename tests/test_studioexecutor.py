@@ -0,0 +1,79 @@
+#Studio command executor: commands run in order on one thread, and waiting commands with the same key are replaced by the newest one.
+import threading
+import pytest
+from concurrent.futures import CancelledError
+from metrics import Metrics
+from studioexecutor import StudioExecutor
+
+
+def blocked_executor():
+    #The executor is busy with a command that waits for release, so the commands submitted next stay in the queue.
+    executor = StudioExecutor(metrics=Metrics())
+    started = threading.Event()
+    release = threading.Event()
+    def busy():
+        started.set()
+        release.wait(10)
+    executor.submit(busy)
+    assert started.wait(10)
+    return executor, release
+
+
+def test_moves_with_the_same_key_are_coalesced():
+    executor, release = blocked_executor()
+    done = []
+    moves = [executor.submit(done.append, (k, k), key="move") for k in range(10)]
+    other = executor.submit(done.append, "withdraw")
+    assert executor.queue_depth() == 2 and executor.coalesced == 9
+    release.set()
+    assert moves[-1].result(10) is None and other.result(10) is None
+    assert done == [(9, 9), "withdraw"] #The move keeps the place of the first one.
+    assert all(move.cancelled() for move in moves[:-1])
+    with pytest.raises(CancelledError):
+        moves[0].result()
+    executor.shutdown()
+    assert executor.submitted == 12 and executor.executed == 3
+
+
+def test_commands_without_key_all_run_in_order():
+    executor, release = blocked_executor()
+    done = []
+    futures = [executor.submit(done.append, k) for k in range(5)]
+    futures.append(executor.submit(done.append, 5, key="move"))
+    futures.append(executor.submit(done.append, 6, key="setpoint")) #Another key is not replaced.
+    release.set()
+    executor.shutdown()
+    assert done == list(range(7)) and executor.coalesced == 0
+    assert all(future.done() and not future.cancelled() for future in futures)
+
+
+def test_key_is_free_again_once_the_command_runs():
+    executor = StudioExecutor()
+    done = []
+    executor.submit(done.append, 1, key="move").result(10)
+    executor.submit(done.append, 2, key="move").result(10)
+    executor.shutdown()
+    assert done == [1, 2] and executor.coalesced == 0
+
+
+def test_errors_go_to_the_future():
+    executor = StudioExecutor(metrics=Metrics())
+    def fail():
+        raise RuntimeError("no Studio")
+    future = executor.submit(fail)
+    with pytest.raises(RuntimeError):
+        future.result(10)
+    assert executor.submit(lambda x: x*2, 21).result(10) == 42 #The thread keeps going.
+    executor.shutdown()
+    assert executor.failed == 1 and executor.running is None
+    assert executor.metrics.histogram("studio_command_seconds", command="fail").count == 1
+
+
+def test_shutdown_runs_what_is_waiting():
+    executor, release = blocked_executor()
+    done = []
+    executor.submit(done.append, "a")
+    executor.submit(done.append, "b")
+    threading.Timer(0.05, release.set).start()
+    executor.shutdown()
+    assert done == ["a", "b"] and not executor.thread.is_alive()